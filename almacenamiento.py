@@ -0,0 +1,1237 @@
+import abc
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import orjson
+except ImportError:  # se usa el módulo json estándar
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # sin pyarrow solo hay snapshots JSON
+    pa = None
+
+from consolidados import CAMPOS_VENTAS
+from metricas import medir
+
+# Archivo con la foto (snapshot) completa de los datos
+DATA_FILE = "balance_data.json"
+
+# Base de datos del almacenamiento SQLite
+DB_FILE = "balance_data.db"
+
+# Variables de entorno para elegir el almacenamiento
+ENV_ALMACEN = "BALANCE_ALMACEN"
+ENV_RUTA = "BALANCE_RUTA"
+
+# Directorio con un subdirectorio (y un almacenamiento propio) por tienda
+ENV_TIENDAS = "BALANCE_TIENDAS"
+
+# El diario crece hasta ser una fracción del snapshot antes de compactarse,
+# así el costo de compactar se reparte entre muchos guardados
+COMPACTAR_MIN_BYTES = 256 * 1024
+COMPACTAR_PROPORCION = 0.5
+
+# Versión del formato de los datos; MIGRACIONES lleva cada versión a la siguiente
+ESQUEMA_VERSION = 1
+
+# Los snapshots con esta extensión se guardan en Arrow IPC (binario, requiere pyarrow);
+# cualquier otra ruta usa JSON compacto
+EXTENSION_ARROW = ".arrow"
+MAGIA_ARROW = b"ARROW1"
+TABLAS_SNAPSHOT = ('ventas', 'gastos', 'tasas_cambio')
+
+# Días que nunca se archivan; cubren con holgura el rango por defecto de Ver Balance (30 días)
+DIAS_RECIENTES = 62
+
+# Totales por día que resumen cada partición archivada
+CAMPOS_RESUMEN = ('ventas_bs', 'ventas_usd', 'gastos_pagados_bs', 'gastos_pagados_usd',
+                  'gastos_pendientes_bs', 'gastos_pendientes_usd')
+
+
+def datos_vacios():
+    """Estructura de datos vacía"""
+    return {
+        "schema_version": ESQUEMA_VERSION,
+        "ventas": [],
+        "gastos": [],
+        "tasas_cambio": [],
+        "seq": 0,
+        "ultimo_id": {"ventas": 0, "gastos": 0}
+    }
+
+
+def ruta_diario(ruta=DATA_FILE):
+    """Ruta del diario de eventos asociado a un snapshot"""
+    return os.path.splitext(ruta)[0] + ".journal.jsonl"
+
+
+def ruta_bloqueo(ruta=DATA_FILE):
+    """Ruta del archivo de bloqueo; depende del nombre base, igual que el diario,
+    así un snapshot JSON y su conversión a Arrow se bloquean entre sí"""
+    return os.path.splitext(ruta)[0] + ".lock"
+
+
+def ruta_snapshot(ruta=DATA_FILE):
+    """Snapshot existente para `ruta`: la misma ruta o, si no existe, su versión en el otro formato
+
+    `convertir` cambia la extensión (JSON ↔ Arrow) y deja el original como .bak,
+    así que con la ruta por defecto se sigue encontrando el snapshot convertido.
+    """
+    if os.path.exists(ruta):
+        return ruta
+    base, extension = os.path.splitext(ruta)
+    alternativa = base + (".json" if extension == EXTENSION_ARROW else EXTENSION_ARROW)
+    return alternativa if os.path.exists(alternativa) else ruta
+
+
+def ruta_archivo(ruta=DATA_FILE):
+    """Ruta del índice de particiones anuales archivadas"""
+    return os.path.splitext(ruta)[0] + ".archivo.json"
+
+
+def _tamano_archivo(ruta):
+    """Tamaño en bytes, 0 si el archivo no existe"""
+    try:
+        return os.path.getsize(ruta)
+    except FileNotFoundError:
+        return 0
+
+
+def ruta_particion(ruta, anio):
+    """Ruta de la partición archivada de un año"""
+    return f"{os.path.splitext(ruta)[0]}.{anio}.json"
+
+
+def ruta_consolidados(ruta=DATA_FILE):
+    """Ruta de los totales consolidados de los meses cerrados"""
+    return os.path.splitext(ruta)[0] + ".consolidados.json"
+
+
+def _migrar_a_v1(datos):
+    """Registros anteriores al control de pagos y a los IDs"""
+    # Asegurar que todos los gastos tengan el campo 'pagado'
+    for gasto in datos['gastos']:
+        if 'pagado' not in gasto:
+            gasto['pagado'] = False  # Por defecto, gastos antiguos se consideran NO pagados
+        if 'fecha_pago' not in gasto and gasto['pagado']:
+            gasto['fecha_pago'] = gasto['fecha']  # Usar la fecha del gasto como fecha de pago
+
+    # Registros sin 'id' reciben IDs nuevos por encima de los existentes (nunca repetidos)
+    ultimo_id = datos['ultimo_id']
+    for tabla in ('ventas', 'gastos'):
+        ultimo = max([ultimo_id.get(tabla, 0)] + [r['id'] for r in datos[tabla] if 'id' in r])
+        for registro in datos[tabla]:
+            if 'id' not in registro:
+                ultimo += 1
+                registro['id'] = ultimo
+        ultimo_id[tabla] = ultimo
+
+
+# Migración que lleva los datos de la versión N (clave) a la N + 1; los datos sin
+# 'schema_version' son de la versión 0
+MIGRACIONES = {
+    0: _migrar_a_v1,
+}
+
+
+def migrar_datos(datos):
+    """Aplicar en orden las migraciones pendientes y devolver las versiones alcanzadas
+
+    Con los datos al día solo se revisa la versión, sin recorrer los registros.
+    """
+    datos.setdefault('ventas', [])
+    datos.setdefault('gastos', [])
+    datos.setdefault('tasas_cambio', [])
+    datos.setdefault('seq', 0)
+    datos.setdefault('ultimo_id', {})
+
+    version = datos.get('schema_version', 0)
+    if version > ESQUEMA_VERSION:
+        raise ValueError(f"Los datos son de la versión {version} del esquema y esta aplicación "
+                         f"solo conoce hasta la {ESQUEMA_VERSION}")
+    aplicadas = []
+    while version < ESQUEMA_VERSION:
+        MIGRACIONES[version](datos)
+        version += 1
+        datos['schema_version'] = version
+        aplicadas.append(version)
+    return aplicadas
+
+
+def indice_gastos(datos):
+    """Índice id → gasto (ante IDs repetidos gana el primero)"""
+    indice = {}
+    for gasto in datos['gastos']:
+        indice.setdefault(gasto['id'], gasto)
+    return indice
+
+
+# Eventos que marcan gastos como pagados
+EVENTOS_PAGO = ('gasto_pagado', 'gastos_pagados')
+
+
+def aplicar_evento(datos, evento, gastos_por_id=None):
+    """Aplicar un evento del diario sobre los datos en memoria
+
+    `gastos_por_id` (ver indice_gastos) evita recorrer los gastos al pagar.
+    """
+    tipo = evento['evento']
+    if tipo == 'venta_agregada':
+        datos['ventas'].append(evento['venta'])
+        datos['ultimo_id']['ventas'] = max(datos['ultimo_id']['ventas'], evento['venta']['id'])
+    elif tipo == 'gasto_agregado':
+        datos['gastos'].append(evento['gasto'])
+        if gastos_por_id is not None:
+            gastos_por_id.setdefault(evento['gasto']['id'], evento['gasto'])
+        datos['ultimo_id']['gastos'] = max(datos['ultimo_id']['gastos'], evento['gasto']['id'])
+    elif tipo == 'ventas_agregadas':
+        datos['ventas'].extend(evento['ventas'])
+        datos['ultimo_id']['ventas'] = max([datos['ultimo_id']['ventas']] + [v['id'] for v in evento['ventas']])
+    elif tipo == 'gastos_agregados':
+        datos['gastos'].extend(evento['gastos'])
+        if gastos_por_id is not None:
+            for gasto in evento['gastos']:
+                gastos_por_id.setdefault(gasto['id'], gasto)
+        datos['ultimo_id']['gastos'] = max([datos['ultimo_id']['gastos']] + [g['id'] for g in evento['gastos']])
+    elif tipo in EVENTOS_PAGO:
+        if gastos_por_id is None:
+            gastos_por_id = indice_gastos(datos)
+        for id_gasto in evento.get('ids', [evento.get('id')]):
+            gasto = gastos_por_id.get(id_gasto)
+            if gasto is not None:
+                gasto['pagado'] = True
+                gasto['fecha_pago'] = evento['fecha_pago']
+    elif tipo == 'tasa_agregada':
+        datos['tasas_cambio'].append(evento['tasa'])
+    else:
+        raise ValueError(f"Evento desconocido: {tipo}")
+
+    if 'seq' in evento:
+        datos['seq'] = evento['seq']
+
+
+def leer_diario(ruta=DATA_FILE):
+    """Leer los eventos del diario en orden de escritura"""
+    eventos = []
+    diario = ruta_diario(ruta)
+    if not os.path.exists(diario):
+        return eventos
+
+    with open(diario, 'rb') as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                eventos.append(json_desde_bytes(linea))
+            except json.JSONDecodeError:
+                # Última línea incompleta por un corte durante la escritura
+                break
+    return eventos
+
+
+def _resumen_particion(ventas_dia, gastos_dia, ultimo_pago):
+    """Totales por día, conteos por mes y totales por día de cada mes de una partición
+
+    `ventas_dia` da filas (fecha, *CAMPOS_VENTAS) y `gastos_dia` filas (fecha,
+    clasificacion, pagado, monto_bs, monto_usd, cantidad), el formato de los
+    consolidados; con 'meses' se consolidan los meses archivados sin cargar la partición.
+    """
+    por_dia, conteos, meses = {}, {}, {}
+
+    def contar(fecha, clave, cantidad):
+        mes = conteos.setdefault(fecha[:7], {'ventas': 0, 'gastos': 0, 'pagados': 0})
+        mes[clave] += cantidad
+
+    def del_mes(fecha):
+        return meses.setdefault(fecha[:7], {'ventas': [], 'gastos': []})
+
+    for fila in ventas_dia:
+        fecha, *_, total_bs, total_usd, cantidad = fila
+        totales = por_dia.setdefault(fecha, dict.fromkeys(CAMPOS_RESUMEN, 0.0))
+        totales['ventas_bs'] += total_bs
+        totales['ventas_usd'] += total_usd
+        contar(fecha, 'ventas', cantidad)
+        del_mes(fecha)['ventas'].append(list(fila))
+    for fecha, clasificacion, pagado, monto_bs, monto_usd, cantidad in gastos_dia:
+        campo = 'gastos_pagados' if pagado else 'gastos_pendientes'
+        totales = por_dia.setdefault(fecha, dict.fromkeys(CAMPOS_RESUMEN, 0.0))
+        totales[campo + '_bs'] += monto_bs
+        totales[campo + '_usd'] += monto_usd
+        contar(fecha, 'gastos', cantidad)
+        if pagado:
+            contar(fecha, 'pagados', cantidad)
+        del_mes(fecha)['gastos'].append([fecha, clasificacion, bool(pagado), monto_bs, monto_usd, cantidad])
+    return {'por_dia': por_dia, 'conteos': conteos, 'meses': meses, 'ultimo_pago': ultimo_pago}
+
+
+def resumir_particion(ventas, gastos):
+    """Resumen de una partición, para no tener que cargarla al iniciar"""
+    ventas_dia, gastos_dia = {}, {}
+    for v in ventas:
+        sumas = ventas_dia.setdefault(v['fecha'], [0.0] * len(CAMPOS_VENTAS))
+        for k, campo in enumerate(CAMPOS_VENTAS[:-1]):
+            sumas[k] += v.get(campo, 0.0)
+        sumas[-1] += 1
+    for g in gastos:
+        sumas = gastos_dia.setdefault((g['fecha'], g['clasificacion'], g['pagado']), [0.0, 0.0, 0])
+        sumas[0] += g['monto_bs']
+        sumas[1] += g['monto_usd']
+        sumas[2] += 1
+    return _resumen_particion(
+        ([fecha, *sumas] for fecha, sumas in sorted(ventas_dia.items())),
+        ([*clave, *sumas] for clave, sumas in sorted(gastos_dia.items())),
+        max((g.get('fecha_pago') or g['fecha'] for g in gastos if g['pagado']), default=None)
+    )
+
+
+def cargar_indice_archivo(ruta=DATA_FILE):
+    """Índice de particiones: generación, corte y resumen de cada año archivado"""
+    try:
+        return leer_json(ruta_archivo(ruta))
+    except FileNotFoundError:
+        return {'generacion': 0, 'hasta': None, 'particiones': {}, 'movidos': {}}
+
+
+def cargar_particion(ruta, anio):
+    """Ventas y gastos archivados de un año"""
+    archivo = ruta_particion(ruta, anio)
+    with medir('cargar_particion', bytes=_tamano_archivo(archivo)) as medicion:
+        particion = leer_json(archivo)
+        medicion['registros'] = len(particion['ventas']) + len(particion['gastos'])
+        return particion
+
+
+def _sin_repetidos(registros, ids):
+    """Registros cuyo ID no está en `ids` (que se actualiza con los agregados)"""
+    unicos = []
+    for registro in registros:
+        if registro['id'] not in ids:
+            ids.add(registro['id'])
+            unicos.append(registro)
+    return unicos
+
+
+def cargar_datos(ruta=DATA_FILE, archivo=True):
+    """Cargar el snapshot y reproducir el diario de eventos
+
+    Con `archivo=False` se omiten las particiones archivadas (solo los datos recientes).
+    Un snapshot de una versión anterior del esquema se migra solo en memoria.
+    """
+    return _cargar_datos(ruta, archivo)[0]
+
+
+def _cargar_datos(ruta, archivo):
+    """cargar_datos y las migraciones que hubo que aplicar al snapshot"""
+    # Se mide el total leído: snapshot, diario y particiones
+    with medir('cargar_datos', bytes=_tamano_archivo(ruta_diario(ruta))) as medicion:
+        if os.path.exists(ruta):
+            datos = leer_snapshot(ruta)
+            medicion['bytes'] += os.path.getsize(ruta)
+        else:
+            datos = datos_vacios()
+
+        migraciones = migrar_datos(datos)
+
+        # Los eventos ya incluidos en el snapshot se saltan (compactación interrumpida);
+        # el índice de gastos se arma solo si hay pagos que reproducir
+        gastos_por_id = None
+        for evento in leer_diario(ruta):
+            if evento.get('seq', 0) > datos['seq']:
+                if gastos_por_id is None and evento['evento'] in EVENTOS_PAGO:
+                    gastos_por_id = indice_gastos(datos)
+                aplicar_evento(datos, evento, gastos_por_id)
+
+        indice = cargar_indice_archivo(ruta)
+        if datos.get('archivo_generacion', 0) != indice['generacion']:
+            # Archivado interrumpido antes de reescribir el snapshot: lo movido ya está en las particiones
+            for tabla in ('ventas', 'gastos'):
+                movidos = set(indice['movidos'].get(tabla, ()))
+                datos[tabla] = [r for r in datos[tabla] if r['id'] not in movidos]
+            datos['archivo_generacion'] = indice['generacion']
+
+        if archivo:
+            ids = {tabla: {r['id'] for r in datos[tabla]} for tabla in ('ventas', 'gastos')}
+            for anio in sorted(indice['particiones']):
+                particion = cargar_particion(ruta, anio)
+                medicion['bytes'] += _tamano_archivo(ruta_particion(ruta, anio))
+                for tabla in ('ventas', 'gastos'):
+                    datos[tabla].extend(_sin_repetidos(particion[tabla], ids[tabla]))
+
+        medicion['registros'] = len(datos['ventas']) + len(datos['gastos'])
+        return datos, migraciones
+
+
+@contextmanager
+def bloqueo_archivo(ruta):
+    """Bloqueo exclusivo entre procesos sobre ruta_bloqueo(ruta) (advisory)"""
+    with open(ruta_bloqueo(ruta), 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _nativo(valor):
+    """Escalares de NumPy como tipos de Python (orjson no los serializa)"""
+    if hasattr(valor, 'item'):
+        return valor.item()
+    raise TypeError(f"Tipo no serializable en JSON: {type(valor).__name__}")
+
+
+def json_a_bytes(datos, legible=False):
+    """JSON en UTF-8, con orjson si está instalado; `legible` indenta con 2 espacios"""
+    if orjson is not None:
+        return orjson.dumps(datos, default=_nativo, option=orjson.OPT_INDENT_2 if legible else 0)
+    opciones = {'indent': 2} if legible else {'separators': (',', ':')}
+    return json.dumps(datos, ensure_ascii=False, default=_nativo, **opciones).encode('utf-8')
+
+
+def json_desde_bytes(contenido):
+    return orjson.loads(contenido) if orjson is not None else json.loads(contenido)
+
+
+def leer_json(ruta):
+    with open(ruta, 'rb') as f:
+        return json_desde_bytes(f.read())
+
+
+def _escribir_atomico(ruta, escribir):
+    """Llamar escribir(f) sobre un archivo temporal binario, hacer fsync y renombrarlo sobre `ruta`"""
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(ruta)), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            escribir(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def escribir_json(datos, ruta, legible=False):
+    """Escribir JSON de forma atómica (archivo temporal con fsync + rename)"""
+    contenido = json_a_bytes(datos, legible)
+    _escribir_atomico(ruta, lambda f: f.write(contenido))
+
+
+def _esquema_arrow(tabla):
+    """Tipo Arrow de los registros de una tabla (mismas columnas que en SQLite)"""
+    columnas = {'ventas': COLUMNAS_VENTAS, 'gastos': COLUMNAS_GASTOS, 'tasas_cambio': COLUMNAS_TASAS}[tabla]
+    tipos = {'id': pa.int64(), 'fecha': pa.string(), 'clasificacion': pa.string(),
+             'descripcion': pa.string(), 'pagado': pa.bool_(), 'fecha_pago': pa.string()}
+    campos = [(c, tipos.get(c, pa.float64())) for c in columnas]
+    # Claves fuera de las columnas conocidas, como JSON, para no perderlas al pasar por Arrow
+    return pa.struct(campos + [(COLUMNA_EXTRA, pa.string())])
+
+
+def _registros_arrow(tabla, registros):
+    """Registros con las claves desconocidas agrupadas en COLUMNA_EXTRA"""
+    conocidas = set(_esquema_arrow(tabla).names)
+    filas = []
+    for registro in registros:
+        extra = {clave: valor for clave, valor in registro.items() if clave not in conocidas}
+        filas.append({**registro, COLUMNA_EXTRA: json_a_bytes(extra).decode() if extra else None})
+    return filas
+
+
+def _registros_desde_arrow(filas):
+    for fila in filas:
+        extra = fila.pop(COLUMNA_EXTRA, None)
+        if extra:
+            fila.update(json_desde_bytes(extra.encode()))
+    return filas
+
+
+def escribir_arrow(datos, ruta):
+    """Snapshot binario: una fila con la lista de registros de cada tabla, comprimida con zstd
+
+    El resto de los campos (seq, ultimo_id, ...) va como JSON en los metadatos del esquema.
+    """
+    if pa is None:
+        raise RuntimeError(f"Los snapshots {EXTENSION_ARROW} requieren pyarrow")
+    columnas = []
+    for tabla in TABLAS_SNAPSHOT:
+        registros = pa.array(_registros_arrow(tabla, datos.get(tabla, [])), type=_esquema_arrow(tabla))
+        columnas.append(pa.ListArray.from_arrays(pa.array([0, len(registros)], pa.int32()), registros))
+    resto = {clave: valor for clave, valor in datos.items() if clave not in TABLAS_SNAPSHOT}
+    tabla = pa.Table.from_arrays(columnas, names=list(TABLAS_SNAPSHOT),
+                                 metadata={b'balance': json_a_bytes(resto)})
+    opciones = pa_ipc.IpcWriteOptions(compression='zstd')
+
+    def escribir(f):
+        with pa_ipc.new_file(f, tabla.schema, options=opciones) as escritor:
+            escritor.write_table(tabla)
+    _escribir_atomico(ruta, escribir)
+
+
+def leer_arrow(ruta):
+    if pa is None:
+        raise RuntimeError(f"El snapshot {ruta} es Arrow IPC y requiere pyarrow")
+    with pa.memory_map(ruta) as fuente:
+        # Las columnas apuntan al archivo mapeado: se convierten antes de cerrarlo
+        tabla = pa_ipc.open_file(fuente).read_all()
+        datos = json_desde_bytes(tabla.schema.metadata[b'balance'])
+        for nombre in TABLAS_SNAPSHOT:
+            datos[nombre] = _registros_desde_arrow(tabla.column(nombre).combine_chunks().flatten().to_pylist())
+    return datos
+
+
+def leer_snapshot(ruta):
+    """Snapshot JSON o Arrow; el formato se reconoce por el contenido, no por la extensión"""
+    with open(ruta, 'rb') as f:
+        if f.read(len(MAGIA_ARROW)) == MAGIA_ARROW:
+            return leer_arrow(ruta)
+        f.seek(0)
+        return json_desde_bytes(f.read())
+
+
+def escribir_snapshot(datos, ruta):
+    """Escribir el snapshot en Arrow si `ruta` termina en .arrow, si no en JSON compacto"""
+    if ruta.endswith(EXTENSION_ARROW):
+        escribir_arrow(datos, ruta)
+    else:
+        escribir_json(datos, ruta)
+
+
+def guardar_datos(datos, ruta=DATA_FILE):
+    """Guardar el snapshot completo (archivo temporal + rename atómico) y vaciar el diario
+
+    Lo guardado queda siempre en la versión actual del esquema.
+    """
+    with medir('guardar_datos', registros=len(datos['ventas']) + len(datos['gastos'])) as medicion:
+        migrar_datos(datos)
+        escribir_snapshot(datos, ruta)
+        medicion['bytes'] = os.path.getsize(ruta)
+
+    # El snapshot ya contiene todos los eventos, el diario puede vaciarse
+    open(ruta_diario(ruta), 'w', encoding='utf-8').close()
+
+
+def _descartar_linea_incompleta(f):
+    """Truncar el diario después de su último salto de línea
+
+    Una línea sin terminar es una escritura cortada que nunca se confirmó; si
+    se escribiera a continuación, el evento nuevo quedaría pegado a ella y
+    leer_diario lo descartaría.
+    """
+    fin = f.seek(0, os.SEEK_END)
+    posicion = fin
+    while posicion > 0:
+        inicio = max(0, posicion - 65536)
+        f.seek(inicio)
+        bloque = f.read(posicion - inicio)
+        if posicion == fin and bloque.endswith(b"\n"):
+            return
+        salto = bloque.rfind(b"\n")
+        if salto >= 0:
+            f.truncate(inicio + salto + 1)
+            return
+        posicion = inicio
+    if fin:
+        f.truncate(0)
+
+
+def agregar_al_diario(eventos, ruta=DATA_FILE):
+    """Agregar eventos al final del diario (un solo fsync) y devolver el tamaño del diario"""
+    lineas = b"".join(json_a_bytes(e) + b"\n" for e in eventos)
+    with medir('agregar_al_diario', bytes=len(lineas), registros=len(eventos)):
+        with open(ruta_diario(ruta), 'a+b') as f:
+            _descartar_linea_incompleta(f)
+            f.write(lineas)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+
+def compactar(ruta=DATA_FILE):
+    """Incorporar el diario al snapshot"""
+    guardar_datos(cargar_datos(ruta, archivo=False), ruta)
+
+
+def corte_reciente(hoy=None):
+    """Primer día del año que contiene los últimos DIAS_RECIENTES días ('AAAA-01-01')"""
+    inicio = (hoy or datetime.date.today()) - datetime.timedelta(days=DIAS_RECIENTES)
+    return f"{inicio.year:04d}-01-01"
+
+
+def _archivable(registro, corte, es_gasto):
+    """Registros que ya no cambian: anteriores al corte y, si son gastos, pagados antes del corte"""
+    if registro['fecha'] >= corte:
+        return False
+    return not es_gasto or (registro['pagado'] and (registro.get('fecha_pago') or registro['fecha']) < corte)
+
+
+def archivar(ruta=DATA_FILE, hasta=None):
+    """Mover a particiones anuales las ventas y los gastos pagados de los años anteriores a `hasta`
+
+    Por defecto `hasta` es el año de corte_reciente().
+    Los gastos pendientes se quedan en el snapshot aunque sean viejos. Devuelve
+    {año: cantidad de registros movidos}.
+    """
+    corte = f"{int(hasta):04d}-01-01" if hasta else corte_reciente()
+    with bloqueo_archivo(ruta):
+        datos = cargar_datos(ruta, archivo=False)
+        indice = cargar_indice_archivo(ruta)
+
+        movidos = {}
+        for tabla in ('ventas', 'gastos'):
+            quedan = []
+            for registro in datos[tabla]:
+                if _archivable(registro, corte, tabla == 'gastos'):
+                    anio = registro['fecha'][:4]
+                    movidos.setdefault(anio, {'ventas': [], 'gastos': []})[tabla].append(registro)
+                else:
+                    quedan.append(registro)
+            datos[tabla] = quedan
+
+        # Particiones e índice primero; si se corta antes de reescribir el snapshot,
+        # cargar_datos descarta del snapshot los IDs listados en 'movidos'
+        for anio, nuevos in movidos.items():
+            particion = (cargar_particion(ruta, anio) if anio in indice['particiones']
+                         else {'ventas': [], 'gastos': []})
+            for tabla in ('ventas', 'gastos'):
+                ids = {r['id'] for r in particion[tabla]}
+                particion[tabla].extend(_sin_repetidos(nuevos[tabla], ids))
+            escribir_json(particion, ruta_particion(ruta, anio))
+            indice['particiones'][anio] = resumir_particion(particion['ventas'], particion['gastos'])
+
+        indice['generacion'] += 1
+        indice['hasta'] = max(indice['hasta'] or corte, corte)
+        indice['movidos'] = {tabla: [r['id'] for n in movidos.values() for r in n[tabla]]
+                             for tabla in ('ventas', 'gastos')}
+        escribir_json(indice, ruta_archivo(ruta))
+
+        datos['archivo_generacion'] = indice['generacion']
+        guardar_datos(datos, ruta)
+
+    return {anio: len(n['ventas']) + len(n['gastos']) for anio, n in sorted(movidos.items())}
+
+
+def eliminar_archivo(ruta=DATA_FILE):
+    """Borrar las particiones archivadas y su índice"""
+    for anio in cargar_indice_archivo(ruta)['particiones']:
+        if os.path.exists(ruta_particion(ruta, anio)):
+            os.remove(ruta_particion(ruta, anio))
+    if os.path.exists(ruta_archivo(ruta)):
+        os.remove(ruta_archivo(ruta))
+
+
+class Almacen(abc.ABC):
+    """Interfaz común de los almacenamientos de datos"""
+
+    ruta = None
+
+    @contextmanager
+    def bloqueo(self):
+        """Bloqueo de escritura entre procesos; reentrante dentro del mismo almacén"""
+        if not hasattr(self, '_bloqueo_hilos'):
+            self._bloqueo_hilos = threading.RLock()
+            self._profundidad = 0
+        with self._bloqueo_hilos:
+            if self._profundidad:
+                self._profundidad += 1
+                try:
+                    yield
+                finally:
+                    self._profundidad -= 1
+                return
+            with bloqueo_archivo(self.ruta):
+                self._profundidad = 1
+                try:
+                    yield
+                finally:
+                    self._profundidad = 0
+
+    @abc.abstractmethod
+    def cargar(self):
+        """Cargar todos los datos"""
+
+    @abc.abstractmethod
+    def guardar(self, datos):
+        """Reemplazar todo el contenido almacenado"""
+
+    @abc.abstractmethod
+    def version(self):
+        """Marca barata que cambia cada vez que cambia el contenido almacenado"""
+
+    def eventos_desde(self, seq):
+        """Eventos escritos después de `seq`, o None si hay que recargar todo"""
+        return None
+
+    @abc.abstractmethod
+    def registrar(self, evento):
+        """Persistir un evento y devolverlo con su número de secuencia
+
+        Debe llamarse con el bloqueo tomado y después de ponerse al día con
+        eventos_desde, para no repetir números de secuencia.
+        """
+
+    def registrar_lote(self, eventos):
+        """Persistir varios eventos en orden; los almacenamientos los agrupan en una sola escritura"""
+        return [self.registrar(evento) for evento in eventos]
+
+    def cargar_reciente(self):
+        """Datos recientes e índice de particiones archivadas que se cargan a demanda
+
+        Devuelve (datos, particiones), con particiones {año: resumen} (ver
+        resumir_particion). Por defecto no hay nada archivado.
+        """
+        return self.cargar(), {}
+
+    @abc.abstractmethod
+    def cargar_particion(self, anio):
+        """Ventas y gastos archivados de un año ({'ventas': [...], 'gastos': [...]})"""
+
+    def cargar_consolidados(self):
+        """Totales consolidados de los meses cerrados ({'AAAA-MM': {...}})"""
+        return {}
+
+    def guardar_consolidados(self, meses):
+        """Guardar (reemplazando) los consolidados de los meses indicados"""
+
+
+class AlmacenJSON(Almacen):
+    """Snapshot con diario de eventos JSON; las consultas se hacen sobre el libro en memoria
+
+    El snapshot es JSON compacto, o Arrow IPC si la ruta termina en .arrow.
+    """
+
+    def __init__(self, ruta=DATA_FILE):
+        self.ruta = ruta_snapshot(ruta)
+        self.seq = 0
+
+    def _cargar(self, archivo):
+        datos, migraciones = _cargar_datos(self.ruta, archivo)
+        if migraciones:
+            # Guardar el snapshot migrado para que las próximas cargas no repitan las migraciones
+            with self.bloqueo():
+                compactar(self.ruta)
+        self.seq = datos['seq']
+        return datos
+
+    def cargar(self):
+        return self._cargar(archivo=True)
+
+    def guardar(self, datos):
+        # `datos` reemplaza todo, incluidas las particiones archivadas
+        datos = {clave: valor for clave, valor in datos.items() if clave != 'archivo_generacion'}
+        with self.bloqueo():
+            eliminar_archivo(self.ruta)
+            guardar_datos(datos, self.ruta)
+        self.seq = datos.get('seq', 0)
+
+    def cargar_reciente(self):
+        return self._cargar(archivo=False), cargar_indice_archivo(self.ruta)['particiones']
+
+    def cargar_particion(self, anio):
+        return cargar_particion(self.ruta, anio)
+
+    def version(self):
+        marcas = []
+        for archivo in (self.ruta, ruta_diario(self.ruta)):
+            try:
+                estado = os.stat(archivo)
+                marcas.append((estado.st_mtime_ns, estado.st_size))
+            except FileNotFoundError:
+                marcas.append(None)
+        return tuple(marcas)
+
+    def eventos_desde(self, seq):
+        eventos = [e for e in leer_diario(self.ruta) if e.get('seq', 0) > seq]
+        if not eventos or eventos[0]['seq'] != seq + 1:
+            # Otro proceso compactó el diario: los eventos ya están en el snapshot
+            return None
+        self.seq = eventos[-1]['seq']
+        return eventos
+
+    def cargar_consolidados(self):
+        try:
+            return leer_json(ruta_consolidados(self.ruta))
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Se reconstruyen desde el libro
+            return {}
+
+    def guardar_consolidados(self, meses):
+        with self.bloqueo():
+            consolidados = self.cargar_consolidados()
+            consolidados.update(meses)
+            escribir_json(consolidados, ruta_consolidados(self.ruta))
+
+    def registrar(self, evento):
+        return self.registrar_lote([evento])[0]
+
+    def registrar_lote(self, eventos):
+        with medir('registrar_lote', registros=len(eventos)):
+            for seq, evento in enumerate(eventos, self.seq + 1):
+                evento['seq'] = seq
+            tamano_diario = agregar_al_diario(eventos, self.ruta)
+            # Solo después de escribir: si falla, el próximo intento reutiliza los mismos números
+            self.seq += len(eventos)
+
+            # Compactación periódica para mantener acotado el tiempo de reproducción
+            if tamano_diario >= max(COMPACTAR_MIN_BYTES, _tamano_archivo(self.ruta) * COMPACTAR_PROPORCION):
+                try:
+                    compactar(self.ruta)
+                except OSError:
+                    # Los eventos ya están en el diario; se compacta en el próximo registro
+                    pass
+            return eventos
+
+
+# Columnas de cada tabla, en el orden de los registros JSON
+COLUMNAS_VENTAS = ['id', 'fecha', 'punto_venta_bs', 'dolar_cash_bs', 'venta_externa_bs',
+                   'bs_cash_bs', 'total_bs', 'total_usd', 'descripcion', 'tasa_cambio']
+COLUMNAS_GASTOS = ['id', 'fecha', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd',
+                   'tasa_cambio', 'pagado', 'fecha_pago']
+COLUMNAS_TASAS = ['fecha', 'tasa']
+# Campo de los snapshots Arrow con las claves que no tienen columna propia
+COLUMNA_EXTRA = '_extra'
+
+ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS ventas (
+    id INTEGER PRIMARY KEY,
+    fecha TEXT NOT NULL,
+    punto_venta_bs REAL NOT NULL DEFAULT 0,
+    dolar_cash_bs REAL NOT NULL DEFAULT 0,
+    venta_externa_bs REAL NOT NULL DEFAULT 0,
+    bs_cash_bs REAL NOT NULL DEFAULT 0,
+    total_bs REAL NOT NULL DEFAULT 0,
+    total_usd REAL NOT NULL DEFAULT 0,
+    descripcion TEXT,
+    tasa_cambio REAL
+);
+CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas (fecha);
+
+CREATE TABLE IF NOT EXISTS gastos (
+    id INTEGER PRIMARY KEY,
+    fecha TEXT NOT NULL,
+    clasificacion TEXT NOT NULL,
+    descripcion TEXT,
+    monto_bs REAL NOT NULL DEFAULT 0,
+    monto_usd REAL NOT NULL DEFAULT 0,
+    tasa_cambio REAL,
+    pagado INTEGER NOT NULL DEFAULT 0,
+    fecha_pago TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_gastos_fecha ON gastos (fecha, pagado);
+CREATE INDEX IF NOT EXISTS idx_gastos_pagado ON gastos (pagado, clasificacion);
+CREATE INDEX IF NOT EXISTS idx_gastos_clasificacion ON gastos (clasificacion, fecha);
+
+CREATE TABLE IF NOT EXISTS tasas_cambio (
+    orden INTEGER PRIMARY KEY AUTOINCREMENT,
+    fecha TEXT NOT NULL,
+    tasa REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasas_fecha ON tasas_cambio (fecha);
+
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS consolidados (
+    mes TEXT PRIMARY KEY,
+    datos TEXT NOT NULL
+);
+"""
+
+
+# Registros que ya no cambian (ver _archivable); se cargan a demanda por año
+FILTRO_VENTAS_FRIAS = "fecha < :corte"
+FILTRO_GASTOS_FRIOS = "fecha < :corte AND pagado = 1 AND COALESCE(fecha_pago, fecha) < :corte"
+
+
+def _fila_a_gasto(fila):
+    """Convertir una fila SQLite en un gasto con el formato JSON"""
+    gasto = dict(fila)
+    gasto['pagado'] = bool(gasto['pagado'])
+    return gasto
+
+
+class AlmacenSQLite(Almacen):
+    """Tablas SQLite indexadas por fecha, estado de pago y clasificación"""
+
+    def __init__(self, ruta=DB_FILE):
+        self.ruta = ruta
+        # Streamlit ejecuta cada rerun en un hilo distinto
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(ESQUEMA_SQLITE)
+        # Separa lo reciente de lo archivado; cargar_reciente lo vuelve a fijar en cada carga
+        self._corte = corte_reciente()
+
+    def _insertar(self, tabla, columnas, registros):
+        marcas = ", ".join("?" for _ in columnas)
+        self.conn.executemany(
+            f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({marcas})",
+            ([r.get(c) for c in columnas] for r in registros)
+        )
+
+    def _guardar_meta(self, clave, valor):
+        self.conn.execute(
+            "INSERT INTO meta (clave, valor) VALUES (?, ?) "
+            "ON CONFLICT (clave) DO UPDATE SET valor = excluded.valor",
+            (clave, valor)
+        )
+
+    def _guardar_ultimo_id(self, tabla, id_registro):
+        """Avanzar el contador de IDs de una tabla (nunca retrocede)"""
+        self.conn.execute(
+            "INSERT INTO meta (clave, valor) VALUES (?, ?) "
+            "ON CONFLICT (clave) DO UPDATE SET valor = MAX(valor, excluded.valor)",
+            (f'ultimo_id_{tabla}', id_registro)
+        )
+
+    def _filas(self, tabla, filtro="1", parametros=()):
+        filas = self.conn.execute(f"SELECT * FROM {tabla} WHERE {filtro} ORDER BY id", parametros)
+        if tabla == 'gastos':
+            return [_fila_a_gasto(f) for f in filas]
+        return [dict(f) for f in filas]
+
+    def cargar(self):
+        return self._cargar()
+
+    def _cargar(self, filtro_ventas="1", filtro_gastos="1", parametros=()):
+        datos = datos_vacios()
+        with medir('cargar_datos') as medicion:
+            datos['ventas'] = self._filas('ventas', filtro_ventas, parametros)
+            datos['gastos'] = self._filas('gastos', filtro_gastos, parametros)
+            medicion['registros'] = len(datos['ventas']) + len(datos['gastos'])
+        datos['tasas_cambio'] = [dict(f) for f in self.conn.execute(
+            "SELECT fecha, tasa FROM tasas_cambio ORDER BY orden")]
+        meta = {f['clave']: f['valor'] for f in self.conn.execute("SELECT clave, valor FROM meta")}
+        datos['seq'] = meta.get('seq', 0)
+        for tabla in ('ventas', 'gastos'):
+            # Bases anteriores al contador: se parte del mayor ID (clave primaria, O(log n))
+            maximo = self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabla}").fetchone()[0]
+            datos['ultimo_id'][tabla] = max(meta.get(f'ultimo_id_{tabla}', 0), maximo)
+        return datos
+
+    def cargar_reciente(self):
+        # El corte queda fijo para que las particiones cargadas después no se solapen con lo reciente
+        self._corte = corte_reciente()
+        parametros = {'corte': self._corte}
+        datos = self._cargar(f"NOT ({FILTRO_VENTAS_FRIAS})", f"NOT ({FILTRO_GASTOS_FRIOS})", parametros)
+
+        # Resumen de lo archivado con GROUP BY, sin traer las filas a Python
+        ventas_dia, gastos_dia = {}, {}
+        sumas = ", ".join(f"SUM({c})" for c in CAMPOS_VENTAS[:-1])
+        for fila in self.conn.execute(
+                f"SELECT fecha, {sumas}, COUNT(*) FROM ventas "
+                f"WHERE {FILTRO_VENTAS_FRIAS} GROUP BY fecha ORDER BY fecha", parametros):
+            ventas_dia.setdefault(fila[0][:4], []).append(tuple(fila))
+        for fila in self.conn.execute(
+                "SELECT fecha, clasificacion, pagado, SUM(monto_bs), SUM(monto_usd), COUNT(*) FROM gastos "
+                f"WHERE {FILTRO_GASTOS_FRIOS} GROUP BY fecha, clasificacion, pagado ORDER BY fecha", parametros):
+            gastos_dia.setdefault(fila[0][:4], []).append(tuple(fila))
+        ultimos_pagos = dict(self.conn.execute(
+            "SELECT substr(fecha, 1, 4), MAX(COALESCE(fecha_pago, fecha)) FROM gastos "
+            f"WHERE {FILTRO_GASTOS_FRIOS} GROUP BY 1", parametros).fetchall())
+
+        particiones = {
+            anio: _resumen_particion(ventas_dia.get(anio, []), gastos_dia.get(anio, []), ultimos_pagos.get(anio))
+            for anio in ventas_dia.keys() | gastos_dia.keys()
+        }
+        return datos, particiones
+
+    def cargar_particion(self, anio):
+        parametros = {'corte': self._corte, 'desde': f"{anio}-01-01", 'hasta': f"{anio}-12-31"}
+        return {
+            'ventas': self._filas('ventas', f"{FILTRO_VENTAS_FRIAS} AND fecha BETWEEN :desde AND :hasta",
+                                  parametros),
+            'gastos': self._filas('gastos', f"{FILTRO_GASTOS_FRIOS} AND fecha BETWEEN :desde AND :hasta",
+                                  parametros)
+        }
+
+    def version(self):
+        fila = self.conn.execute("SELECT valor FROM meta WHERE clave = 'seq'").fetchone()
+        return fila['valor'] if fila else 0
+
+    def cargar_consolidados(self):
+        return {f['mes']: json.loads(f['datos']) for f in self.conn.execute("SELECT mes, datos FROM consolidados")}
+
+    def guardar_consolidados(self, meses):
+        with self.bloqueo(), self.conn:
+            self.conn.executemany(
+                "INSERT INTO consolidados (mes, datos) VALUES (?, ?) "
+                "ON CONFLICT (mes) DO UPDATE SET datos = excluded.datos",
+                ((mes, json.dumps(datos, separators=(',', ':'))) for mes, datos in meses.items())
+            )
+
+    def esta_vacio(self):
+        """Indica si no hay ningún registro almacenado"""
+        for tabla in ('ventas', 'gastos', 'tasas_cambio'):
+            if self.conn.execute(f"SELECT 1 FROM {tabla} LIMIT 1").fetchone():
+                return False
+        return True
+
+    def guardar(self, datos):
+        with self.bloqueo(), self.conn:
+            self.conn.execute("DELETE FROM ventas")
+            self.conn.execute("DELETE FROM gastos")
+            self.conn.execute("DELETE FROM tasas_cambio")
+            self._insertar('ventas', COLUMNAS_VENTAS, datos['ventas'])
+            self._insertar('gastos', COLUMNAS_GASTOS, datos['gastos'])
+            self._insertar('tasas_cambio', COLUMNAS_TASAS, datos['tasas_cambio'])
+            self._guardar_meta('seq', datos.get('seq', 0))
+            for tabla, ultimo in datos.get('ultimo_id', {}).items():
+                self._guardar_ultimo_id(tabla, ultimo)
+
+    def registrar(self, evento):
+        return self.registrar_lote([evento])[0]
+
+    def registrar_lote(self, eventos):
+        with medir('registrar_lote', registros=len(eventos)), self.conn:
+            fila = self.conn.execute("SELECT valor FROM meta WHERE clave = 'seq'").fetchone()
+            seq = fila['valor'] if fila else 0
+            for evento in eventos:
+                seq += 1
+                evento['seq'] = seq
+                self._escribir_evento(evento)
+            self._guardar_meta('seq', seq)
+        return eventos
+
+    def _escribir_evento(self, evento):
+        """Aplicar un evento a las tablas (dentro de la transacción de registrar_lote)"""
+        tipo = evento['evento']
+        if tipo == 'venta_agregada':
+            self._insertar('ventas', COLUMNAS_VENTAS, [evento['venta']])
+            self._guardar_ultimo_id('ventas', evento['venta']['id'])
+        elif tipo == 'gasto_agregado':
+            self._insertar('gastos', COLUMNAS_GASTOS, [evento['gasto']])
+            self._guardar_ultimo_id('gastos', evento['gasto']['id'])
+        elif tipo in ('ventas_agregadas', 'gastos_agregados'):
+            tabla = 'ventas' if tipo == 'ventas_agregadas' else 'gastos'
+            self._insertar(tabla, COLUMNAS_VENTAS if tabla == 'ventas' else COLUMNAS_GASTOS, evento[tabla])
+            self._guardar_ultimo_id(tabla, max(r['id'] for r in evento[tabla]))
+        elif tipo == 'gasto_pagado':
+            self.conn.execute(
+                "UPDATE gastos SET pagado = 1, fecha_pago = ? WHERE id = ?",
+                (evento['fecha_pago'], evento['id'])
+            )
+        elif tipo == 'gastos_pagados':
+            self.conn.executemany(
+                "UPDATE gastos SET pagado = 1, fecha_pago = ? WHERE id = ?",
+                [(evento['fecha_pago'], id_gasto) for id_gasto in evento['ids']]
+            )
+        elif tipo == 'tasa_agregada':
+            self._insertar('tasas_cambio', COLUMNAS_TASAS, [evento['tasa']])
+        else:
+            raise ValueError(f"Evento desconocido: {tipo}")
+
+    # Consultas directas a las tablas (usan los índices), para scripts sin libro en memoria
+
+    def ventas_entre(self, fecha_inicio, fecha_fin):
+        filas = self.conn.execute(
+            "SELECT * FROM ventas WHERE fecha BETWEEN ? AND ? ORDER BY fecha, id",
+            (fecha_inicio, fecha_fin)
+        )
+        return [dict(f) for f in filas]
+
+    def gastos_entre(self, fecha_inicio, fecha_fin, pagado=None):
+        consulta = "SELECT * FROM gastos WHERE fecha BETWEEN ? AND ?"
+        parametros = [fecha_inicio, fecha_fin]
+        if pagado is not None:
+            consulta += " AND pagado = ?"
+            parametros.append(int(pagado))
+        filas = self.conn.execute(consulta + " ORDER BY fecha, id", parametros)
+        return [_fila_a_gasto(f) for f in filas]
+
+    def gastos_pendientes(self, clasificacion=None):
+        consulta = "SELECT * FROM gastos WHERE pagado = 0"
+        parametros = []
+        if clasificacion is not None:
+            consulta += " AND clasificacion = ?"
+            parametros.append(clasificacion)
+        filas = self.conn.execute(consulta + " ORDER BY fecha, id", parametros)
+        return [_fila_a_gasto(f) for f in filas]
+
+
+def directorio_tiendas(directorio=None):
+    """Directorio de las tiendas (BALANCE_TIENDAS), o None si hay un solo almacenamiento"""
+    return directorio or os.environ.get(ENV_TIENDAS)
+
+
+def listar_tiendas(directorio=None):
+    """Nombres de las tiendas, uno por subdirectorio, en orden alfabético"""
+    directorio = directorio_tiendas(directorio)
+    if not directorio or not os.path.isdir(directorio):
+        return []
+    return sorted(nombre for nombre in os.listdir(directorio)
+                  if os.path.isdir(os.path.join(directorio, nombre)) and not nombre.startswith('.'))
+
+
+def ruta_tienda(tienda, tipo="json", directorio=None):
+    """Ruta del almacenamiento de una tienda (lo crea el primer guardado)"""
+    directorio = directorio_tiendas(directorio)
+    if not directorio:
+        raise ValueError(f"Define {ENV_TIENDAS} para usar varias tiendas")
+    tienda = tienda.strip()
+    if not tienda or tienda.startswith('.') or os.sep in tienda or (os.altsep and os.altsep in tienda):
+        raise ValueError(f"Nombre de tienda inválido: '{tienda}'")
+    return os.path.join(directorio, tienda, DB_FILE if tipo == "sqlite" else DATA_FILE)
+
+
+def crear_almacen(tipo=None, ruta=None, tienda=None):
+    """Crear el almacenamiento configurado (por defecto JSON), o el de una tienda"""
+    tipo = tipo or os.environ.get(ENV_ALMACEN, "json")
+    if tienda is not None:
+        ruta = ruta_tienda(tienda, tipo)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    ruta = ruta or os.environ.get(ENV_RUTA)
+
+    if tipo == "json":
+        return AlmacenJSON(ruta or DATA_FILE)
+    if tipo == "sqlite":
+        return AlmacenSQLite(ruta or DB_FILE)
+    raise ValueError(f"Almacenamiento desconocido: {tipo}")
+
+
+def _ids_unicos(registros):
+    """Renumerar IDs repetidos para que puedan ser clave primaria"""
+    usados = set()
+    siguiente = max((r['id'] for r in registros), default=0) + 1
+    renumerados = 0
+    for registro in registros:
+        if registro['id'] in usados:
+            registro['id'] = siguiente
+            siguiente += 1
+            renumerados += 1
+        usados.add(registro['id'])
+    return renumerados
+
+
+def migrar_json_a_sqlite(ruta_json=DATA_FILE, ruta_db=DB_FILE):
+    """Copiar los datos de balance_data.json (y su diario) a SQLite, una sola vez"""
+    destino = AlmacenSQLite(ruta_db)
+    if not destino.esta_vacio():
+        raise ValueError(f"La base de datos {ruta_db} ya contiene datos")
+
+    datos = cargar_datos(ruta_json)
+    renumerados = _ids_unicos(datos['ventas']) + _ids_unicos(datos['gastos'])
+    for tabla in ('ventas', 'gastos'):
+        datos['ultimo_id'][tabla] = max([datos['ultimo_id'][tabla]] + [r['id'] for r in datos[tabla]])
+    destino.guardar(datos)
+
+    return {
+        'ventas': len(datos['ventas']),
+        'gastos': len(datos['gastos']),
+        'tasas_cambio': len(datos['tasas_cambio']),
+        'ids_renumerados': renumerados
+    }
+
+
+def convertir_snapshot(origen=DATA_FILE, destino=None):
+    """Reescribir el snapshot en el formato de `destino` (.arrow o .json) y dejar el original como .bak
+
+    Ambas rutas deben compartir el nombre base, porque el diario, las
+    particiones y los consolidados se ubican a partir de él.
+    """
+    destino = destino or os.path.splitext(origen)[0] + EXTENSION_ARROW
+    if os.path.splitext(origen)[0] != os.path.splitext(destino)[0]:
+        raise ValueError(f"{origen} y {destino} deben tener el mismo nombre base")
+    if os.path.abspath(origen) == os.path.abspath(destino):
+        raise ValueError("El destino debe tener otra extensión")
+    # Mismo nombre base, mismo bloqueo: cubre a los procesos que usan cualquiera de los dos
+    with bloqueo_archivo(origen):
+        if os.path.exists(destino):
+            # Reescribirlo desde el origen (o solo desde el diario) perdería lo que tiene
+            raise ValueError(f"{destino} ya existe")
+        datos = cargar_datos(origen, archivo=False)
+        guardar_datos(datos, destino)
+        if os.path.exists(origen):
+            os.replace(origen, origen + ".bak")
+    return os.path.getsize(destino)
+
+
+def exportar_legible(salida, tipo=None, ruta=None):
+    """Exportar todos los datos (incluido lo archivado) como JSON indentado, para leer o respaldar"""
+    datos = crear_almacen(tipo, ruta).cargar()
+    datos.pop('archivo_generacion', None)
+    escribir_json(datos, salida, legible=True)
+    return datos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Herramientas de almacenamiento del balance")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    migrar = subparsers.add_parser("migrar", help="Migrar balance_data.json a SQLite")
+    migrar.add_argument("--json", default=DATA_FILE)
+    migrar.add_argument("--db", default=DB_FILE)
+
+    archivar_parser = subparsers.add_parser(
+        "archivar", help="Mover los años cerrados de balance_data.json a particiones anuales")
+    archivar_parser.add_argument("--json", default=DATA_FILE)
+    archivar_parser.add_argument("--hasta", type=int, default=None,
+                                 help="primer año que se mantiene en el snapshot (por defecto el año reciente)")
+
+    convertir = subparsers.add_parser(
+        "convertir", help="Cambiar el formato del snapshot (JSON ↔ Arrow) según la extensión del destino")
+    convertir.add_argument("--desde", default=DATA_FILE)
+    convertir.add_argument("--hacia", default=None, help="por defecto el mismo nombre con extensión .arrow")
+
+    exportar = subparsers.add_parser("exportar", help="Exportar los datos a JSON legible")
+    exportar.add_argument("--almacen", choices=["json", "sqlite"], default=None)
+    exportar.add_argument("--ruta", default=None)
+    exportar.add_argument("--salida", default="balance_exportado.json")
+
+    args = parser.parse_args()
+    if args.comando == "migrar":
+        try:
+            resultado = migrar_json_a_sqlite(ruta_snapshot(args.json), args.db)
+        except ValueError as e:
+            parser.exit(1, f"Error: {e}\n")
+        print(f"Migrados: {resultado['ventas']} ventas, {resultado['gastos']} gastos, "
+              f"{resultado['tasas_cambio']} tasas ({resultado['ids_renumerados']} IDs renumerados)")
+    elif args.comando == "archivar":
+        args.json = ruta_snapshot(args.json)
+        movidos = archivar(args.json, args.hasta)
+        if not movidos:
+            print("No hay registros para archivar")
+        for anio, cantidad in movidos.items():
+            print(f"{anio}: {cantidad} registros archivados en {ruta_particion(args.json, anio)}")
+    elif args.comando == "convertir":
+        try:
+            tamano = convertir_snapshot(args.desde, args.hacia)
+        except ValueError as e:
+            parser.exit(1, f"Error: {e}\n")
+        destino = args.hacia or os.path.splitext(args.desde)[0] + EXTENSION_ARROW
+        print(f"Snapshot convertido: {destino} ({tamano / 1e6:.1f} MB); original en {args.desde}.bak "
+              f"(la app lo encuentra con la misma configuración)")
+    elif args.comando == "exportar":
+        datos = exportar_legible(args.salida, args.almacen, args.ruta)
+        print(f"Exportados: {len(datos['ventas'])} ventas, {len(datos['gastos'])} gastos, "
+              f"{len(datos['tasas_cambio'])} tasas en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
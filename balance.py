@@ -2,9 +2,16 @@ import streamlit as st
 import pandas as pd
 import datetime
 from datetime import date
-import json
 import os
 
+import contabilidad
+import importacion
+import metricas
+import tiendas
+from almacenamiento import crear_almacen, directorio_tiendas, listar_tiendas
+from compartido import LibroCompartido
+from libro import CacheConsultas
+
 # Configuración de la página
 st.set_page_config(
     page_title="Balance Diario Acumulativo",
@@ -12,82 +19,170 @@ st.set_page_config(
     layout="wide"
 )
 
-# Archivo para guardar los datos
-DATA_FILE = "balance_data.json"
+# Paginación de las listas de gastos pendientes
+TAMANOS_PAGINA = [10, 20, 50, 100]
+ORDENES_PENDIENTES = {"Fecha": 'fecha', "Monto": 'monto_bs', "Clasificación": 'clasificacion', "ID": 'id'}
 
-def cargar_datos():
-    """Cargar datos desde el archivo JSON"""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            datos = json.load(f)
-            
-            # Asegurar que todos los gastos tengan el campo 'pagado' y 'id'
-            for i, gasto in enumerate(datos.get('gastos', [])):
-                if 'pagado' not in gasto:
-                    gasto['pagado'] = False  # Por defecto, gastos antiguos se consideran NO pagados
-                if 'fecha_pago' not in gasto and gasto['pagado']:
-                    gasto['fecha_pago'] = gasto['fecha']  # Usar la fecha del gasto como fecha de pago
-                if 'id' not in gasto:
-                    gasto['id'] = i + 1  # Asignar ID automáticamente
-            
-            # Asegurar que todas las ventas tengan 'id'
-            for i, venta in enumerate(datos.get('ventas', [])):
-                if 'id' not in venta:
-                    venta['id'] = i + 1
-            
-            return datos
-    return {
-        "ventas": [],
-        "gastos": [],
-        "tasas_cambio": []
-    }
-
-def guardar_datos(datos):
-    """Guardar datos en el archivo JSON"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(datos, f, ensure_ascii=False, indent=2)
+# Máximo de filas editables en el pago en lote
+LIMITE_LOTE = 500
+
+# Opciones del resumen por clasificación (cubo de gastos)
+PERIODOS_CUBO = {"Día": 'dia', "Semana": 'semana', "Mes": 'mes'}
+VALORES_CUBO = {"Bolívares": 'monto_bs', "Dólares": 'monto_usd', "Cantidad": 'cantidad'}
+ESTADOS_CUBO = {"Todos": None, "Pagados": True, "Pendientes": False}
+
+# Valores de la tabla de antigüedad de los pendientes
+VALORES_ANTIGUEDAD = {"Bolívares": 'monto_bs', "Dólares (tasa actual)": 'monto_usd', "Cantidad": 'cantidad'}
+
+# Recalcular los agregados desde cero en cada visita al inicio y compararlos
+VERIFICAR_AGREGADOS = os.environ.get("BALANCE_VERIFICAR_AGREGADOS") == "1"
+
+# Segundos entre guardados en segundo plano; sin definir, cada registro se guarda antes de responder
+ESCRITURA_DIFERIDA = os.environ.get("BALANCE_ESCRITURA_DIFERIDA")
+
+# Registro rotativo de métricas (JSONL, resumible con metricas.py) y panel de diagnóstico abierto por defecto
+REGISTRO_METRICAS = os.environ.get("BALANCE_METRICAS")
+DIAGNOSTICO = os.environ.get("BALANCE_DIAGNOSTICO") == "1"
+
+# Con BALANCE_TIENDAS cada tienda tiene su propio almacenamiento y hay un balance consolidado
+DIRECTORIO_TIENDAS = directorio_tiendas()
+
+@st.cache_resource
+def libros_abiertos():
+    """Libros de tienda que el proceso ya cargó ({tienda: LibroCompartido})"""
+    return {}
+
+@st.cache_resource
+def resumenes_tiendas():
+    """Resúmenes de las tiendas leídas desde disco, por versión del almacenamiento y período"""
+    return CacheConsultas()
+
+@st.cache_resource
+def libro_de_tienda(tienda=None):
+    """Libro único del proceso para una tienda (o el almacenamiento único), compartido por todas las sesiones"""
+    intervalo = float(ESCRITURA_DIFERIDA) if ESCRITURA_DIFERIDA else None
+    compartido = LibroCompartido(crear_almacen(tienda=tienda), intervalo_escritura=intervalo)
+    if tienda is not None:
+        libros_abiertos()[tienda] = compartido
+    return compartido
+
+def libro_compartido():
+    """Libro de la tienda con la que trabaja la sesión"""
+    return libro_de_tienda(st.session_state.get('tienda'))
+
+def crear_tienda():
+    """Crear el almacenamiento de una tienda nueva y pasar a trabajar con ella"""
+    nombre = st.session_state.nueva_tienda.strip()
+    try:
+        libro_de_tienda(nombre)
+    except ValueError as error:
+        st.session_state.error_tienda = str(error)
+        return
+    st.session_state.tienda = nombre
+    st.session_state.nueva_tienda = ""
+
+def seleccionar_tienda():
+    """Selector de tienda en la barra lateral; detiene la página si todavía no hay ninguna"""
+    nombres = listar_tiendas()
+    if nombres:
+        st.sidebar.selectbox("🏪 Tienda", nombres, key="tienda")
+    with st.sidebar.expander("➕ Nueva tienda", expanded=not nombres):
+        st.text_input("Nombre de la tienda", key="nueva_tienda")
+        st.button("Crear tienda", on_click=crear_tienda)
+        if 'error_tienda' in st.session_state:
+            st.error(st.session_state.pop('error_tienda'))
+    if not nombres:
+        st.info(f"No hay tiendas en {DIRECTORIO_TIENDAS}. Crea la primera desde la barra lateral.")
+        st.stop()
 
 def inicializar_session_state():
     """Inicializar variables de session state"""
-    if 'datos' not in st.session_state:
-        st.session_state.datos = cargar_datos()
+    # La sesión solo guarda una referencia al libro compartido (recargado si el archivo cambió)
+    st.session_state.libro = libro_compartido().obtener()
+    st.session_state.reruns = st.session_state.get('reruns', 0) + 1
+
+def registrar_evento(evento):
+    """Persistir un evento (asignando el ID de los registros nuevos) y aplicarlo al libro compartido"""
+    libro_compartido().registrar(evento)
 
 # Clasificación de gastos
-CLASIFICACION_GASTOS = [
-    "Gastos administrativos",
-    "Gastos Mantenimiento", 
-    "Gastos Nómina",
-    "Gastos Venta",
-    "Gastos x Compras Materia Prima"
-]
+CLASIFICACION_GASTOS = contabilidad.CLASIFICACION_GASTOS
 
 def main():
     st.title("💰 Balance Diario Acumulativo")
     st.markdown("Sistema para llevar el control acumulativo de ventas y gastos diarios")
     
+    metricas.configurar_registro(REGISTRO_METRICAS)
+    metricas.contar('reruns')
+    if DIRECTORIO_TIENDAS:
+        seleccionar_tienda()
     inicializar_session_state()
     
     # Sidebar para navegación
     st.sidebar.title("Navegación")
-    opcion = st.sidebar.radio(
-        "Selecciona una opción:",
-        ["🏠 Inicio", "💵 Registrar Ventas", "💳 Registrar Gastos", "📊 Ver Balance", "⚙️ Configurar Tasa", "💰 Gestión de Pagos", "📋 Gastos Pendientes"]
-    )
-    
-    if opcion == "🏠 Inicio":
-        mostrar_inicio()
-    elif opcion == "💵 Registrar Ventas":
-        registrar_ventas()
-    elif opcion == "💳 Registrar Gastos":
-        registrar_gastos()
-    elif opcion == "📊 Ver Balance":
-        ver_balance()
-    elif opcion == "⚙️ Configurar Tasa":
-        configurar_tasa()
-    elif opcion == "💰 Gestión de Pagos":
-        gestion_pagos()
-    elif opcion == "📋 Gastos Pendientes":
-        ver_gastos_pendientes()
+    opciones = ["🏠 Inicio", "💵 Registrar Ventas", "💳 Registrar Gastos", "📊 Ver Balance", "⚙️ Configurar Tasa", "💰 Gestión de Pagos", "📋 Gastos Pendientes", "📥 Importar"]
+    if DIRECTORIO_TIENDAS:
+        opciones.append("🏬 Consolidado")
+    opcion = st.sidebar.radio("Selecciona una opción:", opciones)
+    mostrar_estado_guardado()
+    
+    # Cada página se mide con el tamaño del libro cargado, para separar regresiones por página y volumen
+    registros = len(st.session_state.libro.ventas) + len(st.session_state.libro.gastos)
+    with metricas.medir(f"pagina {opcion}", registros=registros):
+        if opcion == "🏠 Inicio":
+            mostrar_inicio()
+        elif opcion == "💵 Registrar Ventas":
+            registrar_ventas()
+        elif opcion == "💳 Registrar Gastos":
+            registrar_gastos()
+        elif opcion == "📊 Ver Balance":
+            ver_balance()
+        elif opcion == "⚙️ Configurar Tasa":
+            configurar_tasa()
+        elif opcion == "💰 Gestión de Pagos":
+            gestion_pagos()
+        elif opcion == "📋 Gastos Pendientes":
+            ver_gastos_pendientes()
+        elif opcion == "📥 Importar":
+            importar_archivo()
+        elif opcion == "🏬 Consolidado":
+            ver_consolidado()
+    
+    mostrar_diagnostico()
+
+def mostrar_estado_guardado():
+    """Durabilidad de lo registrado, en la barra lateral"""
+    estado = libro_compartido().estado_escritura()
+    if not estado['diferida']:
+        st.sidebar.caption("💾 Cada registro se guarda al momento")
+    elif estado['error']:
+        st.sidebar.error(f"⚠️ Error al guardar: {estado['error']}")
+    elif estado['pendientes']:
+        st.sidebar.warning(f"⏳ {estado['pendientes']} cambio(s) por guardar")
+    elif estado['ultimo_guardado']:
+        st.sidebar.success(f"💾 Todo guardado ({estado['ultimo_guardado']:%H:%M:%S})")
+    else:
+        st.sidebar.success("💾 Todo guardado")
+
+def mostrar_diagnostico():
+    """Panel opcional con p50/p95 de las rutas calientes y contadores del proceso"""
+    if not st.sidebar.checkbox("🩺 Diagnóstico", value=DIAGNOSTICO):
+        return
+    
+    libro = st.session_state.libro
+    contadores = metricas.contadores()
+    with st.sidebar.expander("Tiempos (ms)", expanded=True):
+        st.dataframe(metricas.resumen(), use_container_width=True, hide_index=True)
+        st.caption(f"Reruns: {contadores.get('reruns', 0):,} en el proceso, "
+                   f"{st.session_state.reruns:,} en esta sesión")
+        st.caption(f"Registros cargados: {len(libro.ventas):,} ventas y {len(libro.gastos):,} gastos")
+        consultas = libro.consultas.estadisticas()
+        st.caption(f"Caché de consultas: {consultas['aciertos']:,} aciertos y {consultas['fallos']:,} fallos "
+                   f"({consultas['tasa_aciertos']:.0%}), {consultas['entradas']} guardadas")
+        if REGISTRO_METRICAS:
+            st.caption(f"Registro de métricas: {REGISTRO_METRICAS}")
+        else:
+            st.caption("Define BALANCE_METRICAS para guardar las mediciones en un registro rotativo")
 
 def mostrar_inicio():
     """Pantalla de inicio con resumen del día y acumulado"""
@@ -101,18 +196,15 @@ def mostrar_inicio():
     
     # ===== RESUMEN DEL DÍA ACTUAL =====
     st.subheader("📅 Resumen del Día de Hoy")
-    hoy = date.today().isoformat()
-    
-    ventas_hoy = [v for v in st.session_state.datos['ventas'] if v['fecha'] == hoy]
-    gastos_hoy = [g for g in st.session_state.datos['gastos'] if g['fecha'] == hoy]
-    gastos_pagados_hoy = [g for g in gastos_hoy if g.get('pagado', False)]
+    # Dólares a la tasa vigente hoy (puede haber tasas registradas a futuro)
+    totales_hoy = contabilidad.resumen_dia(st.session_state.libro, date.today())
     
-    total_ventas_hoy_bs = sum(v['total_bs'] for v in ventas_hoy)
-    total_ventas_hoy_usd = total_ventas_hoy_bs / tasa_actual if tasa_actual else 0
-    total_gastos_hoy_bs = sum(g['monto_bs'] for g in gastos_pagados_hoy)
-    total_gastos_hoy_usd = total_gastos_hoy_bs / tasa_actual if tasa_actual else 0
-    balance_hoy_bs = total_ventas_hoy_bs - total_gastos_hoy_bs
-    balance_hoy_usd = total_ventas_hoy_usd - total_gastos_hoy_usd
+    total_ventas_hoy_bs = totales_hoy['ventas_bs']
+    total_ventas_hoy_usd = totales_hoy['ventas_usd']
+    total_gastos_hoy_bs = totales_hoy['gastos_pagados_bs']
+    total_gastos_hoy_usd = totales_hoy['gastos_pagados_usd']
+    balance_hoy_bs = totales_hoy['balance_bs']
+    balance_hoy_usd = totales_hoy['balance_usd']
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -130,32 +222,24 @@ def mostrar_inicio():
     
     with col4:
         # Gastos pendientes de hoy
-        gastos_pendientes_hoy = [g for g in gastos_hoy if not g.get('pagado', False)]
-        total_gastos_pendientes_hoy_bs = sum(g['monto_bs'] for g in gastos_pendientes_hoy)
-        total_gastos_pendientes_hoy_usd = total_gastos_pendientes_hoy_bs / tasa_actual if tasa_actual else 0
+        total_gastos_pendientes_hoy_bs = totales_hoy['gastos_pendientes_bs']
+        total_gastos_pendientes_hoy_usd = totales_hoy['gastos_pendientes_usd']
         st.metric("⏳ Gastos Pendientes Hoy (Bs)", f"Bs. {total_gastos_pendientes_hoy_bs:,.2f}")
         st.metric("⏳ Gastos Pendientes Hoy ($)", f"$ {total_gastos_pendientes_hoy_usd:,.2f}")
     
     # ===== RESUMEN ACUMULADO =====
     st.subheader("📈 Resumen Acumulado (Todos los tiempos)")
     
-    # Calcular totales acumulativos (todos los registros)
-    total_ventas_bs = sum(v['total_bs'] for v in st.session_state.datos['ventas'])
-    total_ventas_usd = sum(v['total_usd'] for v in st.session_state.datos['ventas'])
-    
-    # Solo gastos pagados afectan el balance
-    gastos_pagados = [g for g in st.session_state.datos['gastos'] if g.get('pagado', False)]
-    total_gastos_pagados_bs = sum(g['monto_bs'] for g in gastos_pagados)
-    total_gastos_pagados_usd = sum(g['monto_usd'] for g in gastos_pagados)
-    
-    # Gastos pendientes
-    gastos_pendientes = [g for g in st.session_state.datos['gastos'] if not g.get('pagado', False)]
-    total_gastos_pendientes_bs = sum(g['monto_bs'] for g in gastos_pendientes)
-    total_gastos_pendientes_usd = sum(g['monto_usd'] for g in gastos_pendientes)
-    
-    # Balance actual (ventas - gastos pagados)
-    balance_actual_bs = total_ventas_bs - total_gastos_pagados_bs
-    balance_actual_usd = total_ventas_usd - total_gastos_pagados_usd
+    # Calcular totales acumulativos (todos los registros, solo gastos pagados afectan el balance)
+    totales = contabilidad.resumen_acumulado(st.session_state.libro)
+    total_ventas_bs = totales['ventas_bs']
+    total_ventas_usd = totales['ventas_usd']
+    total_gastos_pagados_bs = totales['gastos_pagados_bs']
+    total_gastos_pagados_usd = totales['gastos_pagados_usd']
+    total_gastos_pendientes_bs = totales['gastos_pendientes_bs']
+    total_gastos_pendientes_usd = totales['gastos_pendientes_usd']
+    balance_actual_bs = totales['balance_bs']
+    balance_actual_usd = totales['balance_usd']
     
     # Mostrar métricas acumuladas
     col1, col2, col3, col4 = st.columns(4)
@@ -175,28 +259,40 @@ def mostrar_inicio():
     with col4:
         st.metric("⚖️ Balance Actual (Bs)", f"Bs. {balance_actual_bs:,.2f}")
         st.metric("⚖️ Balance Actual ($)", f"$ {balance_actual_usd:,.2f}")
+    
+    if VERIFICAR_AGREGADOS:
+        diferencias = st.session_state.libro.verificar_agregados()
+        if diferencias:
+            st.error(f"❌ Los agregados no coinciden con el recálculo ({len(diferencias)} diferencias)")
+            st.dataframe(pd.DataFrame(diferencias, columns=['periodo', 'campo', 'agregado', 'recalculado']),
+                         use_container_width=True)
+        else:
+            st.caption("✅ Agregados verificados contra el recálculo completo")
 
+@metricas.medido()
 def obtener_tasa_actual():
     """Obtener la tasa de cambio más reciente"""
-    if st.session_state.datos['tasas_cambio']:
-        return max(st.session_state.datos['tasas_cambio'], 
-                  key=lambda x: x['fecha'])['tasa']
-    return None
+    return contabilidad.tasa_actual(st.session_state.libro)
+
+def mostrar_tasa_registro(fecha):
+    """Tasa con la que se convertirá un registro de esa fecha (la vigente en la fecha, no la de hoy)"""
+    tasa = contabilidad.tasa_registro(st.session_state.libro, fecha)
+    if not tasa:
+        st.warning("⚠️ No hay tasa de cambio configurada. Ve a 'Configurar Tasa' primero.")
+    elif tasa != obtener_tasa_actual():
+        st.info(f"Tasa de cambio del {fecha}: {tasa:,.2f} Bs/$ (actual: {obtener_tasa_actual():,.2f} Bs/$)")
+    else:
+        st.info(f"Tasa de cambio: {tasa:,.2f} Bs/$")
 
 def registrar_ventas():
     """Registrar nuevas ventas"""
     st.header("💵 Registrar Ventas")
     
-    # Obtener tasa actual
-    tasa_actual = obtener_tasa_actual()
-    if tasa_actual:
-        st.info(f"Tasa de cambio actual: {tasa_actual:,.2f} Bs/$")
-    else:
-        st.warning("⚠️ No hay tasa de cambio configurada. Ve a 'Configurar Tasa' primero.")
+    # La fecha va fuera del formulario para mostrar la tasa que le corresponde antes de guardar
+    fecha = st.date_input("Fecha", value=datetime.date.today(), key="fecha_venta")
+    mostrar_tasa_registro(fecha)
     
     with st.form("form_ventas"):
-        fecha = st.date_input("Fecha", value=datetime.date.today())
-        
         col1, col2 = st.columns(2)
         
         with col1:
@@ -212,30 +308,20 @@ def registrar_ventas():
         submitted = st.form_submit_button("💾 Guardar Venta")
         
         if submitted:
-            if tasa_actual is None:
-                st.error("Debes configurar una tasa de cambio primero")
+            try:
+                nueva_venta = contabilidad.construir_venta(
+                    st.session_state.libro, fecha, punto_venta, dolar_cash, venta_externa, bs_cash, descripcion
+                )
+            except ValueError as error:
+                st.error(str(error))
                 return
-                
-            total_bs = punto_venta + dolar_cash + venta_externa + bs_cash
-            total_usd = total_bs / tasa_actual
             
-            nueva_venta = {
-                'fecha': fecha.isoformat(),
-                'punto_venta_bs': punto_venta,
-                'dolar_cash_bs': dolar_cash,
-                'venta_externa_bs': venta_externa,
-                'bs_cash_bs': bs_cash,
-                'total_bs': total_bs,
-                'total_usd': total_usd,
-                'descripcion': descripcion,
-                'tasa_cambio': tasa_actual,
-                'id': len(st.session_state.datos['ventas']) + 1
-            }
+            total_bs = nueva_venta['total_bs']
+            total_usd = nueva_venta['total_usd']
+            registrar_evento({'evento': 'venta_agregada', 'venta': nueva_venta})
             
-            st.session_state.datos['ventas'].append(nueva_venta)
-            guardar_datos(st.session_state.datos)
-            
-            st.success(f"✅ Venta registrada exitosamente! Total: Bs. {total_bs:,.2f} (${total_usd:,.2f})")
+            st.success(f"✅ Venta registrada exitosamente! Total: Bs. {total_bs:,.2f} (${total_usd:,.2f} "
+                       f"a {nueva_venta['tasa_cambio']:,.2f} Bs/$)")
             
             # Mostrar resumen
             st.subheader("Resumen de la Venta")
@@ -251,24 +337,21 @@ def registrar_ventas():
             
             with col2:
                 st.write("**En Dólares:**")
-                st.write(f"Punto de venta: $ {punto_venta/tasa_actual:,.2f}")
-                st.write(f"$ Cash: $ {dolar_cash/tasa_actual:,.2f}")
-                st.write(f"Venta externa: $ {venta_externa/tasa_actual:,.2f}")
-                st.write(f"Bs. Cash: $ {bs_cash/tasa_actual:,.2f}")
+                en_usd = contabilidad.desglose_usd(nueva_venta)
+                st.write(f"Punto de venta: $ {en_usd['punto_venta_bs']:,.2f}")
+                st.write(f"$ Cash: $ {en_usd['dolar_cash_bs']:,.2f}")
+                st.write(f"Venta externa: $ {en_usd['venta_externa_bs']:,.2f}")
+                st.write(f"Bs. Cash: $ {en_usd['bs_cash_bs']:,.2f}")
                 st.write(f"**Total: $ {total_usd:,.2f}**")
 
 def registrar_gastos():
     """Registrar nuevos gastos"""
     st.header("💳 Registrar Gastos")
     
-    tasa_actual = obtener_tasa_actual()
-    if tasa_actual:
-        st.info(f"Tasa de cambio actual: {tasa_actual:,.2f} Bs/$")
-    else:
-        st.warning("⚠️ No hay tasa de cambio configurada. Ve a 'Configurar Tasa' primero.")
+    fecha = st.date_input("Fecha", value=datetime.date.today(), key="fecha_gasto")
+    mostrar_tasa_registro(fecha)
     
     with st.form("form_gastos"):
-        fecha = st.date_input("Fecha", value=datetime.date.today())
         clasificacion = st.selectbox("Clasificación del Gasto", CLASIFICACION_GASTOS)
         descripcion = st.text_input("Descripción del Gasto")
         monto_bs = st.number_input("Monto en Bolívares", min_value=0.0, value=0.0, step=10.0)
@@ -277,30 +360,20 @@ def registrar_gastos():
         submitted = st.form_submit_button("💾 Guardar Gasto")
         
         if submitted:
-            if tasa_actual is None:
-                st.error("Debes configurar una tasa de cambio primero")
+            try:
+                nuevo_gasto = contabilidad.construir_gasto(
+                    st.session_state.libro, fecha, clasificacion, descripcion, monto_bs, pagado
+                )
+            except ValueError as error:
+                st.error(str(error))
                 return
-                
-            monto_usd = monto_bs / tasa_actual
-            fecha_pago = fecha.isoformat() if pagado else None
             
-            nuevo_gasto = {
-                'fecha': fecha.isoformat(),
-                'clasificacion': clasificacion,
-                'descripcion': descripcion,
-                'monto_bs': monto_bs,
-                'monto_usd': monto_usd,
-                'tasa_cambio': tasa_actual,
-                'pagado': pagado,
-                'fecha_pago': fecha_pago,
-                'id': len(st.session_state.datos['gastos']) + 1
-            }
-            
-            st.session_state.datos['gastos'].append(nuevo_gasto)
-            guardar_datos(st.session_state.datos)
+            monto_usd = nuevo_gasto['monto_usd']
+            registrar_evento({'evento': 'gasto_agregado', 'gasto': nuevo_gasto})
             
             estado = "pagado" if pagado else "pendiente"
-            st.success(f"✅ Gasto registrado exitosamente! Monto: Bs. {monto_bs:,.2f} (${monto_usd:,.2f}) - Estado: {estado}")
+            st.success(f"✅ Gasto registrado exitosamente! Monto: Bs. {monto_bs:,.2f} (${monto_usd:,.2f} "
+                       f"a {nuevo_gasto['tasa_cambio']:,.2f} Bs/$) - Estado: {estado}")
 
 def ver_balance():
     """Mostrar balance con filtros por fecha"""
@@ -317,30 +390,20 @@ def ver_balance():
     with col2:
         fecha_fin = st.date_input("Fecha fin", value=datetime.date.today())
     
-    # Convertir a string para comparación
-    fecha_inicio_str = fecha_inicio.isoformat()
-    fecha_fin_str = fecha_fin.isoformat()
-    
-    # Filtrar datos
-    ventas_filtradas = [v for v in st.session_state.datos['ventas'] 
-                       if fecha_inicio_str <= v['fecha'] <= fecha_fin_str]
-    gastos_filtrados = [g for g in st.session_state.datos['gastos'] 
-                       if fecha_inicio_str <= g['fecha'] <= fecha_fin_str]
-    
-    # Separar gastos pagados y pendientes
-    gastos_pagados = [g for g in gastos_filtrados if g.get('pagado', False)]
-    gastos_pendientes = [g for g in gastos_filtrados if not g.get('pagado', False)]
+    libro = st.session_state.libro
+    detalle = contabilidad.detalle_periodo(libro, fecha_inicio, fecha_fin)
     
     # Métricas principales (solo gastos pagados afectan el balance)
-    total_ventas_bs = sum(v['total_bs'] for v in ventas_filtradas)
-    total_ventas_usd = sum(v['total_usd'] for v in ventas_filtradas)
-    total_gastos_pagados_bs = sum(g['monto_bs'] for g in gastos_pagados)
-    total_gastos_pagados_usd = sum(g['monto_usd'] for g in gastos_pagados)
-    total_gastos_pendientes_bs = sum(g['monto_bs'] for g in gastos_pendientes)
-    total_gastos_pendientes_usd = sum(g['monto_usd'] for g in gastos_pendientes)
+    totales = contabilidad.resumen_periodo(libro, fecha_inicio, fecha_fin)
+    total_ventas_bs = totales['ventas_bs']
+    total_ventas_usd = totales['ventas_usd']
+    total_gastos_pagados_bs = totales['gastos_pagados_bs']
+    total_gastos_pagados_usd = totales['gastos_pagados_usd']
+    total_gastos_pendientes_bs = totales['gastos_pendientes_bs']
+    total_gastos_pendientes_usd = totales['gastos_pendientes_usd']
     
-    balance_bs = total_ventas_bs - total_gastos_pagados_bs
-    balance_usd = total_ventas_usd - total_gastos_pagados_usd
+    balance_bs = totales['balance_bs']
+    balance_usd = totales['balance_usd']
     
     # Mostrar métricas
     st.subheader(f"📈 Balance del Período: {fecha_inicio} al {fecha_fin}")
@@ -367,79 +430,119 @@ def ver_balance():
     tab1, tab2, tab3, tab4 = st.tabs(["📈 Detalle Ventas", "✅ Gastos Pagados", "⏳ Gastos Pendientes", "📋 Resumen por Clasificación"])
     
     with tab1:
-        if ventas_filtradas:
-            df_ventas = pd.DataFrame(ventas_filtradas)
-            columnas_mostrar = ['fecha', 'punto_venta_bs', 'dolar_cash_bs', 'venta_externa_bs', 'bs_cash_bs', 'total_bs', 'total_usd']
-            if 'descripcion' in df_ventas.columns:
-                columnas_mostrar.append('descripcion')
+        if not detalle.ventas.empty:
+            st.subheader("Ventas por Canal")
+            canales = contabilidad.ventas_por_canal(libro, fecha_inicio, fecha_fin)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Punto de venta", f"Bs. {canales['punto_venta_bs']:,.2f}")
+            col2.metric("$ Cash", f"Bs. {canales['dolar_cash_bs']:,.2f}")
+            col3.metric("Venta externa", f"Bs. {canales['venta_externa_bs']:,.2f}")
+            col4.metric("Bs. Cash", f"Bs. {canales['bs_cash_bs']:,.2f}")
             
-            df_ventas_display = df_ventas[columnas_mostrar]
             st.subheader("Detalle de Ventas")
-            st.dataframe(df_ventas_display, use_container_width=True)
+            st.dataframe(detalle.ventas, use_container_width=True)
         else:
             st.info("No hay ventas registradas en el período seleccionado")
     
     with tab2:
-        if gastos_pagados:
-            df_gastos_pagados = pd.DataFrame(gastos_pagados)
-            columnas_disponibles = []
-            for col in ['fecha', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd', 'fecha_pago']:
-                if col in df_gastos_pagados.columns:
-                    columnas_disponibles.append(col)
-            
-            df_gastos_pagados_display = df_gastos_pagados[columnas_disponibles]
+        if not detalle.gastos_pagados.empty:
             st.subheader("Gastos Pagados")
-            st.dataframe(df_gastos_pagados_display, use_container_width=True)
+            st.dataframe(detalle.gastos_pagados, use_container_width=True)
         else:
             st.info("No hay gastos pagados en el período seleccionado")
     
     with tab3:
-        if gastos_pendientes:
-            df_gastos_pendientes = pd.DataFrame(gastos_pendientes)
-            columnas_disponibles = []
-            for col in ['fecha', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd']:
-                if col in df_gastos_pendientes.columns:
-                    columnas_disponibles.append(col)
-            
-            df_gastos_pendientes_display = df_gastos_pendientes[columnas_disponibles]
+        if not detalle.gastos_pendientes.empty:
             st.subheader("Gastos Pendientes de Pago")
-            st.dataframe(df_gastos_pendientes_display, use_container_width=True)
+            st.dataframe(detalle.gastos_pendientes, use_container_width=True)
         else:
             st.info("No hay gastos pendientes en el período seleccionado")
     
     with tab4:
-        if gastos_filtrados:
-            df_gastos_clasif = pd.DataFrame(gastos_filtrados)
-            
-            # Calcular resumen por clasificación
-            resumen_data = []
-            for clasificacion in df_gastos_clasif['clasificacion'].unique():
-                gastos_clasif = df_gastos_clasif[df_gastos_clasif['clasificacion'] == clasificacion]
-                total_bs = gastos_clasif['monto_bs'].sum()
-                total_usd = gastos_clasif['monto_usd'].sum()
-                
-                # Contar gastos pagados y pendientes
-                if 'pagado' in gastos_clasif.columns:
-                    pagados = gastos_clasif['pagado'].sum()
-                    pendientes = len(gastos_clasif) - pagados
-                else:
-                    pagados = 0
-                    pendientes = len(gastos_clasif)
-                
-                resumen_data.append({
-                    'clasificacion': clasificacion,
-                    'monto_bs': total_bs,
-                    'monto_usd': total_usd,
-                    'pagados': pagados,
-                    'pendientes': pendientes
-                })
-            
-            resumen_clasif = pd.DataFrame(resumen_data)
+        resumen_clasif = contabilidad.resumen_por_clasificacion(libro, fecha_inicio, fecha_fin)
+        if not resumen_clasif.empty:
             st.subheader("Gastos por Clasificación")
             st.dataframe(resumen_clasif, use_container_width=True)
+            
+            # Cortes del cubo de gastos: no recorren los gastos individuales
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                periodo = st.selectbox("Agrupar por", list(PERIODOS_CUBO), index=2, key="cubo_periodo")
+            with col2:
+                moneda = st.selectbox("Moneda", list(VALORES_CUBO), key="cubo_valor")
+            with col3:
+                estado = st.selectbox("Estado", list(ESTADOS_CUBO), key="cubo_estado")
+            
+            st.subheader(f"Gastos por {periodo.lower()} y clasificación")
+            matriz = contabilidad.matriz_clasificacion(
+                libro, fecha_inicio, fecha_fin, PERIODOS_CUBO[periodo], VALORES_CUBO[moneda], ESTADOS_CUBO[estado]
+            )
+            st.dataframe(matriz, use_container_width=True)
+            st.line_chart(matriz)
+            
+            st.subheader("Tendencia de pagados y pendientes")
+            st.bar_chart(contabilidad.tendencia_gastos(
+                libro, fecha_inicio, fecha_fin, PERIODOS_CUBO[periodo], VALORES_CUBO[moneda]
+            ))
         else:
             st.info("No hay gastos para mostrar el resumen por clasificación")
 
+def ver_consolidado():
+    """Balance de todas las tiendas: el resumen de cada una se calcula en paralelo y se suma
+
+    Solo se usan los libros que alguna sesión ya abrió; las demás tiendas se leen
+    desde disco en otros procesos y no quedan cargadas en este.
+    """
+    st.header("🏬 Balance Consolidado")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        fecha_inicio = st.date_input("Fecha inicio", value=datetime.date.today() - datetime.timedelta(days=30))
+    with col2:
+        fecha_fin = st.date_input("Fecha fin", value=datetime.date.today())
+    
+    consolidado = tiendas.consolidar(dict(libros_abiertos()), fecha_inicio, fecha_fin, cache=resumenes_tiendas())
+    for nombre, error in consolidado.errores.items():
+        st.error(f"⚠️ No se pudo leer la tienda {nombre}: {error}")
+    
+    totales = consolidado.total.totales
+    st.subheader(f"📈 {len(consolidado.tiendas)} tienda(s): {fecha_inicio} al {fecha_fin}")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("💰 Ventas (Bs)", f"Bs. {totales['ventas_bs']:,.2f}")
+        st.metric("💰 Ventas ($)", f"$ {totales['ventas_usd']:,.2f}")
+    with col2:
+        st.metric("💳 Gastos Pagados (Bs)", f"Bs. {totales['gastos_pagados_bs']:,.2f}")
+        st.metric("💳 Gastos Pagados ($)", f"$ {totales['gastos_pagados_usd']:,.2f}")
+    with col3:
+        st.metric("⏳ Gastos Pendientes (Bs)", f"Bs. {totales['gastos_pendientes_bs']:,.2f}")
+        st.metric("⏳ Gastos Pendientes ($)", f"$ {totales['gastos_pendientes_usd']:,.2f}")
+    with col4:
+        st.metric("⚖️ Balance (Bs)", f"Bs. {totales['balance_bs']:,.2f}")
+        st.metric("⚖️ Balance ($)", f"$ {totales['balance_usd']:,.2f}")
+    
+    tab1, tab2, tab3 = st.tabs(["🏪 Por Tienda", "📈 Ventas por Canal", "📋 Gastos por Clasificación"])
+    
+    with tab1:
+        por_tienda = consolidado.tabla()
+        st.dataframe(por_tienda, use_container_width=True, hide_index=True)
+        if not por_tienda.empty:
+            st.bar_chart(por_tienda.set_index('tienda')[['ventas_usd', 'gastos_pagados_usd', 'balance_usd']])
+    
+    with tab2:
+        canales = consolidado.total.canales
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Punto de venta", f"Bs. {canales['punto_venta_bs']:,.2f}")
+        col2.metric("$ Cash", f"Bs. {canales['dolar_cash_bs']:,.2f}")
+        col3.metric("Venta externa", f"Bs. {canales['venta_externa_bs']:,.2f}")
+        col4.metric("Bs. Cash", f"Bs. {canales['bs_cash_bs']:,.2f}")
+    
+    with tab3:
+        if not consolidado.total.clasificacion.empty:
+            st.dataframe(consolidado.total.clasificacion, use_container_width=True, hide_index=True)
+        else:
+            st.info("No hay gastos en el período seleccionado")
+
 def configurar_tasa():
     """Configurar tasa de cambio"""
     st.header("⚙️ Configurar Tasa de Cambio")
@@ -465,35 +568,200 @@ def configurar_tasa():
                 'tasa': nueva_tasa
             }
             
-            st.session_state.datos['tasas_cambio'].append(nueva_tasa_info)
-            guardar_datos(st.session_state.datos)
+            registrar_evento({'evento': 'tasa_agregada', 'tasa': nueva_tasa_info})
             
             st.success(f"✅ Tasa de cambio guardada: {nueva_tasa:,.2f} Bs/$")
     
     # Historial de tasas
-    if st.session_state.datos['tasas_cambio']:
+    if st.session_state.libro.tasas_cambio:
         st.subheader("Historial de Tasas")
-        df_tasas = pd.DataFrame(st.session_state.datos['tasas_cambio'])
+        df_tasas = pd.DataFrame(st.session_state.libro.tasas_cambio)
         df_tasas['fecha'] = pd.to_datetime(df_tasas['fecha'])
         df_tasas = df_tasas.sort_values('fecha', ascending=False)
         st.dataframe(df_tasas, use_container_width=True)
 
+def importar_archivo():
+    """Importar ventas o gastos en bloque desde un CSV o XLSX (cierre del punto de venta o exporte del banco)"""
+    st.header("📥 Importar Ventas o Gastos")
+    
+    if not obtener_tasa_actual():
+        st.warning("⚠️ No hay tasa de cambio configurada. Ve a 'Configurar Tasa' primero.")
+        return
+    
+    tipo = st.radio("Tipo de registros", ["ventas", "gastos"], horizontal=True, format_func=str.capitalize)
+    archivo = st.file_uploader("Archivo CSV o XLSX", type=["csv", "xlsx"])
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        decimal = st.selectbox("Separador decimal", [".", ","])
+    with col2:
+        separador = st.selectbox("Separador de columnas (CSV)", [",", ";", "\t"],
+                                 format_func=lambda s: "Tabulador" if s == "\t" else s)
+    with col3:
+        formato_fecha = st.text_input("Formato de fecha (opcional)", placeholder="%d/%m/%Y")
+    
+    opciones = importacion.OpcionesImportacion(decimal=decimal, separador=separador,
+                                               formato_fecha=formato_fecha or None)
+    if tipo == "gastos":
+        col1, col2 = st.columns(2)
+        with col1:
+            opciones.clasificacion = st.selectbox("Clasificación si el archivo no trae una",
+                                                  [None] + CLASIFICACION_GASTOS,
+                                                  format_func=lambda c: "Ninguna (la fila es inválida)" if c is None else c)
+        with col2:
+            opciones.pagado = st.checkbox("Marcar como pagados si el archivo no lo indica", value=False)
+    
+    with st.expander("Columnas del archivo"):
+        st.caption("Se reconocen los encabezados habituales (fecha, descripción, referencia, monto, débito...). "
+                   "Indica aquí el encabezado de los campos que tengan otro nombre.")
+        for campo in importacion.CAMPOS[tipo]:
+            encabezado = st.text_input(campo, key=f"columna_importacion_{tipo}_{campo}")
+            if encabezado:
+                opciones.columnas[campo] = encabezado
+    
+    simular = st.checkbox("Solo validar (no registrar nada)", value=False)
+    
+    if archivo is None or not st.button("📥 Importar", type="primary"):
+        return
+    
+    progreso = st.empty()
+    
+    def al_avanzar(resultado):
+        progreso.info(f"⏳ {resultado.leidas:,} filas leídas, {resultado.importadas:,} importadas "
+                      f"({resultado.filas_por_segundo:,.0f} filas/s)")
+    
+    try:
+        resultado = importacion.importar(libro_compartido(), archivo, tipo, opciones, simular, al_avanzar)
+    except ValueError as error:
+        progreso.empty()
+        st.error(str(error))
+        return
+    
+    progreso.empty()
+    st.session_state.libro = libro_compartido().obtener()
+    accion = "validadas" if simular else "importadas"
+    st.success(f"✅ {resultado.importadas:,} de {resultado.leidas:,} filas {accion} en {resultado.segundos:.1f}s")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Leídas", f"{resultado.leidas:,}")
+    col2.metric(accion.capitalize(), f"{resultado.importadas:,}")
+    col3.metric("Repetidas", f"{resultado.repetidas:,}")
+    col4.metric("Inválidas", f"{resultado.invalidas:,}")
+    
+    if resultado.errores:
+        st.subheader("Filas inválidas")
+        if resultado.invalidas > len(resultado.errores):
+            st.caption(f"Se muestran las primeras {len(resultado.errores)} de {resultado.invalidas:,}")
+        st.dataframe(pd.DataFrame(resultado.errores), use_container_width=True, hide_index=True)
+
+def pagar_gasto(gasto_id):
+    """Marcar un gasto como pagado por su ID y recargar la página"""
+    try:
+        registrar_evento({
+            'evento': 'gasto_pagado',
+            'id': gasto_id,
+            'fecha_pago': date.today().isoformat()
+        })
+    except ValueError as e:
+        # Otro usuario pudo haberlo pagado mientras tanto
+        st.warning(f"⚠️ {e}")
+        return
+    st.success("✅ Gasto marcado como pagado")
+    st.rerun()
+
+def pagar_en_lote(prefijo):
+    """Pagar de una sola vez varios gastos pendientes, con filtros"""
+    libro = st.session_state.libro
+    
+    with st.expander("💸 Pago en lote"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            clasificaciones = st.multiselect("Clasificación", libro.clasificaciones, key=f"{prefijo}_lote_clasificacion")
+        with col2:
+            fecha_inicio = st.date_input("Desde", value=None, key=f"{prefijo}_lote_desde")
+        with col3:
+            fecha_fin = st.date_input("Hasta", value=None, key=f"{prefijo}_lote_hasta")
+        
+        pendientes, total = libro.pagina_pendientes(clasificaciones or None, fecha_inicio, fecha_fin,
+                                                    tamano=LIMITE_LOTE)
+        if pendientes.empty:
+            st.info("No hay gastos pendientes con esos filtros")
+            return
+        if total > LIMITE_LOTE:
+            st.caption(f"Se muestran los {LIMITE_LOTE} más antiguos de {total}; ajusta los filtros para ver el resto")
+        
+        # Nada seleccionado de entrada: un clic no debe pagar cientos de gastos por descuido
+        pendientes.insert(0, 'pagar', False)
+        seleccion = st.data_editor(
+            pendientes[['pagar', 'id', 'fecha', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd']],
+            disabled=['id', 'fecha', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd'],
+            hide_index=True,
+            use_container_width=True,
+            key=f"{prefijo}_lote_seleccion"
+        )
+        ids = seleccion.loc[seleccion['pagar'], 'id'].tolist()
+        total_bs = seleccion.loc[seleccion['pagar'], 'monto_bs'].sum()
+        
+        if st.button(f"✅ Pagar seleccionados ({len(ids)}) - Bs. {total_bs:,.2f}", key=f"{prefijo}_lote_pagar",
+                     disabled=not ids):
+            try:
+                pagados = libro_compartido().pagar_gastos(ids, date.today().isoformat())
+            except ValueError as e:
+                st.warning(f"⚠️ {e}")
+                return
+            st.success(f"✅ {len(pagados)} gastos marcados como pagados")
+            st.rerun()
+
+def pendientes_paginados(prefijo):
+    """Filtros, orden y paginación de gastos pendientes; devuelve solo la página visible"""
+    libro = st.session_state.libro
+    
+    col1, col2, col3 = st.columns([3, 2, 2])
+    with col1:
+        clasificaciones = st.multiselect("Clasificación", libro.clasificaciones, key=f"{prefijo}_clasificacion")
+    with col2:
+        fecha_inicio = st.date_input("Desde", value=None, key=f"{prefijo}_desde")
+    with col3:
+        fecha_fin = st.date_input("Hasta", value=None, key=f"{prefijo}_hasta")
+    
+    col1, col2, col3, col4 = st.columns([2, 2, 2, 2])
+    with col1:
+        orden = st.selectbox("Ordenar por", list(ORDENES_PENDIENTES), key=f"{prefijo}_orden")
+    with col2:
+        descendente = st.checkbox("Descendente", key=f"{prefijo}_descendente")
+    with col3:
+        tamano = st.selectbox("Por página", TAMANOS_PAGINA, index=1, key=f"{prefijo}_tamano")
+    
+    total = libro.contar_pendientes(clasificaciones or None, fecha_inicio, fecha_fin)
+    paginas = max(1, -(-total // tamano))
+    with col4:
+        pagina = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1,
+                                 key=f"{prefijo}_pagina_{paginas}")
+    
+    marco, total = libro.pagina_pendientes(clasificaciones or None, fecha_inicio, fecha_fin,
+                                           ORDENES_PENDIENTES[orden], descendente, pagina - 1, tamano)
+    if total:
+        inicio = (pagina - 1) * tamano
+        st.caption(f"Mostrando {inicio + 1}-{inicio + len(marco)} de {total} gastos pendientes")
+    else:
+        st.info("No hay gastos pendientes con esos filtros")
+    return marco.to_dict('records')
+
 def gestion_pagos():
     """Gestión de pagos de gastos pendientes"""
     st.header("💰 Gestión de Pagos")
     
-    # Obtener gastos pendientes
-    gastos_pendientes = [g for g in st.session_state.datos['gastos'] if not g.get('pagado', False)]
-    
-    if not gastos_pendientes:
+    if st.session_state.libro.resumen_pendientes().empty:
         st.success("🎉 No hay gastos pendientes de pago")
         return
     
     st.subheader("Gastos Pendientes de Pago")
     
-    for i, gasto in enumerate(gastos_pendientes):
-        # Usar índice como fallback si no hay ID
-        gasto_id = gasto.get('id', i + 1)
+    pagar_en_lote("gestion")
+    
+    # Solo la página visible se materializa y se dibuja
+    for gasto in pendientes_paginados("gestion"):
+        gasto_id = gasto['id']
         
         with st.expander(f"📅 {gasto['fecha']} - {gasto['clasificacion']} - Bs. {gasto['monto_bs']:,.2f}"):
             col1, col2 = st.columns([3, 1])
@@ -507,60 +775,77 @@ def gestion_pagos():
             with col2:
                 if st.button("✅ Marcar como Pagado", key=f"pagar_{gasto_id}"):
                     # Actualizar el gasto como pagado
-                    for g in st.session_state.datos['gastos']:
-                        g_id = g.get('id', 'unknown')
-                        if g_id == gasto_id:
-                            g['pagado'] = True
-                            g['fecha_pago'] = date.today().isoformat()
-                            # Asegurar que tenga ID si no lo tenía
-                            if 'id' not in g:
-                                g['id'] = gasto_id
-                            break
-                    
-                    guardar_datos(st.session_state.datos)
-                    st.success(f"✅ Gasto marcado como pagado")
-                    st.rerun()
+                    pagar_gasto(gasto_id)
     
     # Mostrar resumen de pagos recientes
     st.subheader("📋 Pagos Recientes (Últimos 7 días)")
     
-    fecha_limite = (datetime.date.today() - datetime.timedelta(days=7)).isoformat()
-    pagos_recientes = [g for g in st.session_state.datos['gastos'] 
-                      if g.get('pagado', False) and g.get('fecha_pago', '') >= fecha_limite]
-    
-    if pagos_recientes:
-        # Crear DataFrame con columnas disponibles
-        datos_pagos = []
-        for pago in pagos_recientes:
-            dato_pago = {
-                'fecha': pago['fecha'],
-                'fecha_pago': pago.get('fecha_pago', pago['fecha']),
-                'clasificacion': pago['clasificacion'],
-                'descripcion': pago['descripcion'],
-                'monto_bs': pago['monto_bs'],
-                'monto_usd': pago['monto_usd']
-            }
-            datos_pagos.append(dato_pago)
-        
-        df_pagos_recientes = pd.DataFrame(datos_pagos)
+    df_pagos_recientes = contabilidad.pagos_recientes(st.session_state.libro, dias=7)
+    
+    if not df_pagos_recientes.empty:
         st.dataframe(df_pagos_recientes, use_container_width=True)
     else:
         st.info("No hay pagos recientes en los últimos 7 días")
 
+def mostrar_antiguedad():
+    """Cuentas por pagar por clasificación y tramo de antigüedad"""
+    valor = st.radio("Mostrar", list(VALORES_ANTIGUEDAD), horizontal=True, key="antiguedad_valor")
+    try:
+        antiguedad = contabilidad.antiguedad_pendientes(st.session_state.libro, VALORES_ANTIGUEDAD[valor])
+    except ValueError as error:
+        st.error(str(error))
+        return
+    st.dataframe(antiguedad, use_container_width=True, hide_index=True)
+    st.bar_chart(antiguedad.set_index('clasificacion').drop(columns='total'))
+    if VALORES_ANTIGUEDAD[valor] == 'monto_usd':
+        st.caption("Dólares a la tasa actual: lo que costaría pagarlos hoy")
+
+def mostrar_proyeccion_caja():
+    """Saldo de caja proyectado con la venta promedio y el vencimiento de los pendientes"""
+    libro = st.session_state.libro
+    tasa_actual = obtener_tasa_actual()
+    if not tasa_actual:
+        st.warning("⚠️ No hay tasa de cambio configurada. Ve a 'Configurar Tasa' primero.")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        dias = st.slider("Días a proyectar", min_value=7, max_value=120, value=30, key="proyeccion_dias")
+    with col2:
+        plazo = st.number_input("Plazo de pago (días desde la fecha del gasto)", min_value=0, value=30,
+                                step=1, key="proyeccion_plazo")
+    with col3:
+        saldo_actual = contabilidad.resumen_acumulado(libro)['balance_bs'] / tasa_actual
+        # La clave incluye el saldo por defecto: si otra escritura lo cambia, el campo se actualiza
+        saldo_inicial = st.number_input("Saldo inicial ($)", value=round(saldo_actual, 2), step=100.0,
+                                        key=f"proyeccion_saldo_{saldo_actual:.2f}")
+    
+    proyeccion = contabilidad.proyeccion_caja(libro, dias, int(plazo), saldo_inicial=saldo_inicial)
+    faltante = contabilidad.primer_faltante(proyeccion)
+    if faltante:
+        st.error(f"⚠️ La caja queda en negativo el {faltante}")
+    else:
+        st.success(f"✅ La caja se mantiene positiva los próximos {dias} días")
+    
+    st.line_chart(proyeccion.set_index('fecha')['saldo_usd'])
+    st.dataframe(proyeccion, use_container_width=True, hide_index=True)
+    st.caption("Ingresos: venta promedio de cada día de la semana en las últimas 4 semanas. "
+               "Pagos: cada pendiente vence al cumplirse el plazo (los vencidos se cuentan hoy), "
+               "revaluado a la tasa actual.")
+
 def ver_gastos_pendientes():
     """Vista especializada para ver todos los gastos pendientes"""
     st.header("📋 Gastos Pendientes a la Fecha")
     
-    # Obtener todos los gastos pendientes
-    gastos_pendientes = [g for g in st.session_state.datos['gastos'] if not g.get('pagado', False)]
+    resumen_clasificacion = contabilidad.pendientes_por_clasificacion(st.session_state.libro)
     
-    if not gastos_pendientes:
+    if resumen_clasificacion.empty:
         st.success("🎉 No hay gastos pendientes de pago")
         return
     
     # Mostrar resumen
-    total_pendiente_bs = sum(g['monto_bs'] for g in gastos_pendientes)
-    total_pendiente_usd = sum(g['monto_usd'] for g in gastos_pendientes)
+    total_pendiente_bs = resumen_clasificacion['monto_bs'].sum()
+    total_pendiente_usd = resumen_clasificacion['monto_usd'].sum()
     
     col1, col2 = st.columns(2)
     with col1:
@@ -568,48 +853,33 @@ def ver_gastos_pendientes():
     with col2:
         st.metric("💰 Total Pendiente ($)", f"$ {total_pendiente_usd:,.2f}")
     
-    # Agrupar por clasificación
-    st.subheader("📊 Gastos Pendientes por Clasificación")
+    pagar_en_lote("pendientes")
     
-    gastos_por_clasificacion = {}
-    for gasto in gastos_pendientes:
-        clasificacion = gasto['clasificacion']
-        if clasificacion not in gastos_por_clasificacion:
-            gastos_por_clasificacion[clasificacion] = []
-        gastos_por_clasificacion[clasificacion].append(gasto)
+    tab1, tab2, tab3 = st.tabs(["📊 Por Clasificación", "⏳ Antigüedad", "📉 Proyección de Caja"])
     
-    for clasificacion, gastos in gastos_por_clasificacion.items():
-        total_clasificacion_bs = sum(g['monto_bs'] for g in gastos)
-        total_clasificacion_usd = sum(g['monto_usd'] for g in gastos)
-        
-        with st.expander(f"{clasificacion} - Bs. {total_clasificacion_bs:,.2f} (${total_clasificacion_usd:,.2f}) - {len(gastos)} gastos"):
-            for gasto in gastos:
-                col1, col2, col3 = st.columns([3, 2, 1])
-                with col1:
-                    st.write(f"**{gasto['descripcion']}**")
-                    st.write(f"Fecha: {gasto['fecha']}")
-                with col2:
-                    st.write(f"Bs. {gasto['monto_bs']:,.2f}")
-                    st.write(f"$ {gasto['monto_usd']:,.2f}")
-                with col3:
-                    if st.button("✅ Pagar", key=f"pagar_directo_{gasto.get('id', hash(gasto['descripcion']))}"):
-                        # Actualizar el gasto como pagado
-                        for g in st.session_state.datos['gastos']:
-                            if g.get('id') == gasto.get('id') or (g['fecha'] == gasto['fecha'] and g['descripcion'] == gasto['descripcion']):
-                                g['pagado'] = True
-                                g['fecha_pago'] = date.today().isoformat()
-                                break
-                        guardar_datos(st.session_state.datos)
-                        st.success("✅ Gasto marcado como pagado")
-                        st.rerun()
-    
-    # Tabla completa de gastos pendientes
-    st.subheader("📋 Lista Completa de Gastos Pendientes")
-    if gastos_pendientes:
-        df_pendientes = pd.DataFrame(gastos_pendientes)
-        columnas_mostrar = ['fecha', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd']
-        df_display = df_pendientes[columnas_mostrar]
-        st.dataframe(df_display, use_container_width=True)
+    with tab1:
+        st.dataframe(resumen_clasificacion, use_container_width=True, hide_index=True)
+    
+    with tab2:
+        mostrar_antiguedad()
+    
+    with tab3:
+        mostrar_proyeccion_caja()
+    
+    # Lista paginada: solo la página visible se materializa y se dibuja
+    st.subheader("📋 Lista de Gastos Pendientes")
+    for gasto in pendientes_paginados("pendientes"):
+        col1, col2, col3 = st.columns([3, 2, 1])
+        with col1:
+            st.write(f"**{gasto['descripcion']}**")
+            st.write(f"Fecha: {gasto['fecha']} - {gasto['clasificacion']}")
+        with col2:
+            st.write(f"Bs. {gasto['monto_bs']:,.2f}")
+            st.write(f"$ {gasto['monto_usd']:,.2f}")
+        with col3:
+            if st.button("✅ Pagar", key=f"pagar_directo_{gasto['id']}"):
+                # Actualizar el gasto como pagado
+                pagar_gasto(gasto['id'])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,276 @@
+import atexit
+import datetime
+import threading
+import time
+
+from libro import Libro
+from metricas import medir
+
+# Tabla de cada evento que agrega un registro
+TABLAS_EVENTO = {
+    'venta_agregada': ('venta', 'ventas'),
+    'gasto_agregado': ('gasto', 'gastos')
+}
+
+# Tabla (y clave de la lista de registros) de cada evento que agrega varios registros
+TABLAS_LOTE = {
+    'ventas_agregadas': 'ventas',
+    'gastos_agregados': 'gastos'
+}
+
+
+class LibroCompartido:
+    """Un solo libro por proceso, compartido por todas las sesiones
+
+    Se recarga únicamente cuando la versión del almacenamiento cambia por
+    escrituras ajenas (otro proceso o una edición manual del archivo).
+
+    Con `intervalo_escritura` (segundos) la escritura es diferida: registrar
+    aplica el evento al libro y lo encola, y un hilo guarda los eventos
+    acumulados en un solo lote a lo sumo `intervalo_escritura` segundos
+    después del primero. Lo encolado se guarda también al terminar el proceso.
+    En este modo el proceso debe ser el único que escribe en el almacenamiento.
+    """
+
+    def __init__(self, almacen, intervalo_escritura=None):
+        self.almacen = almacen
+        self.libro = None
+        self._version = None
+        self._bloqueo = threading.RLock()
+
+        # Escritura diferida: eventos aplicados al libro que aún no están en disco
+        self.intervalo_escritura = intervalo_escritura
+        self._pendientes = []
+        self._en_vuelo = 0
+        self._primer_pendiente = None
+        self._cambios = threading.Condition(self._bloqueo)
+        self._escritura = threading.Lock()
+        self._cerrado = False
+        self._ultimo_guardado = None
+        self._error_escritura = None
+        if intervalo_escritura is not None:
+            self._hilo = threading.Thread(target=self._escribir_en_segundo_plano,
+                                          name="escritura-diferida", daemon=True)
+            self._hilo.start()
+            atexit.register(self.cerrar)
+
+    def _recargar(self):
+        with self.almacen.bloqueo(), medir('recargar_libro') as medicion:
+            self._version = self.almacen.version()
+            self.libro = Libro.desde_almacen(self.almacen)
+            self._consolidar()
+            medicion['registros'] = len(self.libro.ventas) + len(self.libro.gastos)
+
+    def _consolidar(self):
+        """Consolidar los meses cerrados pendientes y persistir los que cambiaron (con el bloqueo tomado)"""
+        self.libro.consolidar()
+        consolidados = self.libro.consolidados
+        if consolidados.sin_guardar:
+            self.almacen.guardar_consolidados(consolidados.a_datos(consolidados.sin_guardar))
+            consolidados.sin_guardar.clear()
+
+    def _sincronizar(self):
+        """Ponerse al día con lo escrito por otros procesos (con el bloqueo tomado)"""
+        version = self.almacen.version()
+        if self.libro is None:
+            self._recargar()
+        elif version != self._version:
+            # Versión optimista: si solo hubo agregados ajenos se aplican encima
+            eventos = self.almacen.eventos_desde(self.libro.seq)
+            if eventos is None:
+                self._recargar()
+                return
+            for evento in eventos:
+                self.libro.aplicar(evento)
+            self._version = version
+
+    def obtener(self):
+        """Libro vigente; lo recarga si el almacenamiento cambió"""
+        with self._bloqueo:
+            # Con eventos sin guardar el disco está atrasado respecto al libro, no adelantado
+            sin_guardar = self._pendientes or self._en_vuelo
+            if self.libro is None or (not sin_guardar and self.almacen.version() != self._version):
+                with self.almacen.bloqueo():
+                    self._sincronizar()
+            # Al empezar un mes se consolida el anterior; es O(meses) si no hay nada que hacer
+            if self.libro.consolidar() or self.libro.consolidados.sin_guardar:
+                if self.intervalo_escritura is None:
+                    with self.almacen.bloqueo():
+                        self._consolidar()
+            return self.libro
+
+    def _validar(self, evento):
+        """Asignar el ID de los registros nuevos y descartar pagos imposibles (con el bloqueo tomado)"""
+        if evento['evento'] in TABLAS_EVENTO:
+            clave, tabla = TABLAS_EVENTO[evento['evento']]
+            evento[clave]['id'] = self.libro.siguiente_id(tabla)
+        elif evento['evento'] in TABLAS_LOTE:
+            tabla = TABLAS_LOTE[evento['evento']]
+            if not evento[tabla]:
+                raise ValueError("No hay registros para agregar")
+            siguiente = self.libro.siguiente_id(tabla)
+            for i, registro in enumerate(evento[tabla]):
+                registro['id'] = siguiente + i
+        elif evento['evento'] == 'gasto_pagado':
+            i = self.libro.posicion('gastos', evento['id'])
+            if i is None:
+                raise ValueError(f"No existe el gasto con ID {evento['id']}")
+            if self.libro.gastos['pagado'][i]:
+                raise ValueError(f"El gasto con ID {evento['id']} ya estaba pagado")
+        elif evento['evento'] == 'gastos_pagados':
+            # Los que otro usuario ya pagó (o no existen) se descartan del lote
+            evento['ids'] = [
+                id_gasto for id_gasto in dict.fromkeys(evento['ids'])
+                if (i := self.libro.posicion('gastos', id_gasto)) is not None
+                and not self.libro.gastos['pagado'][i]
+            ]
+            if not evento['ids']:
+                raise ValueError("Ninguno de los gastos seleccionados está pendiente")
+
+    def registrar(self, evento):
+        """Persistir un evento y aplicarlo al libro compartido
+
+        El ID de los registros nuevos se asigna aquí, con el bloqueo entre
+        procesos tomado, para que dos cajeros nunca obtengan el mismo. Con
+        escritura diferida el evento solo se encola y se responde enseguida.
+        """
+        if self.intervalo_escritura is not None:
+            return self._encolar(evento)
+
+        with self._bloqueo, self.almacen.bloqueo():
+            self._sincronizar()
+            self._validar(evento)
+            evento = self.almacen.registrar(evento)
+            self.libro.aplicar(evento)
+            # La escritura propia no debe provocar una recarga
+            self._version = self.almacen.version()
+            self._consolidar()
+            return evento
+
+    def _encolar(self, evento):
+        """Aplicar el evento al libro y dejarlo para el hilo de escritura"""
+        with self._bloqueo:
+            if self._cerrado:
+                raise RuntimeError("El libro ya se cerró, no admite más registros")
+            if self.libro is None:
+                with self.almacen.bloqueo():
+                    self._recargar()
+            self._validar(evento)
+            # Sin número de secuencia: lo asigna el almacenamiento al guardar el lote
+            self.libro.aplicar(evento)
+            self.libro.consolidar()
+            if not self._pendientes:
+                self._primer_pendiente = time.monotonic()
+            self._pendientes.append(evento)
+            self._cambios.notify()
+            return evento
+
+    def guardar_pendientes(self):
+        """Guardar ya los eventos encolados en un solo lote; devuelve cuántos se guardaron
+
+        Si la escritura de los eventos falla vuelven a la cola; si falla solo la
+        de los consolidados, los eventos ya quedaron en el almacenamiento y lo
+        que se reintenta son los consolidados. El error queda en estado_escritura().
+        """
+        with self._escritura:
+            with self._bloqueo:
+                lote, self._pendientes = self._pendientes, []
+                self._en_vuelo = len(lote)
+                meses = {}
+                if self.libro is not None and self.libro.consolidados.sin_guardar:
+                    consolidados = self.libro.consolidados
+                    meses = consolidados.a_datos(consolidados.sin_guardar)
+                    consolidados.sin_guardar.clear()
+            if not lote and not meses:
+                return 0
+
+            try:
+                with self.almacen.bloqueo():
+                    ajenos = self._version is not None and self.almacen.version() != self._version
+                    guardados = self.almacen.registrar_lote(lote)
+                    version = self.almacen.version()
+            except Exception as e:
+                with self._bloqueo:
+                    self._pendientes[:0] = lote
+                    self._en_vuelo = 0
+                    self._primer_pendiente = time.monotonic()
+                    if self.libro is not None:
+                        self.libro.consolidados.sin_guardar.update(meses)
+                    self._error_escritura = str(e)
+                return 0
+
+            # Desde aquí los eventos están guardados: volver a encolarlos los duplicaría
+            error = None
+            if meses:
+                try:
+                    with self.almacen.bloqueo():
+                        self.almacen.guardar_consolidados(meses)
+                except Exception as e:
+                    error = str(e)
+
+            with self._bloqueo:
+                self._en_vuelo = 0
+                self._version = version
+                if self.libro is not None and guardados:
+                    self.libro.seq = max(self.libro.seq, guardados[-1]['seq'])
+                self._ultimo_guardado = datetime.datetime.now()
+                self._error_escritura = error
+                if error is not None and self.libro is not None:
+                    self.libro.consolidados.sin_guardar.update(meses)
+                if ajenos:
+                    self._error_escritura = ("Otro proceso escribió en el almacenamiento; "
+                                             "la escritura diferida requiere un único proceso")
+                    if not self._pendientes:
+                        # Se recarga desde el disco en el próximo obtener()
+                        self.libro = None
+            return len(lote)
+
+    def _escribir_en_segundo_plano(self):
+        while True:
+            with self._cambios:
+                while not self._pendientes and not self._cerrado:
+                    self._cambios.wait()
+                if self._cerrado:
+                    return
+                # Acumular lo que llegue hasta cumplirse el intervalo desde el primer evento
+                while not self._cerrado:
+                    restante = self._primer_pendiente + self.intervalo_escritura - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cambios.wait(restante)
+            self.guardar_pendientes()
+            if self._error_escritura is not None and self._pendientes:
+                # No reintentar en un ciclo cerrado si el almacenamiento falla
+                time.sleep(self.intervalo_escritura)
+
+    def cerrar(self):
+        """Detener el hilo de escritura y guardar lo pendiente (se llama también al salir)"""
+        if self.intervalo_escritura is None:
+            return
+        with self._cambios:
+            self._cerrado = True
+            self._cambios.notify_all()
+        self._hilo.join()
+        self.guardar_pendientes()
+
+    def estado_escritura(self):
+        """Durabilidad de lo registrado: modo, eventos sin guardar, último guardado y último error"""
+        with self._bloqueo:
+            return {
+                'diferida': self.intervalo_escritura is not None,
+                'pendientes': len(self._pendientes) + self._en_vuelo,
+                'ultimo_guardado': self._ultimo_guardado,
+                'error': self._error_escritura
+            }
+
+    def pagar_gastos(self, ids, fecha_pago):
+        """Marcar varios gastos como pagados con una sola escritura
+
+        Devuelve la lista de IDs efectivamente pagados.
+        """
+        evento = self.registrar({
+            'evento': 'gastos_pagados',
+            'ids': [int(id_gasto) for id_gasto in ids],
+            'fecha_pago': str(fecha_pago)
+        })
+        return evento['ids']
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+
+# Canales de pago de las ventas y campos que se consolidan por día
+CANALES_VENTA = ('punto_venta_bs', 'dolar_cash_bs', 'venta_externa_bs', 'bs_cash_bs')
+CAMPOS_VENTAS = CANALES_VENTA + ('total_bs', 'total_usd', 'cantidad')
+COLUMNAS_VENTAS_DIA = ('fecha',) + CAMPOS_VENTAS
+COLUMNAS_GASTOS_DIA = ('fecha', 'clasificacion', 'pagado', 'monto_bs', 'monto_usd', 'cantidad')
+
+
+def limites_mes(mes):
+    """Primer y último día de un mes 'AAAA-MM' como datetime64[D]"""
+    primero = np.datetime64(mes, 'M')
+    return primero.astype('datetime64[D]'), (primero + 1).astype('datetime64[D]') - 1
+
+
+def agrupar_ventas(ventas, posiciones):
+    """Totales por día y canal de las filas de ventas indicadas"""
+    marco = pd.DataFrame({c: ventas[c][posiciones] for c in ('fecha',) + CAMPOS_VENTAS[:-1]})
+    marco['cantidad'] = 1
+    return marco.groupby('fecha', sort=True).sum().reset_index()
+
+
+def sumar_archivados(ventas, gastos, archivados):
+    """Totales por día de un mes (agrupar_ventas / agrupar_gastos) más los de sus filas archivadas
+
+    `archivados` es el mes de una partición sin cargar ({'ventas': filas, 'gastos': filas}).
+    """
+    if archivados['ventas']:
+        marco = _desde_filas(archivados['ventas'], COLUMNAS_VENTAS_DIA)
+        ventas = pd.concat([marco, ventas], ignore_index=True) if len(ventas) else marco
+        ventas = ventas.groupby('fecha', sort=True).sum().reset_index()
+    if archivados['gastos']:
+        marco = _desde_filas(archivados['gastos'], COLUMNAS_GASTOS_DIA)
+        marco['pagado'] = marco['pagado'].astype(bool)
+        gastos = pd.concat([marco, gastos], ignore_index=True) if len(gastos) else marco
+        gastos = gastos.groupby(['fecha', 'clasificacion', 'pagado'], sort=True).sum().reset_index()
+    return ventas, gastos
+
+
+def _a_filas(marco, columnas):
+    """DataFrame como listas JSON, con las fechas en ISO"""
+    filas = marco[list(columnas)].astype(object)
+    filas['fecha'] = np.datetime_as_string(marco['fecha'].to_numpy(dtype='datetime64[D]'), unit='D')
+    return filas.values.tolist()
+
+
+def _desde_filas(filas, columnas):
+    marco = pd.DataFrame(filas, columns=list(columnas))
+    marco['fecha'] = marco['fecha'].to_numpy(dtype='datetime64[D]')
+    return marco
+
+
+class Consolidados:
+    """Totales por día y por mes de los meses cerrados
+
+    Un mes cerrado (anterior al mes en curso) solo cambia si llega un registro
+    con fecha atrasada o se paga uno de sus gastos; entonces se consolida de
+    nuevo ese mes. Cada mes guarda una huella (totales y conteos) para
+    descartarlo al cargar si ya no coincide con el libro.
+    """
+
+    def __init__(self):
+        # 'AAAA-MM' → {'huella', 'ventas' (por día), 'gastos' (por día), 'ventas_mes'}
+        self.meses = {}
+        # Meses consolidados en memoria que aún no se persistieron
+        self.sin_guardar = set()
+        self._gastos_dia = None
+
+    def reemplazar(self, mes, huella, ventas, gastos):
+        """Guardar los totales de un mes recién consolidado"""
+        self.meses[mes] = {
+            'huella': huella,
+            'ventas': ventas,
+            'gastos': gastos,
+            'ventas_mes': {c: float(ventas[c].sum()) for c in CAMPOS_VENTAS}
+        }
+        self.sin_guardar.add(mes)
+        self._gastos_dia = None
+
+    def descartar(self, mes):
+        self.meses.pop(mes, None)
+        self.sin_guardar.discard(mes)
+        self._gastos_dia = None
+
+    def gastos_dia(self):
+        """Celdas día × clasificación × pagado de todos los meses consolidados (None si no hay)"""
+        if self._gastos_dia is None:
+            marcos = [self.meses[m]['gastos'] for m in sorted(self.meses) if len(self.meses[m]['gastos'])]
+            self._gastos_dia = (pd.concat(marcos, ignore_index=True) if marcos else None,)
+        return self._gastos_dia[0]
+
+    def tramos(self, fecha_inicio=None, fecha_fin=None):
+        """Dividir un rango en meses consolidados completos y bordes a recorrer en crudo
+
+        Devuelve (meses, bordes), con los bordes como pares (inicio, fin) de
+        datetime64[D] o None para un extremo abierto.
+        """
+        inicio = None if fecha_inicio is None else np.datetime64(str(fecha_inicio), 'D')
+        fin = None if fecha_fin is None else np.datetime64(str(fecha_fin), 'D')
+        meses, bordes = [], []
+        cursor = inicio
+        for mes in sorted(self.meses):
+            primero, ultimo = limites_mes(mes)
+            if (inicio is not None and primero < inicio) or (fin is not None and ultimo > fin):
+                continue
+            if cursor is None or primero > cursor:
+                bordes.append((cursor, primero - 1))
+            meses.append(mes)
+            cursor = ultimo + 1
+        if cursor is None or fin is None or cursor <= fin:
+            bordes.append((cursor, fin))
+        return meses, bordes
+
+    def a_datos(self, meses=None):
+        """Meses en formato JSON ({'AAAA-MM': {...}}), todos por defecto"""
+        return {
+            mes: {
+                'huella': self.meses[mes]['huella'],
+                'ventas': _a_filas(self.meses[mes]['ventas'], COLUMNAS_VENTAS_DIA),
+                'gastos': _a_filas(self.meses[mes]['gastos'], COLUMNAS_GASTOS_DIA)
+            }
+            for mes in sorted(self.meses if meses is None else meses)
+        }
+
+    @classmethod
+    def desde_datos(cls, datos):
+        """Reconstruir desde el formato JSON; los meses quedan como ya persistidos"""
+        consolidados = cls()
+        for mes, contenido in (datos or {}).items():
+            ventas = _desde_filas(contenido['ventas'], COLUMNAS_VENTAS_DIA)
+            gastos = _desde_filas(contenido['gastos'], COLUMNAS_GASTOS_DIA)
+            gastos['pagado'] = gastos['pagado'].astype(bool)
+            consolidados.reemplazar(mes, contenido['huella'], ventas, gastos)
+        consolidados.sin_guardar.clear()
+        return consolidados
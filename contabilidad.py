@@ -0,0 +1,332 @@
+"""Consultas contables sin Streamlit, para la interfaz, scripts programados y benchmarks
+
+Uso desde la terminal:
+    python contabilidad.py resumen --desde 2024-01-01 --hasta 2024-01-31
+    python contabilidad.py pendientes
+    python contabilidad.py antiguedad --valor monto_usd
+    python contabilidad.py proyeccion --dias 60 --plazo 15
+    python contabilidad.py serie --desde 2024-01-01 --json
+"""
+import argparse
+import datetime
+import functools
+import json
+from dataclasses import dataclass
+from typing import Dict, Optional, TypedDict, Union
+
+import pandas as pd
+
+from almacenamiento import crear_almacen
+from consolidados import CANALES_VENTA
+from libro import Libro
+
+Fecha = Union[str, datetime.date]
+
+# Clasificación de gastos
+CLASIFICACION_GASTOS = [
+    "Gastos administrativos",
+    "Gastos Mantenimiento",
+    "Gastos Nómina",
+    "Gastos Venta",
+    "Gastos x Compras Materia Prima"
+]
+
+# Columnas que se muestran en los detalles de cada período
+COLUMNAS_VENTAS = ['fecha', 'punto_venta_bs', 'dolar_cash_bs', 'venta_externa_bs', 'bs_cash_bs',
+                   'total_bs', 'total_usd', 'descripcion']
+COLUMNAS_GASTOS_PAGADOS = ['fecha', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd', 'fecha_pago']
+COLUMNAS_GASTOS_PENDIENTES = ['fecha', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd']
+
+
+class Totales(TypedDict):
+    ventas_bs: float
+    ventas_usd: float
+    gastos_pagados_bs: float
+    gastos_pagados_usd: float
+    gastos_pendientes_bs: float
+    gastos_pendientes_usd: float
+    balance_bs: float
+    balance_usd: float
+
+
+@dataclass
+class DetallePeriodo:
+    """Registros de un período, listos para mostrar"""
+    ventas: pd.DataFrame
+    gastos_pagados: pd.DataFrame
+    gastos_pendientes: pd.DataFrame
+
+
+def _iso(fecha: Optional[Fecha]) -> Optional[str]:
+    return None if fecha is None else str(fecha)
+
+
+def _memorizada(consulta):
+    """Guardar el resultado en el caché del libro, por parámetros y versión del libro
+
+    Volver a mostrar el mismo período sin escrituras de por medio cuesta una
+    búsqueda en un dict. El resultado se comparte: quien lo use no debe modificarlo.
+    """
+    @functools.wraps(consulta)
+    def envoltura(libro: Libro, *args, **kwargs):
+        parametros = tuple(_iso(a) if isinstance(a, datetime.date) else a for a in args)
+        clave = (consulta.__name__, parametros, tuple(sorted(kwargs.items())))
+        return libro.memorizar(clave, lambda: consulta(libro, *args, **kwargs))
+    return envoltura
+
+
+def a_usd(monto_bs: float, tasa: Optional[float]) -> float:
+    """Convertir bolívares a dólares (0 si no hay tasa)"""
+    return monto_bs / tasa if tasa else 0.0
+
+
+def tasa_actual(libro: Libro) -> Optional[float]:
+    """Tasa de cambio más reciente"""
+    return libro.tasa_actual()
+
+
+def tasa_en(libro: Libro, fecha: Fecha) -> Optional[float]:
+    """Tasa de cambio vigente en una fecha"""
+    return libro.tasa_en(fecha)
+
+
+def tasa_registro(libro: Libro, fecha: Fecha) -> Optional[float]:
+    """Tasa con la que se convierte un registro de esa fecha: la vigente en la fecha,
+    o la actual si la fecha es anterior a la primera tasa"""
+    return libro.tasa_en(fecha) or libro.tasa_actual()
+
+
+def resumen_acumulado(libro: Libro) -> Totales:
+    """Totales de todos los tiempos (mantenidos al escribir, O(1))"""
+    return libro.resumen()
+
+
+@_memorizada
+def resumen_periodo(libro: Libro, fecha_inicio: Optional[Fecha] = None,
+                    fecha_fin: Optional[Fecha] = None) -> Totales:
+    """Totales de un período (bisección sobre sumas prefijas por día)"""
+    return libro.resumen_rango(_iso(fecha_inicio), _iso(fecha_fin))
+
+
+def resumen_dia(libro: Libro, fecha: Fecha) -> Totales:
+    """Totales de un día, con los dólares calculados a la tasa vigente ese día"""
+    totales = libro.resumen(_iso(fecha))
+    tasa = libro.tasa_en(fecha)
+    for campo in ('ventas', 'gastos_pagados', 'gastos_pendientes', 'balance'):
+        totales[f'{campo}_usd'] = a_usd(totales[f'{campo}_bs'], tasa)
+    return totales
+
+
+@_memorizada
+def detalle_periodo(libro: Libro, fecha_inicio: Fecha, fecha_fin: Fecha) -> DetallePeriodo:
+    """Ventas, gastos pagados y gastos pendientes de un período"""
+    gastos = libro.gastos_entre(_iso(fecha_inicio), _iso(fecha_fin))
+    return DetallePeriodo(
+        ventas=libro.ventas_entre(_iso(fecha_inicio), _iso(fecha_fin))[COLUMNAS_VENTAS],
+        gastos_pagados=gastos.loc[gastos['pagado'], COLUMNAS_GASTOS_PAGADOS],
+        gastos_pendientes=gastos.loc[~gastos['pagado'], COLUMNAS_GASTOS_PENDIENTES]
+    )
+
+
+@_memorizada
+def resumen_por_clasificacion(libro: Libro, fecha_inicio: Optional[Fecha] = None,
+                              fecha_fin: Optional[Fecha] = None) -> pd.DataFrame:
+    """Montos, pagados y pendientes por clasificación en un período, desde el cubo de gastos"""
+    return libro.cubo_gastos().por_clasificacion(_iso(fecha_inicio), _iso(fecha_fin))
+
+
+@_memorizada
+def matriz_clasificacion(libro: Libro, fecha_inicio: Optional[Fecha] = None,
+                         fecha_fin: Optional[Fecha] = None, periodo: str = 'mes',
+                         valor: str = 'monto_bs', pagado: Optional[bool] = None) -> pd.DataFrame:
+    """Matriz período ('dia', 'semana' o 'mes') × clasificación con la suma de `valor`"""
+    return libro.cubo_gastos().matriz(_iso(fecha_inicio), _iso(fecha_fin), periodo, valor, pagado)
+
+
+@_memorizada
+def tendencia_gastos(libro: Libro, fecha_inicio: Optional[Fecha] = None,
+                     fecha_fin: Optional[Fecha] = None, periodo: str = 'semana',
+                     valor: str = 'monto_bs') -> pd.DataFrame:
+    """Gastos pagados y pendientes por período"""
+    return libro.cubo_gastos().tendencia(_iso(fecha_inicio), _iso(fecha_fin), periodo, valor)
+
+
+@_memorizada
+def ventas_por_canal(libro: Libro, fecha_inicio: Optional[Fecha] = None,
+                     fecha_fin: Optional[Fecha] = None) -> Dict[str, float]:
+    """Ventas de un período por canal de pago, desde los meses consolidados y los bordes"""
+    return libro.ventas_por_canal(_iso(fecha_inicio), _iso(fecha_fin))
+
+
+def pendientes_por_clasificacion(libro: Libro) -> pd.DataFrame:
+    """Total pendiente y cantidad de gastos no pagados por clasificación"""
+    return libro.resumen_pendientes()
+
+
+@_memorizada
+def serie_diaria(libro: Libro, fecha_inicio: Optional[Fecha] = None,
+                 fecha_fin: Optional[Fecha] = None) -> pd.DataFrame:
+    """Totales por día (solo días con movimientos), a partir de los agregados"""
+    inicio, fin = _iso(fecha_inicio), _iso(fecha_fin)
+    dias = sorted(d for d in libro.agregados.por_dia
+                  if (inicio is None or d >= inicio) and (fin is None or d <= fin))
+    serie = pd.DataFrame([libro.resumen(d) for d in dias], columns=list(Totales.__annotations__))
+    serie.insert(0, 'fecha', dias)
+    return serie
+
+
+@_memorizada
+def _antiguedad(libro: Libro, hoy: str, valor: str) -> pd.DataFrame:
+    return libro.antiguedad_pendientes(hoy, valor)
+
+
+def antiguedad_pendientes(libro: Libro, valor: str = 'monto_bs',
+                          hoy: Optional[datetime.date] = None) -> pd.DataFrame:
+    """Cuentas por pagar por clasificación y tramo de antigüedad (0-7, 8-30, 31-60 y 60+ días)
+
+    `valor` es 'monto_bs', 'monto_usd' (revaluado a la tasa actual) o 'cantidad'.
+    """
+    # La fecha entra en la clave: al cambiar el día se recalcula aunque no haya escrituras
+    return _antiguedad(libro, _iso(hoy or datetime.date.today()), valor)
+
+
+@_memorizada
+def _proyeccion(libro: Libro, hoy: str, dias: int, plazo: int, ventana: int,
+                saldo_inicial: Optional[float]) -> pd.DataFrame:
+    return libro.proyeccion_caja(hoy, dias, plazo, ventana, saldo_inicial)
+
+
+def proyeccion_caja(libro: Libro, dias: int = 30, plazo: int = 30, ventana: int = 28,
+                    saldo_inicial: Optional[float] = None,
+                    hoy: Optional[datetime.date] = None) -> pd.DataFrame:
+    """Saldo de caja proyectado por día (en dólares a la tasa actual), ver Libro.proyeccion_caja"""
+    return _proyeccion(libro, _iso(hoy or datetime.date.today()), dias, plazo, ventana, saldo_inicial)
+
+
+def primer_faltante(proyeccion: pd.DataFrame) -> Optional[str]:
+    """Primer día en que el saldo proyectado queda negativo, o None"""
+    negativos = proyeccion.loc[proyeccion['saldo_usd'] < 0, 'fecha']
+    return None if negativos.empty else negativos.iloc[0]
+
+
+def pagos_recientes(libro: Libro, dias: int = 7, hoy: Optional[datetime.date] = None) -> pd.DataFrame:
+    """Gastos pagados en los últimos `dias` días"""
+    hoy = hoy or datetime.date.today()
+    pagos = libro.gastos_pagados_desde((hoy - datetime.timedelta(days=dias)).isoformat())
+    return pagos[['fecha', 'fecha_pago', 'clasificacion', 'descripcion', 'monto_bs', 'monto_usd']]
+
+
+def construir_venta(libro: Libro, fecha: Fecha, punto_venta_bs: float, dolar_cash_bs: float,
+                    venta_externa_bs: float, bs_cash_bs: float, descripcion: str = '') -> Dict:
+    """Registro de venta convertido a la tasa vigente en su fecha (o la actual si es anterior)
+
+    El ID lo asigna LibroCompartido.registrar. Lanza ValueError si no hay ninguna tasa.
+    """
+    tasa = tasa_registro(libro, fecha)
+    if tasa is None:
+        raise ValueError("Debes configurar una tasa de cambio primero")
+    total_bs = punto_venta_bs + dolar_cash_bs + venta_externa_bs + bs_cash_bs
+    return {
+        'fecha': _iso(fecha),
+        'punto_venta_bs': punto_venta_bs,
+        'dolar_cash_bs': dolar_cash_bs,
+        'venta_externa_bs': venta_externa_bs,
+        'bs_cash_bs': bs_cash_bs,
+        'total_bs': total_bs,
+        'total_usd': total_bs / tasa,
+        'descripcion': descripcion,
+        'tasa_cambio': tasa
+    }
+
+
+def desglose_usd(venta: Dict) -> Dict[str, float]:
+    """Monto en dólares de cada canal de una venta, a la tasa de la venta"""
+    return {canal: venta[canal] / venta['tasa_cambio'] for canal in CANALES_VENTA}
+
+
+def construir_gasto(libro: Libro, fecha: Fecha, clasificacion: str, descripcion: str,
+                    monto_bs: float, pagado: bool) -> Dict:
+    """Registro de gasto convertido a la tasa vigente en su fecha (o la actual si es anterior)
+
+    El ID lo asigna LibroCompartido.registrar. Lanza ValueError si no hay ninguna tasa.
+    """
+    tasa = tasa_registro(libro, fecha)
+    if tasa is None:
+        raise ValueError("Debes configurar una tasa de cambio primero")
+    return {
+        'fecha': _iso(fecha),
+        'clasificacion': clasificacion,
+        'descripcion': descripcion,
+        'monto_bs': monto_bs,
+        'monto_usd': monto_bs / tasa,
+        'tasa_cambio': tasa,
+        'pagado': pagado,
+        'fecha_pago': _iso(fecha) if pagado else None
+    }
+
+
+def cargar_libro(tipo: Optional[str] = None, ruta: Optional[str] = None, tienda: Optional[str] = None) -> Libro:
+    """Cargar el libro desde el almacenamiento configurado (o el de una tienda), sin Streamlit"""
+    almacen = crear_almacen(tipo, ruta, tienda)
+    with almacen.bloqueo():
+        return Libro.desde_almacen(almacen)
+
+
+def main():
+    # Opciones comunes a todos los subcomandos
+    comunes = argparse.ArgumentParser(add_help=False)
+    comunes.add_argument("--almacen", choices=["json", "sqlite"], default=None)
+    comunes.add_argument("--ruta", default=None)
+    comunes.add_argument("--tienda", default=None, help="tienda dentro de BALANCE_TIENDAS")
+    comunes.add_argument("--json", action="store_true", help="salida en JSON")
+
+    parser = argparse.ArgumentParser(description="Consultas del balance desde la terminal")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    for nombre, ayuda in (("resumen", "totales de un período"),
+                          ("serie", "totales por día"),
+                          ("canales", "ventas por canal de pago en un período"),
+                          ("clasificacion", "gastos por clasificación en un período")):
+        sub = subparsers.add_parser(nombre, help=ayuda, parents=[comunes])
+        sub.add_argument("--desde", default=None)
+        sub.add_argument("--hasta", default=None)
+    subparsers.add_parser("pendientes", help="gastos pendientes por clasificación", parents=[comunes])
+    antiguedad = subparsers.add_parser("antiguedad", help="cuentas por pagar por tramo de antigüedad",
+                                       parents=[comunes])
+    antiguedad.add_argument("--valor", choices=["monto_bs", "monto_usd", "cantidad"], default="monto_bs")
+    proyeccion = subparsers.add_parser("proyeccion", help="saldo de caja proyectado por día", parents=[comunes])
+    proyeccion.add_argument("--dias", type=int, default=30)
+    proyeccion.add_argument("--plazo", type=int, default=30, help="días hasta el vencimiento de cada gasto")
+    proyeccion.add_argument("--saldo", type=float, default=None, help="saldo inicial en dólares")
+    tasa = subparsers.add_parser("tasa", help="tasa vigente en una fecha", parents=[comunes])
+    tasa.add_argument("--fecha", default=datetime.date.today().isoformat())
+
+    args = parser.parse_args()
+    libro = cargar_libro(args.almacen, args.ruta, args.tienda)
+
+    if args.comando == "resumen":
+        resultado = resumen_periodo(libro, args.desde, args.hasta)
+    elif args.comando == "canales":
+        resultado = ventas_por_canal(libro, args.desde, args.hasta)
+    elif args.comando == "serie":
+        resultado = serie_diaria(libro, args.desde, args.hasta)
+    elif args.comando == "clasificacion":
+        resultado = resumen_por_clasificacion(libro, args.desde, args.hasta)
+    elif args.comando == "pendientes":
+        resultado = pendientes_por_clasificacion(libro)
+    elif args.comando == "antiguedad":
+        resultado = antiguedad_pendientes(libro, args.valor)
+    elif args.comando == "proyeccion":
+        resultado = proyeccion_caja(libro, args.dias, args.plazo, saldo_inicial=args.saldo)
+    else:
+        resultado = {'fecha': args.fecha, 'tasa': tasa_en(libro, args.fecha)}
+
+    if isinstance(resultado, pd.DataFrame):
+        print(resultado.to_json(orient='records', force_ascii=False) if args.json
+              else resultado.to_string(index=False))
+    else:
+        print(json.dumps(resultado, ensure_ascii=False, indent=None if args.json else 2))
+
+
+if __name__ == "__main__":
+    main()
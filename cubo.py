@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# Granularidades del cubo y la columna que agrupa cada una
+PERIODOS = {'dia': 'fecha', 'semana': 'semana', 'mes': 'mes'}
+VALORES = ('monto_bs', 'monto_usd', 'cantidad')
+
+
+def _fecha(valor):
+    return np.datetime64(str(valor), 'D')
+
+
+def agrupar_gastos(gastos, clasificaciones, posiciones=None):
+    """Celdas día × clasificación × pagado de las filas de gastos indicadas (todas por defecto)
+
+    Devuelve un DataFrame con fecha, clasificacion (nombre), pagado, monto_bs,
+    monto_usd y cantidad, ordenado por fecha.
+    """
+    seleccion = slice(None) if posiciones is None else posiciones
+    marco = pd.DataFrame({
+        'fecha': gastos['fecha'][seleccion],
+        'clasificacion': gastos['clasificacion'][seleccion],
+        'pagado': gastos['pagado'][seleccion],
+        'monto_bs': gastos['monto_bs'][seleccion],
+        'monto_usd': gastos['monto_usd'][seleccion]
+    })
+    celdas = marco.groupby(['fecha', 'clasificacion', 'pagado'], sort=True).agg(
+        monto_bs=('monto_bs', 'sum'),
+        monto_usd=('monto_usd', 'sum'),
+        cantidad=('monto_bs', 'size')
+    ).reset_index()
+    nombres = np.array(clasificaciones, dtype=object)
+    celdas['clasificacion'] = nombres[celdas['clasificacion'].to_numpy(dtype=np.intp)]
+    return celdas
+
+
+class CuboGastos:
+    """Gastos agregados por día × clasificación × pagado
+
+    Se construye con un solo groupby sobre las columnas del libro; semanas y
+    meses se obtienen sumando días, así que cortar el cubo nunca recorre los
+    gastos individuales.
+    """
+
+    def __init__(self, celdas):
+        # Una fila por (fecha, clasificación, pagado), ordenadas por fecha
+        celdas = celdas.reset_index(drop=True)
+        celdas['clasificacion'] = celdas['clasificacion'].astype('category')
+        fechas = celdas['fecha'].to_numpy(dtype='datetime64[D]')
+        # Semana que empieza el lunes (1970-01-01 fue jueves)
+        celdas['semana'] = np.datetime_as_string(fechas - (fechas.view(np.int64) + 3) % 7, unit='D')
+        celdas['mes'] = np.datetime_as_string(fechas, unit='M')
+        self.celdas = celdas
+        self._fechas = fechas
+
+    def rebanada(self, fecha_inicio=None, fecha_fin=None, pagado=None):
+        """Celdas de un rango de fechas (por bisección) y, opcionalmente, de un estado de pago"""
+        i = 0 if fecha_inicio is None else np.searchsorted(self._fechas, _fecha(fecha_inicio), 'left')
+        j = len(self._fechas) if fecha_fin is None else np.searchsorted(self._fechas, _fecha(fecha_fin), 'right')
+        celdas = self.celdas.iloc[i:max(i, j)]
+        if pagado is not None:
+            celdas = celdas[celdas['pagado'] == pagado]
+        return celdas
+
+    def por_clasificacion(self, fecha_inicio=None, fecha_fin=None):
+        """Montos, pagados y pendientes por clasificación"""
+        celdas = self.rebanada(fecha_inicio, fecha_fin)
+        pagados = celdas['cantidad'].where(celdas['pagado'], 0)
+        resumen = celdas.assign(pagados=pagados, pendientes=celdas['cantidad'] - pagados).groupby(
+            'clasificacion', observed=True, sort=False
+        )[['monto_bs', 'monto_usd', 'pagados', 'pendientes']].sum().reset_index()
+        resumen['clasificacion'] = resumen['clasificacion'].astype(str)
+        return resumen
+
+    def matriz(self, fecha_inicio=None, fecha_fin=None, periodo='mes', valor='monto_bs', pagado=None):
+        """Períodos (filas) × clasificaciones (columnas) con la suma de `valor`"""
+        celdas = self.rebanada(fecha_inicio, fecha_fin, pagado)
+        matriz = celdas.pivot_table(index=PERIODOS[periodo], columns='clasificacion', values=valor,
+                                    aggfunc='sum', fill_value=0, observed=True)
+        matriz.columns = matriz.columns.astype(str)
+        matriz.index = matriz.index.astype(str)
+        matriz.index.name = periodo
+        return matriz
+
+    def tendencia(self, fecha_inicio=None, fecha_fin=None, periodo='semana', valor='monto_bs'):
+        """Pagados y pendientes por período"""
+        celdas = self.rebanada(fecha_inicio, fecha_fin)
+        tendencia = celdas.pivot_table(index=PERIODOS[periodo], columns='pagado', values=valor,
+                                       aggfunc='sum', fill_value=0)
+        tendencia = tendencia.reindex(columns=[True, False], fill_value=0)
+        tendencia.columns = ['pagados', 'pendientes']
+        tendencia.index = tendencia.index.astype(str)
+        tendencia.index.name = periodo
+        return tendencia
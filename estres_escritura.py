@@ -0,0 +1,89 @@
+"""Prueba de estrés: varios procesos escribiendo a la vez en el mismo almacenamiento
+
+Uso: python estres_escritura.py --procesos 8 --registros 200 [--almacen sqlite]
+Termina con código 1 si se perdió o duplicó algún registro.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import almacenamiento
+from almacenamiento import crear_almacen
+from compartido import LibroCompartido
+
+
+def escritor(tipo, ruta, numero, registros, compactar_bytes):
+    """Registrar ventas y gastos desde un proceso independiente"""
+    almacenamiento.COMPACTAR_MIN_BYTES = compactar_bytes
+    compartido = LibroCompartido(crear_almacen(tipo, ruta))
+    for i in range(registros):
+        compartido.registrar({'evento': 'venta_agregada', 'venta': {
+            'fecha': '2024-01-01', 'punto_venta_bs': 1.0, 'dolar_cash_bs': 0.0,
+            'venta_externa_bs': 0.0, 'bs_cash_bs': 0.0, 'total_bs': 1.0, 'total_usd': 0.025,
+            'tasa_cambio': 40.0, 'descripcion': f"escritor {numero} venta {i}"
+        }})
+        gasto = compartido.registrar({'evento': 'gasto_agregado', 'gasto': {
+            'fecha': '2024-01-01', 'clasificacion': 'Gastos Venta', 'monto_bs': 1.0,
+            'monto_usd': 0.025, 'tasa_cambio': 40.0, 'pagado': False, 'fecha_pago': None,
+            'descripcion': f"escritor {numero} gasto {i}"
+        }})
+        if i % 2:
+            compartido.registrar({'evento': 'gasto_pagado', 'id': gasto['gasto']['id'],
+                                  'fecha_pago': '2024-01-02'})
+
+
+def verificar(tipo, ruta, procesos, registros):
+    """Lista de problemas encontrados en los datos finales"""
+    datos = crear_almacen(tipo, ruta).cargar()
+    problemas = []
+    for tabla, nombre in (('ventas', 'venta'), ('gastos', 'gasto')):
+        esperadas = {f"escritor {p} {nombre} {i}" for p in range(procesos) for i in range(registros)}
+        encontradas = [r['descripcion'] for r in datos[tabla]]
+        if len(encontradas) != len(esperadas) or set(encontradas) != esperadas:
+            problemas.append(f"{tabla}: {len(encontradas)} registros, se esperaban {len(esperadas)}")
+        ids = [r['id'] for r in datos[tabla]]
+        if len(set(ids)) != len(ids):
+            problemas.append(f"{tabla}: {len(ids) - len(set(ids))} IDs repetidos")
+
+    pagados = sum(1 for g in datos['gastos'] if g['pagado'])
+    if pagados != procesos * (registros // 2):
+        problemas.append(f"gastos pagados: {pagados}, se esperaban {procesos * (registros // 2)}")
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--procesos", type=int, default=8)
+    parser.add_argument("--registros", type=int, default=200)
+    parser.add_argument("--almacen", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--compactar-bytes", type=int, default=16 * 1024,
+                        help="umbral de compactación bajo para forzar compactaciones concurrentes")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="estres_balance_")
+    ruta = os.path.join(directorio, "balance_data.json" if args.almacen == "json" else "balance_data.db")
+
+    procesos = [
+        multiprocessing.Process(target=escritor,
+                                args=(args.almacen, ruta, n, args.registros, args.compactar_bytes))
+        for n in range(args.procesos)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    for proceso in procesos:
+        proceso.join()
+
+    problemas = verificar(args.almacen, ruta, args.procesos, args.registros)
+    if any(p.exitcode for p in procesos):
+        problemas.append("algún proceso escritor terminó con error")
+
+    if problemas:
+        print("❌ " + "\n❌ ".join(problemas))
+        sys.exit(1)
+    print(f"✅ {args.procesos} procesos x {args.registros} registros sin pérdidas ({ruta})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""Importación masiva de ventas y gastos desde CSV o XLSX (cierres del punto de venta, exportes del banco)
+
+Uso desde la terminal:
+    python importacion.py ventas cierre_pos.csv
+    python importacion.py gastos banco.csv --decimal , --separador ";" --columna monto_bs=Débito \\
+        --clasificacion "Gastos administrativos" --pagado
+    python importacion.py gastos compras.xlsx --simular --json
+"""
+import argparse
+import json
+import sys
+import time
+import unicodedata
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from almacenamiento import crear_almacen
+from compartido import LibroCompartido
+from consolidados import CANALES_VENTA
+from contabilidad import CLASIFICACION_GASTOS
+
+# Filas por bloque: cada bloque se valida, se convierte y se guarda con una sola escritura
+TAMANO_BLOQUE = 5000
+
+# Errores de validación que se conservan para el reporte (el resto solo se cuenta)
+MAX_ERRORES = 200
+
+# Evento que agrega los registros de un bloque
+EVENTOS_LOTE = {'ventas': 'ventas_agregadas', 'gastos': 'gastos_agregados'}
+
+# Columnas que se buscan en el archivo; la primera es el nombre propio y las demás,
+# encabezados habituales de los exportes (sin acentos, en minúsculas y con "_")
+CAMPOS = {
+    'ventas': {
+        'fecha': ('fecha', 'fecha_operacion', 'fecha_valor', 'date'),
+        'punto_venta_bs': ('punto_venta_bs', 'punto_de_venta', 'punto_venta'),
+        'dolar_cash_bs': ('dolar_cash_bs', 'dolar_cash', '$_cash'),
+        'venta_externa_bs': ('venta_externa_bs', 'venta_externa'),
+        'bs_cash_bs': ('bs_cash_bs', 'bs_cash', 'efectivo_bs'),
+        'descripcion': ('descripcion', 'concepto', 'detalle'),
+        'referencia': ('referencia', 'ref', 'nro_referencia', 'numero_referencia')
+    },
+    'gastos': {
+        'fecha': ('fecha', 'fecha_operacion', 'fecha_valor', 'date'),
+        'clasificacion': ('clasificacion', 'categoria'),
+        'descripcion': ('descripcion', 'concepto', 'detalle'),
+        'monto_bs': ('monto_bs', 'monto', 'debito', 'importe'),
+        'pagado': ('pagado', 'estado'),
+        'fecha_pago': ('fecha_pago',),
+        'referencia': ('referencia', 'ref', 'nro_referencia', 'numero_referencia')
+    }
+}
+OBLIGATORIOS = {'ventas': ('fecha',), 'gastos': ('fecha', 'monto_bs')}
+
+# Campos con los que se calcula la huella de contenido para detectar repetidos
+CAMPOS_HUELLA = {
+    'ventas': ('fecha',) + CANALES_VENTA + ('descripcion',),
+    'gastos': ('fecha', 'clasificacion', 'monto_bs', 'descripcion')
+}
+
+# Formatos de fecha que se prueban en orden si no se indica uno
+FORMATOS_FECHA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y')
+VALORES_PAGADO = {'si', 'sí', 's', 'x', '1', 'true', 'verdadero', 'pagado', 'yes'}
+
+
+@dataclass
+class OpcionesImportacion:
+    """Formato del archivo y valores por defecto de la importación"""
+    # destino → encabezado del archivo, para columnas con nombres propios del banco
+    columnas: Dict[str, str] = field(default_factory=dict)
+    decimal: str = '.'
+    separador: str = ','
+    formato_fecha: Optional[str] = None
+    hoja: Optional[str] = None
+    # Gastos: clasificación de las filas que no traen una y estado de pago si no hay columna
+    clasificacion: Optional[str] = None
+    pagado: bool = False
+    clasificaciones: List[str] = field(default_factory=lambda: list(CLASIFICACION_GASTOS))
+    tamano_bloque: int = TAMANO_BLOQUE
+
+
+@dataclass
+class ResultadoImportacion:
+    tipo: str
+    leidas: int = 0
+    importadas: int = 0
+    repetidas: int = 0
+    invalidas: int = 0
+    errores: List[Dict] = field(default_factory=list)
+    segundos: float = 0.0
+
+    @property
+    def filas_por_segundo(self) -> float:
+        return self.leidas / self.segundos if self.segundos else 0.0
+
+
+def _normalizar_nombre(nombre):
+    """Encabezado sin acentos, en minúsculas y con "_" en lugar de espacios y puntos"""
+    sin_acentos = unicodedata.normalize('NFKD', str(nombre)).encode('ascii', 'ignore').decode()
+    return "_".join(sin_acentos.strip().lower().replace('.', ' ').split())
+
+
+def resolver_columnas(encabezados, tipo, columnas=None):
+    """Columna del archivo que corresponde a cada campo ({campo: encabezado})
+
+    Lanza ValueError si falta una columna obligatoria o una indicada en `columnas`.
+    """
+    columnas = columnas or {}
+    por_nombre = {_normalizar_nombre(e): e for e in encabezados}
+    mapa = {}
+    for campo, alias in CAMPOS[tipo].items():
+        if campo in columnas:
+            if columnas[campo] not in encabezados:
+                raise ValueError(f"El archivo no tiene la columna '{columnas[campo]}' indicada para {campo}")
+            mapa[campo] = columnas[campo]
+            continue
+        encontrado = next((por_nombre[a] for a in alias if a in por_nombre), None)
+        if encontrado is not None:
+            mapa[campo] = encontrado
+
+    faltantes = [c for c in OBLIGATORIOS[tipo] if c not in mapa]
+    if tipo == 'ventas' and not any(c in mapa for c in CANALES_VENTA):
+        faltantes.append(" / ".join(CANALES_VENTA))
+    if faltantes:
+        raise ValueError(f"Faltan columnas en el archivo: {', '.join(faltantes)} "
+                         f"(encabezados: {', '.join(map(str, encabezados))})")
+    return mapa
+
+
+def leer_bloques(archivo, tamano_bloque=TAMANO_BLOQUE, separador=',', hoja=None, nombre=None):
+    """DataFrames de hasta `tamano_bloque` filas, leídos de a uno desde un CSV o XLSX
+
+    `archivo` es una ruta o un archivo abierto (por ejemplo, el de st.file_uploader);
+    `nombre` decide el formato cuando el archivo no tiene ruta.
+    """
+    nombre = str(nombre or getattr(archivo, 'name', archivo))
+    if nombre.lower().endswith(('.xlsx', '.xlsm')):
+        yield from _bloques_xlsx(archivo, tamano_bloque, hoja)
+        return
+    yield from pd.read_csv(archivo, sep=separador, dtype=str, keep_default_na=False,
+                           skipinitialspace=True, encoding='utf-8-sig', chunksize=tamano_bloque)
+
+
+def _bloques_xlsx(archivo, tamano_bloque, hoja):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Para importar archivos XLSX hace falta el paquete openpyxl (pip install openpyxl)")
+
+    # Modo de solo lectura: las filas se leen a medida que se recorren
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = (libro[hoja] if hoja else libro.active).iter_rows(values_only=True)
+        encabezado = [f"columna_{i + 1}" if c is None else str(c).strip()
+                      for i, c in enumerate(next(filas, ()))]
+        bloque = []
+        for fila in filas:
+            bloque.append(fila[:len(encabezado)])
+            if len(bloque) == tamano_bloque:
+                yield pd.DataFrame(bloque, columns=encabezado)
+                bloque = []
+        if bloque:
+            yield pd.DataFrame(bloque, columns=encabezado)
+    finally:
+        libro.close()
+
+
+def _vacios(serie):
+    return serie.isna() | (serie.astype(str).str.strip() == '')
+
+
+def _a_numeros(serie, decimal):
+    """Montos como float (NaN si no se pueden leer); acepta "1.234,56" con decimal=','"""
+    es_numero = serie.map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool))
+    texto = serie.where(~es_numero, '').astype(str).str.replace(r'[^\d,.\-]', '', regex=True)
+    if decimal == ',':
+        texto = texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    else:
+        texto = texto.str.replace(',', '', regex=False)
+    numeros = pd.to_numeric(texto, errors='coerce')
+    return numeros.where(~es_numero, pd.to_numeric(serie.where(es_numero), errors='coerce')).astype(float)
+
+
+def _a_fechas(serie, formato=None):
+    """Fechas como datetime64 (NaT si no se pueden leer), probando los formatos habituales"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.normalize()
+    es_fecha = serie.map(lambda v: hasattr(v, 'year'))
+    fechas = pd.to_datetime(serie.where(es_fecha), errors='coerce')
+    texto = serie.where(~es_fecha, '').astype(str).str.strip()
+    for formato_texto in ([formato] if formato else FORMATOS_FECHA):
+        faltan = fechas.isna() & (texto != '')
+        if not faltan.any():
+            break
+        fechas[faltan] = pd.to_datetime(texto[faltan], format=formato_texto, errors='coerce')
+    return fechas.dt.normalize()
+
+
+def _canonico(marco, tipo):
+    """Campos de la huella con tipos fijos, para que el archivo y el libro den el mismo hash"""
+    canonico = pd.DataFrame(index=range(len(marco)))
+    for campo in CAMPOS_HUELLA[tipo]:
+        valores = marco[campo]
+        if campo == 'fecha':
+            canonico[campo] = valores.to_numpy(dtype='datetime64[D]').astype(np.int64)
+        elif campo in ('clasificacion', 'descripcion'):
+            canonico[campo] = valores.astype(object).fillna('').to_numpy(dtype=object)
+        else:
+            canonico[campo] = valores.to_numpy(dtype=float).round(2)
+    return canonico
+
+
+def huellas(marco, tipo):
+    """Hash de contenido de cada fila (fecha, montos, descripción y clasificación)"""
+    return pd.util.hash_pandas_object(_canonico(marco, tipo), index=False).to_numpy()
+
+
+def preparar_bloque(libro, crudo, tipo, mapa, opciones, primera_fila=2):
+    """Validar, convertir y descartar repetidos de un bloque leído del archivo
+
+    Devuelve (registros listos para el evento de lote, errores, cantidad de repetidos).
+    Los errores son dicts {'fila', 'motivo'}, con la fila numerada como en la hoja
+    de cálculo (el encabezado es la fila 1).
+    """
+    crudo = crudo.reset_index(drop=True)
+    marco = pd.DataFrame(index=crudo.index)
+    motivos = pd.Series('', index=crudo.index, dtype=object)
+
+    def invalidar(mascara, motivo):
+        motivos[mascara & (motivos == '')] = motivo
+
+    fechas = _a_fechas(crudo[mapa['fecha']], opciones.formato_fecha)
+    invalidar(fechas.isna(), "fecha inválida")
+    marco['fecha'] = fechas.dt.strftime('%Y-%m-%d')
+
+    texto = {c: crudo[mapa[c]].where(~_vacios(crudo[mapa[c]]), '').astype(str).str.strip() if c in mapa
+             else pd.Series('', index=crudo.index) for c in ('descripcion', 'referencia')}
+    marco['descripcion'] = texto['descripcion'].where(
+        texto['referencia'] == '', (texto['descripcion'] + " (ref. " + texto['referencia'] + ")").str.strip())
+
+    if tipo == 'ventas':
+        for canal in CANALES_VENTA:
+            if canal not in mapa:
+                marco[canal] = 0.0
+                continue
+            columna = crudo[mapa[canal]]
+            marco[canal] = _a_numeros(columna, opciones.decimal).where(~_vacios(columna), 0.0)
+            invalidar(marco[canal].isna(), f"monto inválido en {mapa[canal]}")
+            invalidar(marco[canal] < 0, f"monto negativo en {mapa[canal]}")
+        marco['total_bs'] = marco[list(CANALES_VENTA)].sum(axis=1)
+        invalidar(marco['total_bs'] <= 0, "venta sin montos")
+        montos = ['total_bs']
+    else:
+        marco['monto_bs'] = _a_numeros(crudo[mapa['monto_bs']], opciones.decimal).abs()
+        invalidar(marco['monto_bs'].isna(), "monto inválido")
+        invalidar(marco['monto_bs'] <= 0, "el monto debe ser mayor que cero")
+
+        clasificacion = (crudo[mapa['clasificacion']].where(~_vacios(crudo[mapa['clasificacion']]), '')
+                         .astype(str).str.strip() if 'clasificacion' in mapa
+                         else pd.Series('', index=crudo.index))
+        marco['clasificacion'] = clasificacion.where(clasificacion != '', opciones.clasificacion or '')
+        invalidar(marco['clasificacion'] == '', "falta la clasificación")
+        if opciones.clasificaciones:
+            invalidar(~marco['clasificacion'].isin(opciones.clasificaciones), "clasificación desconocida")
+
+        if 'pagado' in mapa:
+            marco['pagado'] = crudo[mapa['pagado']].astype(str).str.strip().str.lower().isin(VALORES_PAGADO)
+        else:
+            marco['pagado'] = opciones.pagado
+        fecha_pago = (_a_fechas(crudo[mapa['fecha_pago']], opciones.formato_fecha) if 'fecha_pago' in mapa
+                      else pd.Series(pd.NaT, index=crudo.index))
+        fecha_pago = fecha_pago.dt.strftime('%Y-%m-%d').where(fecha_pago.notna(), marco['fecha'])
+        marco['fecha_pago'] = pd.Series(np.where(marco['pagado'], fecha_pago, None), index=crudo.index, dtype=object)
+        montos = ['monto_bs']
+
+    errores = [{'fila': primera_fila + int(i), 'motivo': m} for i, m in motivos[motivos != ''].items()]
+    marco = marco[motivos == ''].reset_index(drop=True)
+    if marco.empty:
+        return [], errores, 0
+
+    # Repetidos dentro del bloque y contra lo ya registrado en las mismas fechas
+    propias = huellas(marco, tipo)
+    existentes = (libro.ventas_entre if tipo == 'ventas' else libro.gastos_entre)(
+        marco['fecha'].min(), marco['fecha'].max())
+    repetidas = pd.Series(propias).duplicated().to_numpy()
+    if len(existentes):
+        repetidas = repetidas | np.isin(propias, huellas(existentes, tipo))
+    marco = marco[~repetidas].reset_index(drop=True)
+
+    # Conversión a dólares con la tasa vigente en la fecha de cada fila (o la actual si es anterior)
+    tasas = libro.tasas.tasas_en(marco['fecha'].to_numpy(dtype='datetime64[D]'))
+    marco['tasa_cambio'] = np.where(np.isnan(tasas), libro.tasa_actual(), tasas)
+    marco[montos[0].replace('_bs', '_usd')] = marco[montos[0]] / marco['tasa_cambio']
+
+    return marco.to_dict('records'), errores, int(repetidas.sum())
+
+
+def importar(compartido, archivo, tipo, opciones=None, simular=False, al_avanzar=None, nombre=None):
+    """Importar 'ventas' o 'gastos' de un CSV/XLSX, guardando cada bloque con una sola escritura
+
+    Con `simular` solo se valida y se cuenta (los repetidos entre bloques no se
+    detectan porque nada se registra). `al_avanzar(resultado)` se llama después
+    de cada bloque.
+    """
+    opciones = opciones or OpcionesImportacion()
+    resultado = ResultadoImportacion(tipo)
+    if compartido.obtener().tasa_actual() is None:
+        raise ValueError("Debes configurar una tasa de cambio primero")
+    inicio = time.perf_counter()
+
+    mapa = None
+    fila = 2
+    for crudo in leer_bloques(archivo, opciones.tamano_bloque, opciones.separador, opciones.hoja, nombre):
+        if mapa is None:
+            mapa = resolver_columnas(list(crudo.columns), tipo, opciones.columnas)
+        registros, errores, repetidas = preparar_bloque(compartido.obtener(), crudo, tipo, mapa, opciones, fila)
+        if registros and not simular:
+            compartido.registrar({'evento': EVENTOS_LOTE[tipo], tipo: registros})
+
+        fila += len(crudo)
+        resultado.leidas += len(crudo)
+        resultado.importadas += len(registros)
+        resultado.repetidas += repetidas
+        resultado.invalidas += len(errores)
+        resultado.errores.extend(errores[:MAX_ERRORES - len(resultado.errores)])
+        resultado.segundos = time.perf_counter() - inicio
+        if al_avanzar:
+            al_avanzar(resultado)
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importar ventas o gastos desde CSV o XLSX")
+    parser.add_argument("tipo", choices=["ventas", "gastos"])
+    parser.add_argument("archivo")
+    parser.add_argument("--almacen", choices=["json", "sqlite"], default=None)
+    parser.add_argument("--ruta", default=None)
+    parser.add_argument("--tienda", default=None, help="tienda dentro de BALANCE_TIENDAS")
+    parser.add_argument("--columna", action="append", default=[], metavar="CAMPO=ENCABEZADO",
+                        help="columna del archivo para un campo (repetible)")
+    parser.add_argument("--decimal", default='.', help="separador decimal de los montos")
+    parser.add_argument("--separador", default=',', help="separador de columnas del CSV")
+    parser.add_argument("--formato-fecha", default=None, help="por ejemplo %%d/%%m/%%Y")
+    parser.add_argument("--hoja", default=None, help="hoja del XLSX (por defecto la activa)")
+    parser.add_argument("--clasificacion", default=None, help="clasificación de los gastos que no traen una")
+    parser.add_argument("--pagado", action="store_true", help="gastos pagados si el archivo no lo indica")
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE, help="filas por bloque")
+    parser.add_argument("--simular", action="store_true", help="validar sin registrar nada")
+    parser.add_argument("--json", action="store_true", help="resultado en JSON")
+    args = parser.parse_args()
+
+    try:
+        columnas = dict(c.split('=', 1) for c in args.columna)
+    except ValueError:
+        parser.exit(2, "Error: --columna debe tener la forma CAMPO=ENCABEZADO\n")
+    opciones = OpcionesImportacion(
+        columnas=columnas, decimal=args.decimal, separador=args.separador, formato_fecha=args.formato_fecha,
+        hoja=args.hoja, clasificacion=args.clasificacion, pagado=args.pagado, tamano_bloque=args.bloque
+    )
+
+    def avance(resultado):
+        print(f"  {resultado.leidas:,} filas leídas, {resultado.importadas:,} importadas "
+              f"({resultado.filas_por_segundo:,.0f} filas/s)", file=sys.stderr)
+
+    try:
+        almacen = crear_almacen(args.almacen, args.ruta, args.tienda)
+    except ValueError as e:
+        parser.exit(1, f"Error: {e}\n")
+    compartido = LibroCompartido(almacen)
+    try:
+        resultado = importar(compartido, args.archivo, args.tipo, opciones, args.simular, avance)
+    except ValueError as e:
+        parser.exit(1, f"Error: {e}\n")
+
+    if args.json:
+        print(json.dumps(dict(asdict(resultado), filas_por_segundo=resultado.filas_por_segundo),
+                         ensure_ascii=False))
+        return
+    accion = "validarían" if args.simular else "importaron"
+    print(f"Se {accion} {resultado.importadas:,} de {resultado.leidas:,} filas en {resultado.segundos:.1f}s "
+          f"({resultado.filas_por_segundo:,.0f} filas/s); {resultado.repetidas:,} repetidas, "
+          f"{resultado.invalidas:,} inválidas")
+    for error in resultado.errores[:20]:
+        print(f"  fila {error['fila']}: {error['motivo']}")
+    if resultado.invalidas > 20:
+        print(f"  ... y {resultado.invalidas - 20:,} errores más")
+
+
+if __name__ == "__main__":
+    main()
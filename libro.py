@@ -0,0 +1,890 @@
+import datetime
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from consolidados import CAMPOS_VENTAS, Consolidados, agrupar_ventas, limites_mes, sumar_archivados
+from cubo import CuboGastos, agrupar_gastos
+from tasas import LineaTasas
+
+CAPACIDAD_INICIAL = 1024
+
+# Resultados de consultas que se conservan por libro (los más usados recientemente)
+MAX_CONSULTAS = 64
+
+# Tramos de antigüedad de las cuentas por pagar: días desde la fecha del gasto, con el
+# límite superior incluido (los gastos con fecha futura cuentan en el primero)
+TRAMOS_ANTIGUEDAD = ['0-7 días', '8-30 días', '31-60 días', '60+ días']
+LIMITES_ANTIGUEDAD = np.array([7, 30, 60])
+
+# Tipos de cada columna del libro en memoria
+TIPOS_VENTAS = {
+    'id': np.int64,
+    'fecha': 'datetime64[D]',
+    'punto_venta_bs': np.float64,
+    'dolar_cash_bs': np.float64,
+    'venta_externa_bs': np.float64,
+    'bs_cash_bs': np.float64,
+    'total_bs': np.float64,
+    'total_usd': np.float64,
+    'tasa_cambio': np.float64,
+    'descripcion': object
+}
+
+TIPOS_GASTOS = {
+    'id': np.int64,
+    'fecha': 'datetime64[D]',
+    'clasificacion': np.int16,  # Código dentro de Libro.clasificaciones
+    'descripcion': object,
+    'monto_bs': np.float64,
+    'monto_usd': np.float64,
+    'tasa_cambio': np.float64,
+    'pagado': np.bool_,
+    'fecha_pago': 'datetime64[D]'
+}
+
+
+class Columnas:
+    """Tabla en arreglos NumPy con crecimiento geométrico (agregar cuesta O(1) amortizado)"""
+
+    def __init__(self, tipos, capacidad=CAPACIDAD_INICIAL):
+        self.n = 0
+        self._arreglos = {c: np.empty(capacidad, dtype=t) for c, t in tipos.items()}
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, columna):
+        return self._arreglos[columna][:self.n]
+
+    def _reservar(self, total):
+        """Duplicar la capacidad hasta que quepan `total` filas"""
+        capacidad = len(next(iter(self._arreglos.values())))
+        if total <= capacidad:
+            return
+        capacidad = max(capacidad, 1)
+        while capacidad < total:
+            capacidad *= 2
+        for columna, arreglo in self._arreglos.items():
+            nuevo = np.empty(capacidad, dtype=arreglo.dtype)
+            nuevo[:self.n] = arreglo[:self.n]
+            self._arreglos[columna] = nuevo
+
+    def agregar(self, fila):
+        """Agregar una fila (dict columna → valor)"""
+        self._reservar(self.n + 1)
+        for columna, arreglo in self._arreglos.items():
+            arreglo[self.n] = fila[columna]
+        self.n += 1
+
+    def extender(self, columnas):
+        """Agregar muchas filas a partir de un dict columna → secuencia"""
+        cantidad = len(next(iter(columnas.values())))
+        self._reservar(self.n + cantidad)
+        for columna, valores in columnas.items():
+            self._arreglos[columna][self.n:self.n + cantidad] = valores
+        self.n += cantidad
+
+
+def _fecha(valor):
+    """Convertir una fecha ISO o datetime.date a datetime64[D]"""
+    return np.datetime64(str(valor), 'D')
+
+
+class IndiceFechas:
+    """Posiciones de una tabla ordenadas por fecha, para buscar rangos por bisección"""
+
+    def __init__(self, tabla):
+        self.tabla = tabla
+        self._ordenado = Columnas({'posicion': np.int64, 'fecha': 'datetime64[D]'})
+
+    def _actualizar(self):
+        """Incorporar las filas nuevas de la tabla"""
+        indexadas = len(self._ordenado)
+        total = len(self.tabla)
+        if indexadas == total:
+            return
+
+        nuevas = self.tabla['fecha'][indexadas:total]
+        en_orden = bool(np.all(nuevas[1:] >= nuevas[:-1]))
+        if en_orden and (not indexadas or nuevas[0] >= self._ordenado['fecha'][-1]):
+            # Caso común (registros del día): se agregan al final en O(1) amortizado
+            self._ordenado.extender({
+                'posicion': np.arange(indexadas, total),
+                'fecha': nuevas
+            })
+            return
+
+        # Registro con fecha atrasada: reordenar todo una vez
+        orden = np.argsort(self.tabla['fecha'], kind='stable')
+        self._ordenado = Columnas({'posicion': np.int64, 'fecha': 'datetime64[D]'}, capacidad=max(total, 1))
+        self._ordenado.extender({'posicion': orden, 'fecha': self.tabla['fecha'][orden]})
+
+    def rango(self, fecha_inicio=None, fecha_fin=None):
+        """Posiciones de las filas con fecha dentro del rango, ordenadas por fecha"""
+        self._actualizar()
+        fechas = self._ordenado['fecha']
+        i = 0 if fecha_inicio is None else np.searchsorted(fechas, _fecha(fecha_inicio), 'left')
+        j = len(fechas) if fecha_fin is None else np.searchsorted(fechas, _fecha(fecha_fin), 'right')
+        return self._ordenado['posicion'][i:max(i, j)]
+
+
+CAMPOS_TOTALES = ('ventas_bs', 'ventas_usd', 'gastos_pagados_bs', 'gastos_pagados_usd',
+                  'gastos_pendientes_bs', 'gastos_pendientes_usd')
+
+
+# Marca de "no está en el caché" (None puede ser un resultado válido)
+_FALTA = object()
+
+
+class CacheConsultas:
+    """Caché LRU acotado de resultados de consultas, con aciertos y fallos
+
+    Las claves incluyen la versión del libro, así que lo calculado antes de una
+    escritura nunca se devuelve después; esas entradas solo esperan a salir por
+    antigüedad. Los resultados se comparten entre sesiones y no deben modificarse.
+    """
+
+    def __init__(self, maximo=MAX_CONSULTAS):
+        self.maximo = maximo
+        self._entradas = OrderedDict()
+        self._bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, calcular):
+        """Resultado guardado para `clave` o, si no está, calcular() guardado para la próxima vez"""
+        resultado = self.buscar(clave, _FALTA)
+        if resultado is _FALTA:
+            # Se calcula sin el bloqueo; dos sesiones pueden calcular lo mismo a la vez, sin daño
+            resultado = self.guardar(clave, calcular())
+        return resultado
+
+    def buscar(self, clave, defecto=None):
+        """Resultado guardado para `clave` (cuenta como acierto) o `defecto` (cuenta como fallo)"""
+        with self._bloqueo:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave]
+            self.fallos += 1
+            return defecto
+
+    def guardar(self, clave, resultado):
+        """Guardar un resultado calculado por fuera de obtener(), descartando los más antiguos"""
+        with self._bloqueo:
+            self._entradas[clave] = resultado
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+        return resultado
+
+    def vaciar(self):
+        with self._bloqueo:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        """Aciertos, fallos, proporción de aciertos y entradas guardadas"""
+        with self._bloqueo:
+            consultas = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+                'entradas': len(self._entradas)
+            }
+
+
+def _con_balance(totales):
+    """Agregar el balance (ventas - gastos pagados) a un dict de totales"""
+    totales = dict(totales)
+    totales['balance_bs'] = totales['ventas_bs'] - totales['gastos_pagados_bs']
+    totales['balance_usd'] = totales['ventas_usd'] - totales['gastos_pagados_usd']
+    return totales
+
+
+class Agregados:
+    """Totales acumulados, por día y por mes, actualizados en cada escritura"""
+
+    def __init__(self):
+        self.total = dict.fromkeys(CAMPOS_TOTALES, 0.0)
+        self.por_dia = {}
+        self.por_mes = {}
+        self.version = 0
+        self._acumulados = None
+
+    def _sumar(self, fecha, campo_bs, monto_bs, monto_usd):
+        self.version += 1
+        dia = str(fecha)
+        campo_usd = campo_bs[:-3] + '_usd'
+        for totales in (self.total,
+                        self.por_dia.setdefault(dia, dict.fromkeys(CAMPOS_TOTALES, 0.0)),
+                        self.por_mes.setdefault(dia[:7], dict.fromkeys(CAMPOS_TOTALES, 0.0))):
+            totales[campo_bs] += monto_bs
+            totales[campo_usd] += monto_usd
+
+    def sumar_venta(self, fecha, total_bs, total_usd):
+        self._sumar(fecha, 'ventas_bs', total_bs, total_usd)
+
+    def sumar_gasto(self, fecha, monto_bs, monto_usd, pagado):
+        campo = 'gastos_pagados_bs' if pagado else 'gastos_pendientes_bs'
+        self._sumar(fecha, campo, monto_bs, monto_usd)
+
+    def sumar_totales(self, fecha, totales):
+        """Sumar los totales de un día ya agregado (por ejemplo, de una partición archivada)"""
+        for campo_bs in CAMPOS_TOTALES[::2]:
+            if totales[campo_bs] or totales[campo_bs[:-3] + '_usd']:
+                self._sumar(fecha, campo_bs, totales[campo_bs], totales[campo_bs[:-3] + '_usd'])
+
+    def marcar_pagado(self, fecha, monto_bs, monto_usd):
+        """Mover un gasto de pendiente a pagado"""
+        self._sumar(fecha, 'gastos_pendientes_bs', -monto_bs, -monto_usd)
+        self._sumar(fecha, 'gastos_pagados_bs', monto_bs, monto_usd)
+
+    def resumen(self, periodo=None):
+        """Totales de todos los tiempos, de un día ('AAAA-MM-DD') o de un mes ('AAAA-MM')"""
+        if periodo is None:
+            totales = self.total
+        else:
+            periodo = str(periodo)
+            buckets = self.por_mes if len(periodo) == 7 else self.por_dia
+            totales = buckets.get(periodo) or dict.fromkeys(CAMPOS_TOTALES, 0.0)
+        return _con_balance(totales)
+
+    def acumulados(self):
+        """Días ordenados y sumas prefijas por día (se recalculan solo tras escribir)"""
+        if self._acumulados is None or self._acumulados[0] != self.version:
+            dias = sorted(self.por_dia)
+            sumas = np.zeros((len(dias) + 1, len(CAMPOS_TOTALES)))
+            if dias:
+                valores = np.array([[self.por_dia[d][c] for c in CAMPOS_TOTALES] for d in dias])
+                np.cumsum(valores, axis=0, out=sumas[1:])
+            self._acumulados = (self.version, np.array(dias, dtype='datetime64[D]'), sumas)
+        return self._acumulados[1], self._acumulados[2]
+
+    def resumen_rango(self, fecha_inicio=None, fecha_fin=None):
+        """Totales de un rango de fechas por bisección sobre las sumas prefijas"""
+        dias, sumas = self.acumulados()
+        i = 0 if fecha_inicio is None else np.searchsorted(dias, _fecha(fecha_inicio), 'left')
+        j = len(dias) if fecha_fin is None else np.searchsorted(dias, _fecha(fecha_fin), 'right')
+        diferencia = sumas[max(j, i)] - sumas[i]
+        return _con_balance({c: float(v) for c, v in zip(CAMPOS_TOTALES, diferencia)})
+
+    @classmethod
+    def calcular(cls, ventas, gastos):
+        """Calcular desde cero todos los totales de un par de tablas columnares"""
+        agregados = cls()
+        columnas = [
+            ('ventas_bs', ventas['fecha'], ventas['total_bs'], ventas['total_usd']),
+            ('gastos_pagados_bs', gastos['fecha'][gastos['pagado']],
+             gastos['monto_bs'][gastos['pagado']], gastos['monto_usd'][gastos['pagado']]),
+            ('gastos_pendientes_bs', gastos['fecha'][~gastos['pagado']],
+             gastos['monto_bs'][~gastos['pagado']], gastos['monto_usd'][~gastos['pagado']])
+        ]
+        for campo_bs, fechas, montos_bs, montos_usd in columnas:
+            if not len(fechas):
+                continue
+            # Una pasada por columna: agrupar por día con unique + bincount
+            dias, grupos = np.unique(fechas, return_inverse=True)
+            sumas_bs = np.bincount(grupos, weights=montos_bs)
+            sumas_usd = np.bincount(grupos, weights=montos_usd)
+            for dia, suma_bs, suma_usd in zip(dias, sumas_bs, sumas_usd):
+                agregados._sumar(dia, campo_bs, float(suma_bs), float(suma_usd))
+        return agregados
+
+    def diferencias(self, otros, tolerancia=1e-6):
+        """Claves y campos en los que dos agregados no coinciden"""
+        diferencias = []
+        pares = [('total', self.total, otros.total)]
+        for nombre, propios, ajenos in (('dia', self.por_dia, otros.por_dia),
+                                        ('mes', self.por_mes, otros.por_mes)):
+            vacio = dict.fromkeys(CAMPOS_TOTALES, 0.0)
+            for clave in propios.keys() | ajenos.keys():
+                pares.append((f"{nombre} {clave}", propios.get(clave, vacio), ajenos.get(clave, vacio)))
+        for clave, propios, ajenos in pares:
+            for campo in CAMPOS_TOTALES:
+                if not np.isclose(propios[campo], ajenos[campo], rtol=tolerancia, atol=tolerancia):
+                    diferencias.append((clave, campo, propios[campo], ajenos[campo]))
+        return diferencias
+
+
+def _fechas_iso(arreglo):
+    """Fechas datetime64 como texto ISO, con None para las vacías"""
+    texto = np.datetime_as_string(arreglo, unit='D').astype(object)
+    texto[np.isnat(arreglo)] = None
+    return texto
+
+
+def _fila_venta(venta):
+    return {
+        'id': venta['id'],
+        'fecha': venta['fecha'],
+        'punto_venta_bs': venta.get('punto_venta_bs', 0.0),
+        'dolar_cash_bs': venta.get('dolar_cash_bs', 0.0),
+        'venta_externa_bs': venta.get('venta_externa_bs', 0.0),
+        'bs_cash_bs': venta.get('bs_cash_bs', 0.0),
+        'total_bs': venta['total_bs'],
+        'total_usd': venta['total_usd'],
+        'tasa_cambio': venta.get('tasa_cambio') or np.nan,
+        'descripcion': venta.get('descripcion', '')
+    }
+
+
+def _con_bloqueo(metodo):
+    """Ejecutar el método con el bloqueo del libro tomado
+
+    Las lecturas leen varias columnas (y actualizan los índices de fechas); sin el
+    bloqueo, un evento aplicado a mitad de camino deja columnas de largos distintos.
+    """
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        with self._bloqueo:
+            return metodo(self, *args, **kwargs)
+    return envoltura
+
+
+class Libro:
+    """Ventas, gastos y tasas de cambio en memoria, organizados por columnas
+
+    Un mismo libro se comparte entre sesiones (hilos): los eventos y las consultas
+    públicas toman el mismo bloqueo, así que cada consulta ve el libro entre dos eventos.
+    """
+
+    def __init__(self):
+        self.ventas = Columnas(TIPOS_VENTAS)
+        self.gastos = Columnas(TIPOS_GASTOS)
+        self.tasas = LineaTasas()
+        self.clasificaciones = []
+        self._codigos = {}
+        self.seq = 0
+        self.agregados = Agregados()
+        self.indice_ventas = IndiceFechas(self.ventas)
+        self.indice_gastos = IndiceFechas(self.gastos)
+        # Contador monotónico de IDs e índice hash id → posición por tabla
+        self.ultimo_id = {'ventas': 0, 'gastos': 0}
+        self.posiciones = {'ventas': {}, 'gastos': {}}
+        # Cambia con cada gasto agregado o pagado; invalida el cubo de gastos
+        self.version_gastos = 0
+        self._cubo = None
+        # Cambia con cada evento aplicado; forma parte de la clave de las consultas memorizadas
+        self.version = 0
+        self.consultas = CacheConsultas()
+        # Totales de los meses cerrados y meses a consolidar de nuevo por registros atrasados
+        self.consolidados = Consolidados()
+        self._meses_cambiados = set()
+        self._mes_abierto = None
+        # Particiones archivadas: {año: resumen}, las ya cargadas y cómo cargar las demás
+        self.particiones = {}
+        self._particiones_cargadas = set()
+        self._cargador = None
+        # Serializa eventos, cargas de particiones y consultas entre sesiones
+        self._bloqueo = threading.RLock()
+
+    @classmethod
+    def desde_datos(cls, datos):
+        """Construir el libro a partir del formato de listas de diccionarios"""
+        libro = cls()
+        libro._extender(datos['ventas'], datos['gastos'])
+        libro.tasas = LineaTasas(datos['tasas_cambio'])
+        libro.seq = datos.get('seq', 0)
+        libro.agregados = Agregados.calcular(libro.ventas, libro.gastos)
+        for tabla in ('ventas', 'gastos'):
+            libro.ultimo_id[tabla] = max(datos.get('ultimo_id', {}).get(tabla, 0), libro.ultimo_id[tabla])
+        return libro
+
+    @classmethod
+    def desde_almacen(cls, almacen):
+        """Cargar los datos recientes y los consolidados de un almacenamiento
+
+        Las particiones archivadas entran solo por su resumen y se cargan
+        cuando una consulta llega a sus fechas.
+        """
+        datos, particiones = almacen.cargar_reciente()
+        libro = cls.desde_datos(datos)
+        libro.usar_particiones(particiones, almacen.cargar_particion)
+        libro.usar_consolidados(Consolidados.desde_datos(almacen.cargar_consolidados()))
+        return libro
+
+    def _extender(self, ventas, gastos):
+        """Agregar filas en bloque e indexar sus IDs, sin tocar los agregados"""
+        for tabla, registros, convertir, tipos in (('ventas', ventas, _fila_venta, TIPOS_VENTAS),
+                                                   ('gastos', gastos, self._fila_gasto, TIPOS_GASTOS)):
+            filas = [convertir(r) for r in registros]
+            if not filas:
+                continue
+            columnas = getattr(self, tabla)
+            inicio = len(columnas)
+            columnas.extender({c: [f[c] for f in filas] for c in tipos})
+            ids = columnas['id'][inicio:]
+            # Recorrido inverso para que, ante IDs repetidos, gane el primero (y lo ya indexado)
+            nuevas = dict(zip(ids[::-1].tolist(), range(len(columnas) - 1, inicio - 1, -1)))
+            nuevas.update(self.posiciones[tabla])
+            self.posiciones[tabla] = nuevas
+            self.ultimo_id[tabla] = max(self.ultimo_id[tabla], int(ids.max()))
+
+    def usar_particiones(self, particiones, cargador):
+        """Incorporar el resumen de las particiones archivadas; `cargador(año)` trae sus filas"""
+        self.particiones = dict(particiones)
+        self._cargador = cargador
+        for resumen in self.particiones.values():
+            for dia, totales in resumen['por_dia'].items():
+                self.agregados.sumar_totales(dia, totales)
+
+    def _cargar_particiones(self, anios):
+        """Cargar las particiones indicadas que aún no están en memoria"""
+        pendientes = sorted(a for a in anios if a in self.particiones and a not in self._particiones_cargadas)
+        if not pendientes:
+            return
+        with self._bloqueo:
+            for anio in pendientes:
+                if anio in self._particiones_cargadas:
+                    continue
+                particion = self._cargador(anio)
+                # Sus totales ya están en los agregados (por el resumen); solo faltan las filas
+                self._extender(
+                    [v for v in particion['ventas'] if v['id'] not in self.posiciones['ventas']],
+                    [g for g in particion['gastos'] if g['id'] not in self.posiciones['gastos']]
+                )
+                self._particiones_cargadas.add(anio)
+
+    def asegurar_rango(self, fecha_inicio=None, fecha_fin=None):
+        """Cargar las particiones archivadas que se solapan con un rango de fechas"""
+        if len(self._particiones_cargadas) == len(self.particiones):
+            return
+        desde = '0000' if fecha_inicio is None else str(fecha_inicio)[:4]
+        hasta = '9999' if fecha_fin is None else str(fecha_fin)[:4]
+        self._cargar_particiones(a for a in self.particiones if desde <= a <= hasta)
+
+    def codigo_clasificacion(self, nombre):
+        """Código categórico de una clasificación (se crea si es nueva)"""
+        codigo = self._codigos.get(nombre)
+        if codigo is None:
+            codigo = len(self.clasificaciones)
+            self.clasificaciones.append(nombre)
+            self._codigos[nombre] = codigo
+        return codigo
+
+    def _fila_gasto(self, gasto):
+        return {
+            'id': gasto['id'],
+            'fecha': gasto['fecha'],
+            'clasificacion': self.codigo_clasificacion(gasto['clasificacion']),
+            'descripcion': gasto.get('descripcion', ''),
+            'monto_bs': gasto['monto_bs'],
+            'monto_usd': gasto['monto_usd'],
+            'tasa_cambio': gasto.get('tasa_cambio') or np.nan,
+            'pagado': gasto.get('pagado', False),
+            'fecha_pago': gasto.get('fecha_pago')
+        }
+
+    def aplicar(self, evento):
+        """Aplicar un evento del almacenamiento"""
+        with self._bloqueo:
+            try:
+                self._aplicar(evento)
+            finally:
+                self.version += 1
+
+    def memorizar(self, clave, calcular):
+        """Resultado de una consulta de solo lectura, calculado una vez por versión del libro"""
+        # Con el bloqueo tomado la versión de la clave es la que vio el cálculo
+        with self._bloqueo:
+            return self.consultas.obtener((self.version,) + tuple(clave), calcular)
+
+    def _aplicar(self, evento):
+        tipo = evento['evento']
+
+        if tipo == 'venta_agregada':
+            self._agregar_venta(evento['venta'])
+        elif tipo == 'gasto_agregado':
+            self._agregar_gasto(evento['gasto'])
+        elif tipo == 'ventas_agregadas':
+            for venta in evento['ventas']:
+                self._agregar_venta(venta)
+        elif tipo == 'gastos_agregados':
+            for gasto in evento['gastos']:
+                self._agregar_gasto(gasto)
+        elif tipo == 'gasto_pagado':
+            self._pagar(evento['id'], evento['fecha_pago'])
+        elif tipo == 'gastos_pagados':
+            for id_gasto in evento['ids']:
+                self._pagar(id_gasto, evento['fecha_pago'])
+        elif tipo == 'tasa_agregada':
+            self.tasas.agregar(evento['tasa'])
+        else:
+            raise ValueError(f"Evento desconocido: {tipo}")
+
+        self.seq = evento.get('seq', self.seq)
+
+    def _agregar_venta(self, venta):
+        fila = _fila_venta(venta)
+        self._indexar('ventas', fila['id'])
+        self.ventas.agregar(fila)
+        self.agregados.sumar_venta(fila['fecha'], fila['total_bs'], fila['total_usd'])
+        self._tocar_mes(fila['fecha'])
+
+    def _agregar_gasto(self, gasto):
+        fila = self._fila_gasto(gasto)
+        self._indexar('gastos', fila['id'])
+        self.gastos.agregar(fila)
+        self.agregados.sumar_gasto(fila['fecha'], fila['monto_bs'], fila['monto_usd'], fila['pagado'])
+        self.version_gastos += 1
+        self._tocar_mes(fila['fecha'])
+
+    def _pagar(self, id_gasto, fecha_pago):
+        i = self.posiciones['gastos'].get(id_gasto)
+        if i is not None and not self.gastos['pagado'][i]:
+            self.gastos['pagado'][i] = True
+            self.gastos['fecha_pago'][i] = fecha_pago
+            self.agregados.marcar_pagado(self.gastos['fecha'][i], self.gastos['monto_bs'][i],
+                                         self.gastos['monto_usd'][i])
+            self.version_gastos += 1
+            self._tocar_mes(self.gastos['fecha'][i])
+
+    def _tocar_mes(self, fecha):
+        """Marcar para consolidar de nuevo el mes de `fecha` si ya estaba consolidado"""
+        mes = str(fecha)[:7]
+        if mes in self.consolidados.meses:
+            self._meses_cambiados.add(mes)
+
+    def _indexar(self, tabla, id_registro):
+        """Registrar la posición de la fila que está por agregarse"""
+        self.posiciones[tabla].setdefault(id_registro, len(getattr(self, tabla)))
+        self.ultimo_id[tabla] = max(self.ultimo_id[tabla], id_registro)
+
+    def siguiente_id(self, tabla):
+        """ID libre para un registro nuevo de 'ventas' o 'gastos', en O(1)"""
+        return self.ultimo_id[tabla] + 1
+
+    def posicion(self, tabla, id_registro):
+        """Posición de un registro por su ID, o None si no existe"""
+        return self.posiciones[tabla].get(id_registro)
+
+    @property
+    def tasas_cambio(self):
+        """Tasas registradas, en orden de registro"""
+        return self.tasas.historial
+
+    def tasa_actual(self):
+        """Tasa de cambio más reciente"""
+        return self.tasas.actual()
+
+    def tasa_en(self, fecha):
+        """Tasa de cambio vigente en una fecha"""
+        return self.tasas.tasa_en(fecha)
+
+    def _mascara_fechas(self, tabla, fecha_inicio, fecha_fin):
+        fechas = tabla['fecha']
+        mascara = np.ones(len(fechas), dtype=bool)
+        if fecha_inicio is not None:
+            mascara &= fechas >= _fecha(fecha_inicio)
+        if fecha_fin is not None:
+            mascara &= fechas <= _fecha(fecha_fin)
+        return mascara
+
+    @_con_bloqueo
+    def resumen(self, periodo=None):
+        """Totales mantenidos al escribir: todos los tiempos, un día o un mes, en O(1)"""
+        return self.agregados.resumen(periodo)
+
+    @_con_bloqueo
+    def resumen_rango(self, fecha_inicio=None, fecha_fin=None):
+        """Totales de un período en O(log n) usando las sumas prefijas por día"""
+        return self.agregados.resumen_rango(fecha_inicio, fecha_fin)
+
+    def _huella(self, mes, ventas, gastos):
+        """Totales y conteos de un mes consolidado, para validarlo al cargar"""
+        totales = self.agregados.por_mes.get(mes) or dict.fromkeys(CAMPOS_TOTALES, 0.0)
+        return {
+            'totales': [totales[c] for c in CAMPOS_TOTALES],
+            'ventas': int(ventas['cantidad'].sum()),
+            'gastos': int(gastos['cantidad'].sum()),
+            'pagados': int(gastos.loc[gastos['pagado'], 'cantidad'].sum())
+        }
+
+    def _conteos_por_mes(self):
+        """Ventas, gastos y gastos pagados por mes, en una pasada por columna"""
+        conteos = {}
+        for clave, fechas in (('ventas', self.ventas['fecha']), ('gastos', self.gastos['fecha']),
+                              ('pagados', self.gastos['fecha'][self.gastos['pagado']])):
+            meses, cantidades = np.unique(fechas.astype('datetime64[M]'), return_counts=True)
+            conteos[clave] = dict(zip(meses.astype(str).tolist(), cantidades.tolist()))
+        # Las particiones sin cargar cuentan por su resumen
+        for anio, resumen in self.particiones.items():
+            if anio in self._particiones_cargadas:
+                continue
+            for mes, cantidades in resumen['conteos'].items():
+                for clave in conteos:
+                    conteos[clave][mes] = conteos[clave].get(mes, 0) + cantidades[clave]
+        return conteos
+
+    @_con_bloqueo
+    def usar_consolidados(self, consolidados, hoy=None):
+        """Adoptar consolidados persistidos, descartando los meses que ya no coinciden"""
+        abierto = str(np.datetime64(hoy or datetime.date.today(), 'M'))
+        conteos = self._conteos_por_mes()
+        for mes, contenido in list(consolidados.meses.items()):
+            huella = contenido['huella']
+            totales = self.agregados.por_mes.get(mes) or dict.fromkeys(CAMPOS_TOTALES, 0.0)
+            valida = (
+                mes < abierto
+                and np.allclose(huella['totales'], [totales[c] for c in CAMPOS_TOTALES],
+                                rtol=1e-9, atol=1e-6)
+                and all(huella[clave] == conteos[clave].get(mes, 0) for clave in conteos)
+            )
+            if not valida:
+                consolidados.descartar(mes)
+        self.consolidados = consolidados
+        self._meses_cambiados.clear()
+
+    @_con_bloqueo
+    def consolidar(self, hoy=None):
+        """Consolidar los meses cerrados que faltan o que cambiaron; devuelve esos meses
+
+        Es O(meses) cuando no hay nada que hacer, así que puede llamarse antes de cada consulta.
+        """
+        abierto = str(np.datetime64(hoy or datetime.date.today(), 'M'))
+        meses = sorted(
+            mes for mes in self.agregados.por_mes
+            if mes < abierto and (mes not in self.consolidados.meses or mes in self._meses_cambiados)
+        )
+        for mes in meses:
+            primero, ultimo = limites_mes(mes)
+            archivados = self._mes_archivado(mes)
+            if archivados is None:
+                self.asegurar_rango(primero, ultimo)
+            ventas = agrupar_ventas(self.ventas, self.indice_ventas.rango(primero, ultimo))
+            gastos = agrupar_gastos(self.gastos, self.clasificaciones, self.indice_gastos.rango(primero, ultimo))
+            if archivados is not None:
+                ventas, gastos = sumar_archivados(ventas, gastos, archivados)
+            self.consolidados.reemplazar(mes, self._huella(mes, ventas, gastos), ventas, gastos)
+        self._meses_cambiados.clear()
+        self._mes_abierto = abierto
+        return meses
+
+    def _mes_archivado(self, mes):
+        """Totales por día de las filas de `mes` en una partición sin cargar, o None si hay que cargarla
+
+        El resumen de la partición los trae (ver resumir_particion); los índices
+        escritos antes de que existieran obligan a cargar la partición.
+        """
+        anio = mes[:4]
+        resumen = self.particiones.get(anio)
+        if resumen is None or anio in self._particiones_cargadas or 'meses' not in resumen:
+            return None
+        return resumen['meses'].get(mes, {'ventas': [], 'gastos': []})
+
+    @_con_bloqueo
+    def ventas_por_canal(self, fecha_inicio=None, fecha_fin=None):
+        """Ventas por canal de pago: meses consolidados completos más recorrido de los bordes"""
+        self.consolidar()
+        meses, bordes = self.consolidados.tramos(fecha_inicio, fecha_fin)
+        totales = dict.fromkeys(CAMPOS_VENTAS, 0.0)
+        for mes in meses:
+            for campo, valor in self.consolidados.meses[mes]['ventas_mes'].items():
+                totales[campo] += valor
+        for inicio, fin in bordes:
+            self.asegurar_rango(inicio, fin)
+            posiciones = self.indice_ventas.rango(inicio, fin)
+            for campo in CAMPOS_VENTAS[:-1]:
+                totales[campo] += float(self.ventas[campo][posiciones].sum())
+            totales['cantidad'] += len(posiciones)
+        totales['cantidad'] = int(totales['cantidad'])
+        return totales
+
+    @_con_bloqueo
+    def cubo_gastos(self):
+        """Cubo día × clasificación × pagado (se recalcula solo si cambiaron los gastos)
+
+        Los meses cerrados salen de los consolidados; solo el mes en curso (y
+        fechas futuras) se agrupa desde los gastos individuales.
+        """
+        if self._cubo is None or self._cubo[0] != self.version_gastos:
+            self.consolidar()
+            primero, _ = limites_mes(self._mes_abierto)
+            abiertas = agrupar_gastos(self.gastos, self.clasificaciones, self.indice_gastos.rango(primero, None))
+            cerradas = self.consolidados.gastos_dia()
+            celdas = abiertas if cerradas is None else pd.concat([cerradas, abiertas], ignore_index=True)
+            self._cubo = (self.version_gastos, CuboGastos(celdas))
+        return self._cubo[1]
+
+    @_con_bloqueo
+    def verificar_agregados(self):
+        """Recalcular los agregados desde cero y devolver las diferencias encontradas"""
+        self.asegurar_rango()
+        return self.agregados.diferencias(Agregados.calcular(self.ventas, self.gastos))
+
+    @_con_bloqueo
+    def marco_ventas(self, seleccion=None):
+        """DataFrame de ventas (filtradas por máscara o posiciones) con fechas ISO"""
+        if seleccion is None:
+            seleccion = slice(None)
+        marco = pd.DataFrame({c: self.ventas[c][seleccion] for c in TIPOS_VENTAS})
+        marco['fecha'] = _fechas_iso(self.ventas['fecha'][seleccion])
+        return marco
+
+    @_con_bloqueo
+    def marco_gastos(self, seleccion=None):
+        """DataFrame de gastos con clasificación categórica y fechas ISO"""
+        if seleccion is None:
+            seleccion = slice(None)
+        marco = pd.DataFrame({c: self.gastos[c][seleccion] for c in TIPOS_GASTOS})
+        marco['fecha'] = _fechas_iso(self.gastos['fecha'][seleccion])
+        marco['fecha_pago'] = _fechas_iso(self.gastos['fecha_pago'][seleccion])
+        marco['clasificacion'] = pd.Categorical.from_codes(
+            self.gastos['clasificacion'][seleccion], categories=self.clasificaciones)
+        return marco
+
+    @_con_bloqueo
+    def ventas_entre(self, fecha_inicio, fecha_fin):
+        """Ventas dentro del rango de fechas (inclusivo), ordenadas por fecha"""
+        self.asegurar_rango(fecha_inicio, fecha_fin)
+        return self.marco_ventas(self.indice_ventas.rango(fecha_inicio, fecha_fin))
+
+    @_con_bloqueo
+    def gastos_entre(self, fecha_inicio, fecha_fin, pagado=None):
+        """Gastos dentro del rango de fechas, opcionalmente por estado de pago"""
+        self.asegurar_rango(fecha_inicio, fecha_fin)
+        posiciones = self.indice_gastos.rango(fecha_inicio, fecha_fin)
+        if pagado is not None:
+            posiciones = posiciones[self.gastos['pagado'][posiciones] == pagado]
+        return self.marco_gastos(posiciones)
+
+    def _mascara_pendientes(self, clasificaciones=None, fecha_inicio=None, fecha_fin=None):
+        mascara = ~self.gastos['pagado'] & self._mascara_fechas(self.gastos, fecha_inicio, fecha_fin)
+        if clasificaciones is not None:
+            codigos = [self._codigos[c] for c in clasificaciones if c in self._codigos]
+            mascara &= np.isin(self.gastos['clasificacion'], codigos)
+        return mascara
+
+    @_con_bloqueo
+    def contar_pendientes(self, clasificaciones=None, fecha_inicio=None, fecha_fin=None):
+        """Cantidad de gastos no pagados que cumplen los filtros"""
+        return int(self._mascara_pendientes(clasificaciones, fecha_inicio, fecha_fin).sum())
+
+    @_con_bloqueo
+    def pagina_pendientes(self, clasificaciones=None, fecha_inicio=None, fecha_fin=None,
+                          orden='fecha', descendente=False, pagina=0, tamano=20):
+        """Una página de gastos pendientes ordenados; solo esa página se convierte en DataFrame
+
+        Devuelve (marco, total de pendientes que cumplen los filtros).
+        """
+        posiciones = np.flatnonzero(self._mascara_pendientes(clasificaciones, fecha_inicio, fecha_fin))
+        clave = self.gastos[orden][posiciones]
+        if orden == 'clasificacion':
+            # Ordenar por nombre, no por código
+            nombres = np.array(self.clasificaciones, dtype=object)
+            rangos = np.empty(len(nombres), dtype=np.int64)
+            rangos[np.argsort(nombres)] = np.arange(len(nombres))
+            clave = rangos[clave]
+        if clave.dtype.kind == 'M':
+            clave = clave.view(np.int64)
+        # El ID desempata para que el orden sea estable entre reruns
+        ids = self.gastos['id'][posiciones]
+        if descendente:
+            clave, ids = -clave, -ids
+        orden_filas = np.lexsort((ids, clave))
+        inicio = pagina * tamano
+        return self.marco_gastos(posiciones[orden_filas[inicio:inicio + tamano]]), len(posiciones)
+
+    @_con_bloqueo
+    def resumen_pendientes(self):
+        """Total pendiente y cantidad de gastos por clasificación, en una pasada"""
+        pendientes = ~self.gastos['pagado']
+        codigos = self.gastos['clasificacion'][pendientes].astype(np.intp)
+        minimo = len(self.clasificaciones)
+        resumen = pd.DataFrame({
+            'clasificacion': self.clasificaciones,
+            'monto_bs': np.bincount(codigos, weights=self.gastos['monto_bs'][pendientes], minlength=minimo),
+            'monto_usd': np.bincount(codigos, weights=self.gastos['monto_usd'][pendientes], minlength=minimo),
+            'cantidad': np.bincount(codigos, minlength=minimo)
+        })
+        return resumen[resumen['cantidad'] > 0].reset_index(drop=True)
+
+    @_con_bloqueo
+    def antiguedad_pendientes(self, hoy, valor='monto_bs'):
+        """Cuentas por pagar por clasificación (filas) y tramo de antigüedad (columnas), en una pasada
+
+        `valor` es 'monto_bs', 'monto_usd' (revaluado a la tasa actual, que es lo
+        que costaría pagarlas hoy) o 'cantidad'.
+        """
+        pendientes = np.flatnonzero(~self.gastos['pagado'])
+        dias = (_fecha(hoy) - self.gastos['fecha'][pendientes]).astype(np.int64)
+        tramos = len(TRAMOS_ANTIGUEDAD)
+        celdas = (self.gastos['clasificacion'][pendientes].astype(np.intp) * tramos
+                  + np.searchsorted(LIMITES_ANTIGUEDAD, dias, 'left'))
+        minimo = len(self.clasificaciones) * tramos
+        cantidades = np.bincount(celdas, minlength=minimo).reshape(-1, tramos)
+        if valor == 'cantidad':
+            matriz = cantidades
+        else:
+            matriz = np.bincount(celdas, weights=self.gastos['monto_bs'][pendientes], minlength=minimo).reshape(-1, tramos)
+            if valor == 'monto_usd':
+                matriz = matriz / self._tasa_obligatoria()
+
+        antiguedad = pd.DataFrame(matriz, columns=TRAMOS_ANTIGUEDAD,
+                                  index=pd.Index(self.clasificaciones, name='clasificacion'))
+        antiguedad['total'] = antiguedad.sum(axis=1)
+        return antiguedad[cantidades.sum(axis=1) > 0].reset_index()
+
+    @_con_bloqueo
+    def proyeccion_caja(self, hoy, dias=30, plazo=30, ventana=28, saldo_inicial=None):
+        """Saldo de caja proyectado día a día, en dólares a la tasa actual
+
+        Entradas: venta promedio de cada día de la semana en las últimas `ventana`
+        jornadas completas (en dólares a la tasa de cada venta). Salidas: cada
+        gasto pendiente vence `plazo` días después de su fecha, revaluado a la
+        tasa actual; los vencidos se cuentan hoy. El saldo inicial es por defecto
+        el balance acumulado (ventas - gastos pagados) a la tasa actual.
+        """
+        tasa = self._tasa_obligatoria()
+        hoy = _fecha(hoy)
+        fechas = hoy + np.arange(dias)
+
+        # Venta diaria de la ventana, una casilla por día, y su promedio por día de la semana
+        inicio = hoy - ventana
+        self.asegurar_rango(str(inicio), str(hoy - 1))
+        posiciones = self.indice_ventas.rango(str(inicio), str(hoy - 1))
+        diaria = np.bincount((self.ventas['fecha'][posiciones] - inicio).astype(np.intp),
+                             weights=self.ventas['total_usd'][posiciones], minlength=ventana)
+        # 1970-01-01 fue jueves: (días + 3) % 7 da 0 para el lunes
+        semana_ventana = (inicio + np.arange(ventana)).astype(np.int64) % 7
+        jornadas = np.bincount((semana_ventana + 3) % 7, minlength=7)
+        promedio = np.bincount((semana_ventana + 3) % 7, weights=diaria, minlength=7) / np.maximum(jornadas, 1)
+        ingresos = promedio[(fechas.astype(np.int64) + 3) % 7]
+
+        # Pagos: vencimiento de cada pendiente, acumulado por día dentro del horizonte
+        pendientes = np.flatnonzero(~self.gastos['pagado'])
+        vence = np.maximum((self.gastos['fecha'][pendientes] + plazo - hoy).astype(np.int64), 0)
+        dentro = vence < dias
+        pagos = np.bincount(vence[dentro], weights=self.gastos['monto_bs'][pendientes[dentro]],
+                            minlength=dias) / tasa
+
+        if saldo_inicial is None:
+            saldo_inicial = self.resumen()['balance_bs'] / tasa
+        flujo = ingresos - pagos
+        return pd.DataFrame({
+            'fecha': _fechas_iso(fechas),
+            'ingresos_usd': ingresos,
+            'pagos_usd': pagos,
+            'flujo_usd': flujo,
+            'saldo_usd': saldo_inicial + np.cumsum(flujo)
+        })
+
+    def _tasa_obligatoria(self):
+        tasa = self.tasa_actual()
+        if tasa is None:
+            raise ValueError("Debes configurar una tasa de cambio primero")
+        return tasa
+
+    @_con_bloqueo
+    def gastos_pagados_desde(self, fecha):
+        """Gastos pagados con fecha de pago igual o posterior a `fecha`"""
+        self._cargar_particiones(a for a, resumen in self.particiones.items()
+                                 if (resumen['ultimo_pago'] or '') >= str(fecha))
+        # NaT nunca cumple la comparación, así que los pendientes quedan fuera
+        mascara = self.gastos['pagado'] & (self.gastos['fecha_pago'] >= _fecha(fecha))
+        return self.marco_gastos(mascara)
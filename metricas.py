@@ -0,0 +1,194 @@
+"""Tiempos de las rutas calientes (cargas, guardados, consultas y páginas) con resúmenes p50/p95
+
+Cada medición queda en memoria (una ventana acotada por nombre) para el panel de
+diagnóstico y, si se configura un registro, se agrega como una línea JSON a un
+archivo rotativo que puede resumirse después.
+
+Uso desde la terminal:
+    python metricas.py balance_metricas.jsonl
+    python metricas.py balance_metricas.jsonl --por-tamano --json
+"""
+import argparse
+import datetime
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+import numpy as np
+import pandas as pd
+
+# Mediciones que se conservan en memoria por nombre
+VENTANA = 500
+
+# Rotación del registro: tamaño máximo de cada archivo y cantidad de copias anteriores
+MAX_BYTES_REGISTRO = 5 * 1024 * 1024
+COPIAS_REGISTRO = 5
+
+COLUMNAS_RESUMEN = ['nombre', 'llamadas', 'p50_ms', 'p95_ms', 'max_ms', 'bytes', 'registros']
+
+
+class Metricas:
+    """Mediciones de un proceso, compartidas por todas las sesiones e hilos"""
+
+    def __init__(self, ventana=VENTANA):
+        self.ventana = ventana
+        self._bloqueo = threading.Lock()
+        self._muestras = {}
+        self._llamadas = {}
+        self._contadores = {}
+        self._registro = None
+        self._ruta_registro = None
+
+    def configurar_registro(self, ruta, max_bytes=MAX_BYTES_REGISTRO, copias=COPIAS_REGISTRO):
+        """Agregar cada medición a un JSONL rotativo en `ruta` (None lo desactiva)"""
+        with self._bloqueo:
+            if ruta == self._ruta_registro:
+                return
+            if self._registro is not None:
+                for manejador in list(self._registro.handlers):
+                    self._registro.removeHandler(manejador)
+                    manejador.close()
+                self._registro = None
+            self._ruta_registro = ruta
+            if ruta is None:
+                return
+            registro = logging.getLogger(f"{__name__}.{id(self)}")
+            registro.setLevel(logging.INFO)
+            registro.propagate = False
+            manejador = RotatingFileHandler(ruta, maxBytes=max_bytes, backupCount=copias, encoding='utf-8')
+            manejador.setFormatter(logging.Formatter('%(message)s'))
+            registro.addHandler(manejador)
+            self._registro = registro
+
+    def anotar(self, nombre, segundos, **datos):
+        """Guardar una medición ya tomada; `datos` puede traer bytes, registros u otros campos"""
+        muestra = dict(datos, segundos=segundos)
+        with self._bloqueo:
+            if nombre not in self._muestras:
+                self._muestras[nombre] = deque(maxlen=self.ventana)
+            self._muestras[nombre].append(muestra)
+            self._llamadas[nombre] = self._llamadas.get(nombre, 0) + 1
+            registro = self._registro
+        if registro is not None:
+            registro.info(json.dumps(
+                dict(ts=datetime.datetime.now().isoformat(timespec='milliseconds'), nombre=nombre, **muestra),
+                ensure_ascii=False, default=str
+            ))
+
+    @contextmanager
+    def medir(self, nombre, **datos):
+        """Medir el bloque; el dict entregado admite completar bytes o registros al terminar"""
+        medicion = dict(datos)
+        inicio = time.perf_counter()
+        try:
+            yield medicion
+        finally:
+            self.anotar(nombre, time.perf_counter() - inicio, **medicion)
+
+    def medido(self, nombre=None):
+        """Decorador que mide cada llamada a la función"""
+        def decorar(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with self.medir(nombre or funcion.__name__):
+                    return funcion(*args, **kwargs)
+            return envoltura
+        return decorar
+
+    def contar(self, nombre, cantidad=1):
+        """Sumar a un contador (reruns, por ejemplo)"""
+        with self._bloqueo:
+            self._contadores[nombre] = self._contadores.get(nombre, 0) + cantidad
+
+    def contadores(self):
+        with self._bloqueo:
+            return dict(self._contadores)
+
+    def resumen(self):
+        """p50, p95 y máximo en milisegundos de la ventana de cada medición, con los últimos bytes y registros"""
+        with self._bloqueo:
+            muestras = {nombre: list(valores) for nombre, valores in self._muestras.items()}
+            llamadas = dict(self._llamadas)
+        filas = []
+        for nombre, valores in sorted(muestras.items()):
+            ms = np.array([m['segundos'] for m in valores]) * 1000
+            ultima = valores[-1]
+            filas.append([nombre, llamadas[nombre], *np.percentile(ms, [50, 95]), ms.max(),
+                          ultima.get('bytes'), ultima.get('registros')])
+        return pd.DataFrame(filas, columns=COLUMNAS_RESUMEN)
+
+
+# Mediciones del proceso; los módulos usan las funciones de abajo
+METRICAS = Metricas()
+configurar_registro = METRICAS.configurar_registro
+anotar = METRICAS.anotar
+medir = METRICAS.medir
+medido = METRICAS.medido
+contar = METRICAS.contar
+contadores = METRICAS.contadores
+resumen = METRICAS.resumen
+
+
+def _tamano(registros):
+    """Orden de magnitud del libro, para comparar mediciones con tamaños parecidos"""
+    if registros is None or pd.isna(registros):
+        return "sin dato"
+    if registros < 1:
+        return "0"
+    return f"≥{10 ** int(math.log10(registros)):,}"
+
+
+def leer_registro(ruta):
+    """Mediciones del registro y de sus copias rotadas, de la más antigua a la más reciente"""
+    lineas = []
+    for copia in range(COPIAS_REGISTRO, -1, -1):
+        archivo = f"{ruta}.{copia}" if copia else ruta
+        if not os.path.exists(archivo):
+            continue
+        with open(archivo, encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    lineas.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    # Línea cortada por una rotación o un cierre abrupto
+                    continue
+    return pd.DataFrame(lineas)
+
+
+def resumir_registro(ruta, por_tamano=False):
+    """p50/p95 por medición (y por tamaño del libro) de todo lo registrado en `ruta`"""
+    mediciones = leer_registro(ruta)
+    if mediciones.empty:
+        return pd.DataFrame(columns=['nombre', 'llamadas', 'p50_ms', 'p95_ms', 'max_ms'])
+    mediciones['ms'] = mediciones['segundos'] * 1000
+    claves = ['nombre']
+    if por_tamano:
+        registros = mediciones['registros'] if 'registros' in mediciones else pd.Series(np.nan, index=mediciones.index)
+        mediciones['tamano_libro'] = registros.map(_tamano)
+        claves.append('tamano_libro')
+    return (mediciones.groupby(claves)['ms']
+            .agg(llamadas='count', p50_ms='median', p95_ms=lambda ms: ms.quantile(0.95), max_ms='max')
+            .reset_index())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumen p50/p95 del registro de métricas")
+    parser.add_argument("registro")
+    parser.add_argument("--por-tamano", action="store_true", help="separar por tamaño del libro")
+    parser.add_argument("--json", action="store_true", help="salida en JSON")
+    args = parser.parse_args()
+
+    resultado = resumir_registro(args.registro, args.por_tamano)
+    print(resultado.to_json(orient='records', force_ascii=False) if args.json
+          else resultado.to_string(index=False, float_format=lambda x: f"{x:,.1f}"))
+
+
+if __name__ == "__main__":
+    main()
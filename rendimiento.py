@@ -0,0 +1,270 @@
+"""Benchmark con libros sintéticos: carga, guardado y el cálculo de cada página
+
+Uso: python rendimiento.py --tamanos 1000 100000 1000000 --salida rendimiento.json
+     python rendimiento.py --base rendimiento_base.json --tolerancia 0.25
+Termina con código 1 si alguna medición empeora más que la tolerancia respecto a la base.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import contabilidad
+import almacenamiento
+from almacenamiento import cargar_datos, crear_almacen, datos_vacios, guardar_datos, migrar_datos
+from libro import Libro
+from tasas import LineaTasas
+
+CLASIFICACIONES = [
+    "Gastos administrativos",
+    "Gastos Mantenimiento",
+    "Gastos Nómina",
+    "Gastos Venta",
+    "Gastos x Compras Materia Prima"
+]
+
+# Diferencias menores a esto se consideran ruido al comparar con la base
+RUIDO_S = 0.001
+
+
+def generar_datos(registros, pendientes=0.2, proporcion_gastos=0.5, dias=730, tasas=None,
+                  hoy=None, semilla=0):
+    """Libro sintético con `registros` ventas + gastos repartidos en `dias` días
+
+    `pendientes` es la fracción de gastos sin pagar y `tasas` la cantidad de
+    tasas de cambio del historial (por defecto una por día).
+    """
+    aleatorio = np.random.default_rng(semilla)
+    hoy = np.datetime64(hoy or datetime.date.today(), 'D')
+    datos = datos_vacios()
+
+    # Historial de tasas: caminata aleatoria creciente, fechas distintas dentro del período
+    tasas = min(tasas or dias, dias)
+    desplazamientos = np.sort(aleatorio.choice(dias, size=tasas, replace=False))
+    fechas_tasas = hoy - (dias - 1) + desplazamientos
+    valores_tasas = 36.0 * np.cumprod(1 + aleatorio.normal(0.002, 0.01, tasas))
+    datos['tasas_cambio'] = [
+        {'fecha': str(f), 'tasa': round(float(t), 4)} for f, t in zip(fechas_tasas, valores_tasas)
+    ]
+    linea = LineaTasas(datos['tasas_cambio'])
+
+    def fechas_y_tasas(n):
+        fechas = np.sort(hoy - aleatorio.integers(0, dias, n))
+        tasas_registro = linea.tasas_en(fechas)
+        # Antes de la primera tasa se usa la primera, como hace el formulario
+        tasas_registro[np.isnan(tasas_registro)] = valores_tasas[0]
+        return fechas.astype(str).tolist(), tasas_registro.tolist()
+
+    n_gastos = int(registros * proporcion_gastos)
+    n_ventas = registros - n_gastos
+
+    fechas, tasas_venta = fechas_y_tasas(n_ventas)
+    canales = aleatorio.uniform(0, 5000, (4, n_ventas)).round(2)
+    totales = canales.sum(axis=0)
+    datos['ventas'] = [
+        {'id': i + 1, 'fecha': fecha, 'punto_venta_bs': pv, 'dolar_cash_bs': dc,
+         'venta_externa_bs': ve, 'bs_cash_bs': bc, 'total_bs': total, 'total_usd': total / tasa,
+         'descripcion': '', 'tasa_cambio': tasa}
+        for i, (fecha, pv, dc, ve, bc, total, tasa)
+        in enumerate(zip(fechas, *canales.tolist(), totales.tolist(), tasas_venta))
+    ]
+
+    fechas, tasas_gasto = fechas_y_tasas(n_gastos)
+    montos = aleatorio.uniform(10, 20000, n_gastos).round(2).tolist()
+    clasificaciones = aleatorio.integers(0, len(CLASIFICACIONES), n_gastos).tolist()
+    pagados = (aleatorio.random(n_gastos) >= pendientes).tolist()
+    demoras = aleatorio.integers(0, 30, n_gastos)
+    fechas_pago = np.minimum(np.array(fechas, dtype='datetime64[D]') + demoras, hoy).astype(str).tolist()
+    datos['gastos'] = [
+        {'id': i + 1, 'fecha': fecha, 'clasificacion': CLASIFICACIONES[c],
+         'descripcion': f"gasto {i + 1}", 'monto_bs': monto, 'monto_usd': monto / tasa,
+         'tasa_cambio': tasa, 'pagado': pagado, 'fecha_pago': fecha_pago if pagado else None}
+        for i, (fecha, c, monto, tasa, pagado, fecha_pago)
+        in enumerate(zip(fechas, clasificaciones, montos, tasas_gasto, pagados, fechas_pago))
+    ]
+
+    datos['ultimo_id'] = {'ventas': n_ventas, 'gastos': n_gastos}
+    return datos
+
+
+def medir(funcion, repeticiones):
+    """Mediana y mínimo, en segundos, de varias ejecuciones de `funcion`"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return {'mediana_s': statistics.median(tiempos), 'minimo_s': min(tiempos), 'repeticiones': repeticiones}
+
+
+def guardar_legible(datos, ruta):
+    """Formato original del snapshot: JSON indentado con el módulo json estándar, sin versión de esquema"""
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump({k: v for k, v in datos.items() if k != 'schema_version'}, f, ensure_ascii=False, indent=2)
+
+
+def cargar_legible(ruta):
+    with open(ruta, 'r', encoding='utf-8') as f:
+        datos = json.load(f)
+    migrar_datos(datos)
+    return datos
+
+
+def medir_tamano(datos, directorio, repeticiones, sqlite=False):
+    """Medir cada operación sobre un libro ya generado"""
+    ruta = os.path.join(directorio, "balance_data.json")
+    hoy = datetime.date.today()
+    inicio_periodo = hoy - datetime.timedelta(days=30)
+    resultados = {}
+    bytes_formato = {}
+
+    # Formato original como referencia de los snapshots actuales
+    ruta_legible = os.path.join(directorio, "legible.json")
+    resultados['guardar_legible'] = medir(lambda: guardar_legible(datos, ruta_legible), repeticiones)
+    resultados['cargar_legible'] = medir(lambda: cargar_legible(ruta_legible), repeticiones)
+    bytes_formato['json_legible'] = os.path.getsize(ruta_legible)
+
+    resultados['guardar_datos'] = medir(lambda: guardar_datos(datos, ruta), repeticiones)
+    resultados['cargar_datos'] = medir(lambda: cargar_datos(ruta), repeticiones)
+    bytes_formato['json'] = os.path.getsize(ruta)
+    if almacenamiento.pa is not None:
+        ruta_arrow = os.path.join(directorio, "balance_data.arrow")
+        resultados['guardar_arrow'] = medir(lambda: guardar_datos(datos, ruta_arrow), repeticiones)
+        resultados['cargar_arrow'] = medir(lambda: cargar_datos(ruta_arrow), repeticiones)
+        bytes_formato['arrow'] = os.path.getsize(ruta_arrow)
+        # Ida y vuelta JSON -> Arrow -> JSON: el snapshot binario no puede perder campos
+        if cargar_datos(ruta_arrow) != cargar_datos(ruta):
+            raise AssertionError("El snapshot Arrow no reproduce el JSON original")
+    resultados['libro_desde_datos'] = medir(lambda: Libro.desde_datos(datos), repeticiones)
+    if sqlite:
+        almacen = crear_almacen("sqlite", os.path.join(directorio, "balance_data.db"))
+        resultados['sqlite_guardar'] = medir(lambda: almacen.guardar(datos), repeticiones)
+        resultados['sqlite_cargar'] = medir(almacen.cargar, repeticiones)
+
+    libro = Libro.desde_datos(datos)
+
+    def inicio():
+        contabilidad.resumen_dia(libro, hoy)
+        contabilidad.resumen_acumulado(libro)
+
+    def ver_balance_memorizado():
+        contabilidad.resumen_periodo(libro, inicio_periodo, hoy)
+        contabilidad.detalle_periodo(libro, inicio_periodo, hoy)
+        contabilidad.ventas_por_canal(libro, inicio_periodo, hoy)
+        contabilidad.resumen_por_clasificacion(libro, inicio_periodo, hoy)
+
+    def ver_balance():
+        # Sin el caché de consultas, para medir el cálculo y no solo la búsqueda
+        libro.consultas.vaciar()
+        ver_balance_memorizado()
+
+    def pendientes():
+        contabilidad.pendientes_por_clasificacion(libro)
+        libro.pagina_pendientes()
+
+    resultados['inicio'] = medir(inicio, repeticiones)
+    resultados['ver_balance'] = medir(ver_balance, repeticiones)
+    resultados['ver_balance_memorizado'] = medir(ver_balance_memorizado, repeticiones)
+    resultados['pendientes'] = medir(pendientes, repeticiones)
+    resultados['antiguedad_proyeccion'] = medir(
+        lambda: (libro.antiguedad_pendientes(hoy, 'monto_usd'), libro.proyeccion_caja(hoy, 90)), repeticiones)
+
+    registros = len(datos['ventas']) + len(datos['gastos'])
+    return {
+        'ventas': len(datos['ventas']),
+        'gastos': len(datos['gastos']),
+        'tasas': len(datos['tasas_cambio']),
+        'bytes_snapshot': os.path.getsize(ruta),
+        'bytes_por_formato': bytes_formato,
+        'json_rapido': almacenamiento.orjson is not None,
+        # Registros por segundo al guardar y cargar cada formato (mediana)
+        'rendimiento_formatos': {
+            operacion: registros / tiempos['mediana_s']
+            for operacion, tiempos in resultados.items()
+            if operacion.startswith(('guardar', 'cargar')) and tiempos['mediana_s'] > 0
+        },
+        'operaciones': resultados
+    }
+
+
+def comparar(reporte, base, tolerancia):
+    """Mediciones cuya mediana empeoró más que `tolerancia` (fracción) respecto a la base"""
+    regresiones = []
+    for tamano, medicion in reporte['resultados'].items():
+        anteriores = base.get('resultados', {}).get(tamano, {}).get('operaciones', {})
+        for operacion, tiempos in medicion['operaciones'].items():
+            if operacion not in anteriores:
+                continue
+            actual, anterior = tiempos['mediana_s'], anteriores[operacion]['mediana_s']
+            if actual > anterior * (1 + tolerancia) and actual - anterior > RUIDO_S:
+                regresiones.append(f"{tamano} registros, {operacion}: {anterior:.4f}s → {actual:.4f}s "
+                                   f"(+{(actual / anterior - 1) * 100:.0f}%)")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="registros por libro (ventas + gastos)")
+    parser.add_argument("--pendientes", type=float, default=0.2, help="fracción de gastos sin pagar")
+    parser.add_argument("--proporcion-gastos", type=float, default=0.5)
+    parser.add_argument("--dias", type=int, default=730, help="días que abarca el libro")
+    parser.add_argument("--tasas", type=int, default=None, help="tasas en el historial (una por día)")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--sqlite", action="store_true", help="medir también el almacenamiento SQLite")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", default="rendimiento.json")
+    parser.add_argument("--base", default=None, help="reporte anterior para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args()
+
+    reporte = {
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('salida', 'base')},
+        'resultados': {}
+    }
+
+    for tamano in args.tamanos:
+        datos = generar_datos(tamano, args.pendientes, args.proporcion_gastos, args.dias,
+                              args.tasas, semilla=args.semilla)
+        directorio = tempfile.mkdtemp(prefix="rendimiento_balance_")
+        try:
+            medicion = medir_tamano(datos, directorio, args.repeticiones, args.sqlite)
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+        reporte['resultados'][str(tamano)] = medicion
+
+        print(f"{tamano} registros ({medicion['bytes_snapshot'] / 1e6:.1f} MB):")
+        for operacion, tiempos in medicion['operaciones'].items():
+            por_segundo = medicion['rendimiento_formatos'].get(operacion)
+            detalle = f" {por_segundo:12,.0f} registros/s" if por_segundo else ""
+            print(f"  {operacion:<20} {tiempos['mediana_s'] * 1000:10.2f} ms{detalle}")
+        print("  tamaños: " + ", ".join(f"{formato} {tamano_archivo / 1e6:.1f} MB"
+                                      for formato, tamano_archivo in medicion['bytes_por_formato'].items()))
+
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    print(f"Reporte: {args.salida}")
+
+    if args.base:
+        with open(args.base, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        regresiones = comparar(reporte, base, args.tolerancia)
+        if regresiones:
+            print("❌ " + "\n❌ ".join(regresiones))
+            sys.exit(1)
+        print(f"✅ Sin regresiones mayores a {args.tolerancia:.0%} respecto a {args.base}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def _fecha(valor):
+    """Convertir una fecha ISO o datetime.date a datetime64[D]"""
+    return np.datetime64(str(valor), 'D')
+
+
+class LineaTasas:
+    """Historial de tasas de cambio ordenado por fecha, con consultas "a la fecha"
+
+    Si hay varias tasas para el mismo día vale la última registrada.
+    """
+
+    def __init__(self, historial=()):
+        self.historial = list(historial)
+        self._fechas = np.empty(0, dtype='datetime64[D]')
+        self._tasas = np.empty(0, dtype=np.float64)
+        self._actual = None
+        self._reconstruir()
+
+    def __len__(self):
+        return len(self.historial)
+
+    def _reconstruir(self):
+        """Ordenar por fecha conservando, para cada día, la última tasa registrada"""
+        if not self.historial:
+            return
+        fechas = np.array([t['fecha'] for t in self.historial], dtype='datetime64[D]')
+        tasas = np.array([t['tasa'] for t in self.historial], dtype=np.float64)
+        orden = np.argsort(fechas, kind='stable')
+        fechas, tasas = fechas[orden], tasas[orden]
+        # Con orden estable, la última de cada grupo de fechas iguales es la más reciente
+        ultimas = np.append(fechas[1:] != fechas[:-1], True)
+        self._fechas = fechas[ultimas]
+        self._tasas = tasas[ultimas]
+        self._actual = float(self._tasas[-1])
+
+    def agregar(self, tasa):
+        """Registrar una tasa ({'fecha', 'tasa'})"""
+        self.historial.append(tasa)
+        fecha = _fecha(tasa['fecha'])
+        if len(self._fechas) and fecha == self._fechas[-1]:
+            self._tasas[-1] = tasa['tasa']
+            self._actual = float(tasa['tasa'])
+        elif not len(self._fechas) or fecha > self._fechas[-1]:
+            # Las tasas son pocas (una por día); copiar al agregar es suficiente
+            self._fechas = np.append(self._fechas, fecha)
+            self._tasas = np.append(self._tasas, tasa['tasa'])
+            self._actual = float(tasa['tasa'])
+        else:
+            self._reconstruir()
+
+    def actual(self):
+        """Tasa vigente más reciente, en O(1)"""
+        return self._actual
+
+    def tasa_en(self, fecha):
+        """Tasa vigente en una fecha (la última registrada en o antes de ella), en O(log n)"""
+        i = np.searchsorted(self._fechas, _fecha(fecha), 'right') - 1
+        if i < 0:
+            return None
+        return float(self._tasas[i])
+
+    def tasas_en(self, fechas):
+        """Tasas vigentes para un arreglo de fechas; NaN antes de la primera tasa"""
+        fechas = np.asarray(fechas, dtype='datetime64[D]')
+        indices = np.searchsorted(self._fechas, fechas, 'right') - 1
+        resultado = np.full(fechas.shape, np.nan)
+        validas = indices >= 0
+        resultado[validas] = self._tasas[indices[validas]]
+        return resultado
@@ -0,0 +1,5 @@
+"""Los módulos de la aplicación están en la raíz del repositorio, sin paquete"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
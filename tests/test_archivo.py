@@ -0,0 +1,76 @@
+"""Archivado por años: lo archivado y lo cargado desde las particiones coincide con el libro completo"""
+import datetime
+
+import pandas as pd
+import pytest
+
+import contabilidad
+from almacenamiento import (AlmacenJSON, archivar, cargar_datos, cargar_indice_archivo, cargar_particion,
+                            corte_reciente, guardar_datos)
+from libro import Libro
+from rendimiento import generar_datos
+
+HOY = datetime.date.today()
+# Cubre el año en curso y los tres anteriores, así siempre hay al menos dos años archivados
+DIAS = (HOY - datetime.date(HOY.year - 3, 1, 1)).days + 1
+
+
+@pytest.fixture
+def archivado(tmp_path):
+    """Ruta de un libro con los años anteriores al corte archivados, y sus datos antes de archivar"""
+    ruta = str(tmp_path / "balance_data.json")
+    datos = generar_datos(3000, dias=DIAS, hoy=HOY, semilla=3)
+    guardar_datos(datos, ruta)
+    original = cargar_datos(ruta)
+    movidos = archivar(ruta)
+    assert len(movidos) >= 2
+    return ruta, original
+
+
+def por_id(registros):
+    return sorted(registros, key=lambda r: r['id'])
+
+
+def test_reciente_mas_particiones_es_el_original(archivado):
+    ruta, original = archivado
+    corte = corte_reciente()
+    reciente = cargar_datos(ruta, archivo=False)
+    particiones = {anio: cargar_particion(ruta, anio) for anio in cargar_indice_archivo(ruta)['particiones']}
+
+    for tabla in ('ventas', 'gastos'):
+        archivados = [r for p in particiones.values() for r in p[tabla]]
+        assert all(r['fecha'] < corte for r in archivados)
+        assert por_id(reciente[tabla] + archivados) == por_id(original[tabla])
+    # Los gastos pendientes nunca se archivan
+    assert all(g['pagado'] for p in particiones.values() for g in p['gastos'])
+    assert por_id(cargar_datos(ruta)['ventas']) == por_id(original['ventas'])
+
+
+def test_libro_con_particiones_equivale_al_completo(archivado):
+    ruta, original = archivado
+    completo = Libro.desde_datos(original)
+    libro = Libro.desde_almacen(AlmacenJSON(ruta))
+    assert libro.particiones
+
+    anio = min(libro.particiones)
+    rangos = [(None, None), (f"{anio}-01-01", f"{anio}-12-31"), (f"{anio}-03-10", str(HOY))]
+    for inicio, fin in rangos:
+        assert contabilidad.resumen_periodo(libro, inicio, fin) == pytest.approx(
+            contabilidad.resumen_periodo(completo, inicio, fin))
+        assert contabilidad.ventas_por_canal(libro, inicio, fin) == pytest.approx(
+            contabilidad.ventas_por_canal(completo, inicio, fin))
+        pd.testing.assert_frame_equal(contabilidad.resumen_por_clasificacion(libro, inicio, fin),
+                                      contabilidad.resumen_por_clasificacion(completo, inicio, fin))
+
+
+def test_consolidar_sin_cargar_particiones(archivado):
+    ruta, original = archivado
+    completo = Libro.desde_datos(original)
+    libro = Libro.desde_almacen(AlmacenJSON(ruta))
+    libro.consolidar()
+    completo.consolidar()
+
+    # Los meses archivados se consolidan desde el resumen del índice
+    assert libro._particiones_cargadas == set()
+    inicio = f"{min(libro.particiones)}-01-01"
+    assert libro.ventas_por_canal(inicio, str(HOY)) == pytest.approx(completo.ventas_por_canal(inicio, str(HOY)))
@@ -0,0 +1,40 @@
+"""Ida y vuelta de los snapshots entre JSON y Arrow"""
+import pytest
+
+import almacenamiento
+from almacenamiento import cargar_datos, convertir_snapshot, guardar_datos, leer_json
+from rendimiento import generar_datos
+
+pytestmark = pytest.mark.skipif(almacenamiento.pa is None, reason="requiere pyarrow")
+
+
+def test_json_arrow_json(tmp_path):
+    datos = generar_datos(500, semilla=1)
+    # Claves sin columna propia en el esquema Arrow
+    datos['ventas'][0]['nota'] = 'cliente frecuente'
+    datos['gastos'][0]['proveedor'] = {'rif': 'J-123', 'nombre': 'Distribuidora'}
+    ruta_json = str(tmp_path / "balance_data.json")
+    ruta_arrow = str(tmp_path / "balance_data.arrow")
+    guardar_datos(datos, ruta_json)
+    original = cargar_datos(ruta_json)
+
+    guardar_datos(original, ruta_arrow)
+    desde_arrow = cargar_datos(ruta_arrow)
+    assert desde_arrow == original
+
+    guardar_datos(desde_arrow, str(tmp_path / "vuelta.json"))
+    assert leer_json(str(tmp_path / "vuelta.json")) == leer_json(ruta_json)
+
+
+def test_convertir_snapshot_conserva_los_datos(tmp_path):
+    datos = generar_datos(200, semilla=2)
+    datos['gastos'][-1]['nota'] = 'pagado en efectivo'
+    ruta_json = str(tmp_path / "balance_data.json")
+    ruta_arrow = str(tmp_path / "balance_data.arrow")
+    guardar_datos(datos, ruta_json)
+    original = cargar_datos(ruta_json)
+
+    convertir_snapshot(ruta_json, ruta_arrow)
+    assert cargar_datos(ruta_arrow) == original
+    convertir_snapshot(ruta_arrow, ruta_json)
+    assert cargar_datos(ruta_json) == original
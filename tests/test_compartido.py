@@ -0,0 +1,111 @@
+"""Escritura diferida: reintentar un lote fallido no repite IDs ni números de secuencia"""
+import pytest
+
+import almacenamiento
+from almacenamiento import AlmacenJSON, AlmacenSQLite, leer_diario
+from compartido import LibroCompartido
+from libro import Libro
+
+
+def tasa(fecha, valor=36.0):
+    return {'evento': 'tasa_agregada', 'tasa': {'fecha': fecha, 'tasa': valor}}
+
+
+def venta(fecha='2024-03-01', total_bs=100.0):
+    return {'evento': 'venta_agregada', 'venta': {
+        'fecha': fecha, 'punto_venta_bs': total_bs, 'dolar_cash_bs': 0.0, 'venta_externa_bs': 0.0,
+        'bs_cash_bs': 0.0, 'total_bs': total_bs, 'total_usd': total_bs / 36.0, 'descripcion': '',
+        'tasa_cambio': 36.0
+    }}
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def crear(request, tmp_path):
+    """Fábrica de almacenamientos sobre la misma ruta, para releer lo guardado"""
+    if request.param == 'json':
+        return lambda: AlmacenJSON(str(tmp_path / "balance_data.json"))
+    return lambda: AlmacenSQLite(str(tmp_path / "balance_data.db"))
+
+
+def fallar_una_vez(monkeypatch, objeto, nombre):
+    original = getattr(objeto, nombre)
+    llamadas = []
+
+    def falla(*args, **kwargs):
+        llamadas.append(args)
+        if len(llamadas) == 1:
+            raise OSError("disco lleno")
+        return original(*args, **kwargs)
+    monkeypatch.setattr(objeto, nombre, falla)
+    return llamadas
+
+
+def test_reintento_sin_ids_repetidos(crear, monkeypatch):
+    almacen = crear()
+    compartido = LibroCompartido(almacen, intervalo_escritura=3600)
+    try:
+        compartido.registrar(tasa('2024-01-01'))
+        compartido.registrar(venta())
+        fallar_una_vez(monkeypatch, almacen, 'registrar_lote')
+        assert compartido.guardar_pendientes() == 0
+        estado = compartido.estado_escritura()
+        assert estado['error'] == "disco lleno"
+        assert estado['pendientes'] == 2
+
+        compartido.registrar(venta())
+        assert compartido.guardar_pendientes() == 3
+        estado = compartido.estado_escritura()
+        assert estado['error'] is None
+        assert estado['pendientes'] == 0
+        assert compartido.guardar_pendientes() == 0
+    finally:
+        compartido.cerrar()
+
+    libro = Libro.desde_almacen(crear())
+    libro.asegurar_rango()
+    assert libro.ventas['id'].tolist() == [1, 2]
+    assert libro.seq == 3
+    assert compartido.obtener().seq == 3
+
+
+def test_diario_fallido_no_adelanta_seq(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "balance_data.json")
+    almacen = AlmacenJSON(ruta)
+    compartido = LibroCompartido(almacen, intervalo_escritura=3600)
+    try:
+        compartido.registrar(tasa('2024-01-01'))
+        compartido.registrar(venta())
+        fallar_una_vez(monkeypatch, almacenamiento, 'agregar_al_diario')
+        assert compartido.guardar_pendientes() == 0
+        assert almacen.seq == 0
+        assert compartido.guardar_pendientes() == 2
+    finally:
+        compartido.cerrar()
+
+    assert [e['seq'] for e in leer_diario(ruta)] == [1, 2]
+    assert almacen.seq == compartido.obtener().seq == 2
+
+
+def test_fallo_de_consolidados_no_duplica_eventos(crear, monkeypatch):
+    almacen = crear()
+    compartido = LibroCompartido(almacen, intervalo_escritura=3600)
+    try:
+        compartido.registrar(tasa('2024-01-01'))
+        # Meses cerrados: quedan consolidados por guardar junto con el lote
+        compartido.registrar(venta('2024-01-15'))
+        compartido.registrar(venta('2024-02-15'))
+        llamadas = fallar_una_vez(monkeypatch, almacen, 'guardar_consolidados')
+        assert compartido.guardar_pendientes() == 3
+        assert compartido.estado_escritura()['error'] == "disco lleno"
+
+        # Se reintentan solo los consolidados; los eventos ya estaban guardados
+        assert compartido.guardar_pendientes() == 0
+        assert len(llamadas) == 2
+        assert compartido.estado_escritura()['error'] is None
+    finally:
+        compartido.cerrar()
+
+    libro = Libro.desde_almacen(crear())
+    libro.asegurar_rango()
+    assert libro.ventas['id'].tolist() == [1, 2]
+    assert set(libro.consolidados.meses) >= {'2024-01', '2024-02'}
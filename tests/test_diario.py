@@ -0,0 +1,65 @@
+"""Reproducción del diario de eventos después de un corte"""
+from almacenamiento import AlmacenJSON, cargar_datos, compactar, leer_diario, ruta_diario
+from libro import Libro
+
+
+def tasa(fecha, valor=36.0):
+    return {'evento': 'tasa_agregada', 'tasa': {'fecha': fecha, 'tasa': valor}}
+
+
+def venta(id_venta, fecha='2024-03-01', total_bs=100.0):
+    return {'evento': 'venta_agregada', 'venta': {
+        'id': id_venta, 'fecha': fecha, 'punto_venta_bs': total_bs, 'dolar_cash_bs': 0.0,
+        'venta_externa_bs': 0.0, 'bs_cash_bs': 0.0, 'total_bs': total_bs,
+        'total_usd': total_bs / 36.0, 'descripcion': '', 'tasa_cambio': 36.0
+    }}
+
+
+def registrar(ruta, eventos):
+    almacen = AlmacenJSON(ruta)
+    with almacen.bloqueo():
+        almacen.cargar()
+        return almacen.registrar_lote(eventos)
+
+
+def cortar_ultima_linea(ruta, bytes_restantes=20):
+    """Simular un corte a mitad de la escritura del último evento"""
+    diario = ruta_diario(ruta)
+    with open(diario, 'rb') as f:
+        contenido = f.read()
+    ultima = contenido.rstrip(b"\n").rfind(b"\n") + 1
+    with open(diario, 'wb') as f:
+        f.write(contenido[:ultima + bytes_restantes])
+
+
+def test_linea_cortada_se_ignora(tmp_path):
+    ruta = str(tmp_path / "balance_data.json")
+    registrar(ruta, [tasa('2024-03-01'), venta(1), venta(2)])
+    cortar_ultima_linea(ruta)
+
+    datos = cargar_datos(ruta)
+    assert [v['id'] for v in datos['ventas']] == [1]
+    assert datos['seq'] == 2
+
+
+def test_escritura_despues_del_corte_no_se_pierde(tmp_path):
+    ruta = str(tmp_path / "balance_data.json")
+    registrar(ruta, [tasa('2024-03-01'), venta(1), venta(2)])
+    cortar_ultima_linea(ruta)
+
+    guardados = registrar(ruta, [venta(3)])
+    assert guardados[0]['seq'] == 3
+    assert [e['seq'] for e in leer_diario(ruta)] == [1, 2, 3]
+    assert [v['id'] for v in cargar_datos(ruta)['ventas']] == [1, 3]
+
+
+def test_compactar_despues_del_corte(tmp_path):
+    ruta = str(tmp_path / "balance_data.json")
+    registrar(ruta, [tasa('2024-03-01'), venta(1), venta(2)])
+    cortar_ultima_linea(ruta)
+    compactar(ruta)
+
+    assert leer_diario(ruta) == []
+    libro = Libro.desde_almacen(AlmacenJSON(ruta))
+    assert libro.ventas['id'].tolist() == [1]
+    assert libro.seq == 2
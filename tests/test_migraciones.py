@@ -0,0 +1,72 @@
+"""Migración de archivos de la versión 0 del esquema (sin 'schema_version')"""
+import json
+
+import pytest
+
+from almacenamiento import (AlmacenJSON, ESQUEMA_VERSION, cargar_datos, guardar_datos, leer_json,
+                            migrar_datos)
+from libro import Libro
+
+
+def datos_v0():
+    """Formato original: sin versión, sin IDs, sin seq y gastos sin estado de pago"""
+    return {
+        'ventas': [
+            {'fecha': '2023-05-01', 'punto_venta_bs': 100.0, 'dolar_cash_bs': 0.0, 'venta_externa_bs': 0.0,
+             'bs_cash_bs': 0.0, 'total_bs': 100.0, 'total_usd': 4.0, 'descripcion': '', 'tasa_cambio': 25.0},
+            {'id': 7, 'fecha': '2023-05-02', 'punto_venta_bs': 50.0, 'dolar_cash_bs': 0.0,
+             'venta_externa_bs': 0.0, 'bs_cash_bs': 0.0, 'total_bs': 50.0, 'total_usd': 2.0,
+             'descripcion': '', 'tasa_cambio': 25.0},
+        ],
+        'gastos': [
+            {'fecha': '2023-05-01', 'clasificacion': 'Gastos Venta', 'descripcion': 'bolsas',
+             'monto_bs': 25.0, 'monto_usd': 1.0, 'tasa_cambio': 25.0},
+            {'fecha': '2023-05-03', 'clasificacion': 'Gastos Nómina', 'descripcion': 'quincena',
+             'monto_bs': 75.0, 'monto_usd': 3.0, 'tasa_cambio': 25.0, 'pagado': True},
+        ],
+        'tasas_cambio': [{'fecha': '2023-05-01', 'tasa': 25.0}],
+    }
+
+
+def test_migrar_datos_v0():
+    datos = datos_v0()
+    assert migrar_datos(datos) == list(range(1, ESQUEMA_VERSION + 1))
+    assert datos['schema_version'] == ESQUEMA_VERSION
+    assert datos['seq'] == 0
+
+    # Los registros sin ID se numeran por encima de los existentes
+    assert [v['id'] for v in datos['ventas']] == [8, 7]
+    assert [g['id'] for g in datos['gastos']] == [1, 2]
+    assert datos['ultimo_id'] == {'ventas': 8, 'gastos': 2}
+
+    assert [g['pagado'] for g in datos['gastos']] == [False, True]
+    assert 'fecha_pago' not in datos['gastos'][0]
+    assert datos['gastos'][1]['fecha_pago'] == '2023-05-03'
+
+    # Con los datos al día no se aplica nada
+    assert migrar_datos(datos) == []
+
+
+def test_archivo_v0_se_migra_en_memoria(tmp_path):
+    ruta = str(tmp_path / "balance_data.json")
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(datos_v0(), f, indent=2)
+
+    datos = cargar_datos(ruta)
+    assert datos['schema_version'] == ESQUEMA_VERSION
+    assert 'schema_version' not in leer_json(ruta)
+
+    libro = Libro.desde_almacen(AlmacenJSON(ruta))
+    assert sorted(libro.ventas['id'].tolist()) == [7, 8]
+    assert libro.gastos['pagado'].tolist() == [False, True]
+
+    guardar_datos(datos, ruta)
+    assert leer_json(ruta)['schema_version'] == ESQUEMA_VERSION
+    assert cargar_datos(ruta) == datos
+
+
+def test_version_futura_se_rechaza():
+    datos = datos_v0()
+    datos['schema_version'] = ESQUEMA_VERSION + 1
+    with pytest.raises(ValueError):
+        migrar_datos(datos)
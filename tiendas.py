@@ -0,0 +1,206 @@
+"""Balance consolidado de varias tiendas, cada una con su propio almacenamiento
+
+Cada tienda es un subdirectorio de BALANCE_TIENDAS con su balance_data.json (o .db).
+El resumen de cada tienda se calcula en paralelo y después se suman: con hilos
+para los libros que ya están en memoria y con procesos que cargan cada una de
+las demás tiendas por su cuenta (la carga es lo que más CPU consume). Solo vuelve
+al proceso que consolida el resumen de cada tienda, no su libro.
+
+Uso desde la terminal:
+    python tiendas.py --desde 2024-01-01 --hasta 2024-01-31
+    python tiendas.py --directorio tiendas --almacen sqlite --procesos 8 --json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import pandas as pd
+
+import contabilidad
+from almacenamiento import ENV_ALMACEN, crear_almacen, listar_tiendas, ruta_tienda
+from consolidados import CANALES_VENTA
+from contabilidad import Fecha, Totales
+from libro import CacheConsultas, Libro
+
+# Hilos para los libros en memoria: el trabajo por tienda es corto y en gran parte NumPy
+MAX_HILOS = 32
+
+
+@dataclass
+class ResumenTienda:
+    """Lo que se muestra de una tienda en un período; se puede sumar con el de otras"""
+    totales: Totales
+    canales: Dict[str, float]
+    clasificacion: pd.DataFrame
+    registros: int = 0
+
+
+@dataclass
+class Consolidado:
+    """Resumen de cada tienda, su suma y las tiendas que no se pudieron leer"""
+    tiendas: Dict[str, ResumenTienda]
+    total: ResumenTienda
+    errores: Dict[str, str] = field(default_factory=dict)
+
+    def tabla(self) -> pd.DataFrame:
+        """Una fila por tienda con sus totales"""
+        filas = [dict(tienda=nombre, **resumen.totales) for nombre, resumen in self.tiendas.items()]
+        return pd.DataFrame(filas, columns=['tienda'] + list(Totales.__annotations__))
+
+
+def resumen_tienda(libro: Libro, fecha_inicio: Optional[Fecha] = None,
+                   fecha_fin: Optional[Fecha] = None) -> ResumenTienda:
+    """Totales, ventas por canal y gastos por clasificación de un libro en un período"""
+    return ResumenTienda(
+        totales=contabilidad.resumen_periodo(libro, fecha_inicio, fecha_fin),
+        canales=contabilidad.ventas_por_canal(libro, fecha_inicio, fecha_fin),
+        clasificacion=contabilidad.resumen_por_clasificacion(libro, fecha_inicio, fecha_fin),
+        registros=len(libro.ventas) + len(libro.gastos)
+    )
+
+
+def _resumen_compartido(compartido, fecha_inicio, fecha_fin):
+    """resumen_tienda de un libro compartido, poniéndolo al día (o cargándolo) antes"""
+    return resumen_tienda(compartido.obtener(), fecha_inicio, fecha_fin)
+
+
+def _resumen_desde_almacen(tipo, ruta, fecha_inicio, fecha_fin):
+    """resumen_tienda cargando el libro en el proceso que lo calcula"""
+    almacen = crear_almacen(tipo, ruta)
+    # Con el bloqueo, para no leer el snapshot a medio compactar por otro proceso
+    with almacen.bloqueo():
+        libro = Libro.desde_almacen(almacen)
+    return resumen_tienda(libro, fecha_inicio, fecha_fin)
+
+
+def sumar(resumenes) -> ResumenTienda:
+    """Suma de varios resúmenes (totales, canales y clasificaciones)"""
+    resumenes = list(resumenes)
+    totales = dict.fromkeys(Totales.__annotations__, 0.0)
+    canales = dict.fromkeys(CANALES_VENTA, 0.0)
+    for resumen in resumenes:
+        for clave in totales:
+            totales[clave] += resumen.totales[clave]
+        for canal in canales:
+            canales[canal] += resumen.canales.get(canal, 0.0)
+
+    marcos = [r.clasificacion for r in resumenes if not r.clasificacion.empty]
+    if marcos:
+        unidos = pd.concat(marcos, ignore_index=True)
+        clasificacion = unidos.groupby('clasificacion', observed=True, sort=True).sum(numeric_only=True).reset_index()
+    else:
+        clasificacion = resumenes[0].clasificacion if resumenes else pd.DataFrame()
+    return ResumenTienda(totales, canales, clasificacion, sum(r.registros for r in resumenes))
+
+
+def _consolidar(*lotes, previos=None) -> Consolidado:
+    """Ejecutar los lotes ((ejecutor, {tienda: (función, *argumentos)})) a la vez y sumar los resúmenes
+
+    `previos` son resúmenes ya calculados ({tienda: ResumenTienda}) que se suman sin recalcular.
+    """
+    resumenes, errores, futuros = dict(previos or {}), {}, {}
+    with ExitStack() as ejecutores:
+        for ejecutor, tareas in lotes:
+            ejecutores.enter_context(ejecutor)
+            futuros.update({ejecutor.submit(*tarea): tienda for tienda, tarea in tareas.items()})
+        for futuro in as_completed(futuros):
+            tienda = futuros[futuro]
+            try:
+                resumenes[tienda] = futuro.result()
+            except Exception as error:
+                # Una tienda dañada no impide ver las demás
+                errores[tienda] = f"{type(error).__name__}: {error}"
+    resumenes = {tienda: resumenes[tienda] for tienda in sorted(resumenes)}
+    return Consolidado(resumenes, sumar(resumenes.values()), errores)
+
+
+def _lote_hilos(tareas):
+    hilos = min(MAX_HILOS, max(1, len(tareas)))
+    return ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="consolidado"), tareas
+
+
+def _tareas_en_memoria(compartidos, fecha_inicio, fecha_fin):
+    return {tienda: (_resumen_compartido, compartido, fecha_inicio, fecha_fin)
+            for tienda, compartido in compartidos.items()}
+
+
+def _tareas_desde_almacenes(tiendas, fecha_inicio, fecha_fin, tipo, directorio):
+    tipo = tipo or os.environ.get(ENV_ALMACEN, "json")
+    return {tienda: (_resumen_desde_almacen, tipo, ruta_tienda(tienda, tipo, directorio), fecha_inicio, fecha_fin)
+            for tienda in tiendas}
+
+
+def consolidar_desde_almacenes(fecha_inicio: Optional[Fecha] = None, fecha_fin: Optional[Fecha] = None,
+                               tipo: Optional[str] = None, directorio: Optional[str] = None,
+                               procesos: Optional[int] = None) -> Consolidado:
+    """Balance consolidado leyendo cada tienda desde disco, con un proceso por núcleo"""
+    tareas = _tareas_desde_almacenes(listar_tiendas(directorio), fecha_inicio, fecha_fin, tipo, directorio)
+    return _consolidar((ProcessPoolExecutor(max_workers=procesos), tareas))
+
+
+def consolidar(compartidos, fecha_inicio: Optional[Fecha] = None, fecha_fin: Optional[Fecha] = None,
+               tipo: Optional[str] = None, directorio: Optional[str] = None,
+               procesos: Optional[int] = None, cache: Optional[CacheConsultas] = None) -> Consolidado:
+    """Balance consolidado de todas las tiendas sin dejar sus libros en memoria
+
+    Las tiendas de `compartidos` ({tienda: LibroCompartido}, las que el proceso
+    ya tiene cargadas y quizás con eventos aún sin guardar) se resumen con hilos;
+    las demás, con procesos que las leen desde disco y se descartan al terminar.
+    Con `cache`, el resumen de una tienda en disco se reutiliza mientras no cambie
+    la versión de su almacenamiento, y los procesos solo se crean si falta alguno.
+    """
+    lotes = [_lote_hilos(_tareas_en_memoria(compartidos, fecha_inicio, fecha_fin))]
+    en_disco = [tienda for tienda in listar_tiendas(directorio) if tienda not in compartidos]
+    tareas = _tareas_desde_almacenes(en_disco, fecha_inicio, fecha_fin, tipo, directorio)
+    previos, claves = {}, {}
+    if cache is not None:
+        for tienda, (_, tipo_tienda, ruta, *_) in list(tareas.items()):
+            # La versión se lee antes de cargar: si la tienda cambia mientras tanto, la próxima vez no coincide
+            claves[tienda] = (tienda, crear_almacen(tipo_tienda, ruta).version(), fecha_inicio, fecha_fin)
+            resumen = cache.buscar(claves[tienda])
+            if resumen is not None:
+                previos[tienda] = resumen
+                del tareas[tienda]
+    if tareas:
+        # spawn: el proceso que consolida puede tener hilos (el servidor de la app) y fork no es seguro
+        lotes.append((ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn')),
+                      tareas))
+    consolidado = _consolidar(*lotes, previos=previos)
+    if cache is not None:
+        for tienda in tareas.keys() & consolidado.tiendas.keys():
+            cache.guardar(claves[tienda], consolidado.tiendas[tienda])
+    return consolidado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Balance consolidado de todas las tiendas")
+    parser.add_argument("--directorio", default=None, help="directorio de las tiendas (BALANCE_TIENDAS)")
+    parser.add_argument("--almacen", choices=["json", "sqlite"], default=None)
+    parser.add_argument("--desde", default=None)
+    parser.add_argument("--hasta", default=None)
+    parser.add_argument("--procesos", type=int, default=None, help="procesos en paralelo (por defecto, uno por núcleo)")
+    parser.add_argument("--json", action="store_true", help="salida en JSON")
+    args = parser.parse_args()
+
+    consolidado = consolidar_desde_almacenes(args.desde, args.hasta, args.almacen, args.directorio, args.procesos)
+    if args.json:
+        print(json.dumps({
+            'tiendas': {nombre: r.totales for nombre, r in consolidado.tiendas.items()},
+            'total': consolidado.total.totales,
+            'canales': consolidado.total.canales,
+            'errores': consolidado.errores
+        }, ensure_ascii=False))
+        return
+    print(consolidado.tabla().to_string(index=False, float_format=lambda x: f"{x:,.2f}"))
+    print(json.dumps(consolidado.total.totales, ensure_ascii=False, indent=2))
+    for tienda, error in consolidado.errores.items():
+        print(f"⚠️ {tienda}: {error}")
+
+
+if __name__ == "__main__":
+    main()